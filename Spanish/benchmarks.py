@@ -0,0 +1,1438 @@
+"""
+Benchmarks for the translator pipeline
+**************************************
+Run from the Spanish folder, e.g.::
+
+    python benchmarks.py normalize
+    python benchmarks.py transe
+    python benchmarks.py lookup
+    python benchmarks.py parallel
+    python benchmarks.py decode
+    python benchmarks.py lengths
+    python benchmarks.py subword
+    python benchmarks.py softmax
+    python benchmarks.py vocab
+    python benchmarks.py cache
+    python benchmarks.py serve
+    python benchmarks.py export
+    python benchmarks.py imports
+    python benchmarks.py sampler
+    python benchmarks.py preprocess
+    python benchmarks.py precision
+
+``suite`` times every stage of the pipeline on the bundled corpora and
+synthetic data and writes the results, with the environment, to a JSON
+file; ``compare`` checks such a file against a stored baseline::
+
+    python benchmarks.py suite --output baseline.json
+    python benchmarks.py suite --output current.json --baseline baseline.json
+    python benchmarks.py compare baseline.json current.json
+
+``imports`` is the gate for import cost: it exits non-zero when a module
+fails to import, prints on import, pulls in a heavy optional dependency
+or goes over its time budget, so run it before committing changes to
+module-level imports.
+"""
+import argparse
+import time
+
+
+def corpusSentences(path):
+    sentences = []
+    with open(path, 'r', encoding="utf8") as lines:
+        for line in lines:
+            head, sep, tail = line.partition('\tCC-BY')
+            sentences.extend(head.split('\t'))
+    return sentences
+
+
+def bestOf(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+######################################################################
+# normalizeString
+# ---------------
+#
+# Checks that the fast ``normalizeString`` gives byte-identical output to
+# the original on every sentence of the corpus, then times both.
+#
+
+def benchNormalize(args):
+    from normalization import (referenceNormalizeString, normalizeString,
+                               cachedNormalizer)
+
+    sentences = corpusSentences(args.path)
+    mismatches = [s for s in sentences
+                  if normalizeString(s).encode() != referenceNormalizeString(s).encode()]
+    print("%d sentences, %d mismatches" % (len(sentences), len(mismatches)))
+    for s in mismatches[:5]:
+        print("  %r: %r != %r" % (s, normalizeString(s), referenceNormalizeString(s)))
+
+    reference = bestOf(lambda: [referenceNormalizeString(s) for s in sentences], args.repeat)
+    fast = bestOf(lambda: [normalizeString(s) for s in sentences], args.repeat)
+    cached = cachedNormalizer()
+    cached_time = bestOf(lambda: [cached(s) for s in sentences], args.repeat)
+    print("reference %.3fs, fast %.3fs (%.1fx), cached %.3fs (%.1fx)" % (
+        reference, fast, reference / fast, cached_time, reference / cached_time))
+    return not mismatches
+
+
+######################################################################
+# TransE training
+# ---------------
+#
+# The one-triple-per-step loop the script used to run against the batched
+# ``trainTransE``, on the same synthetic translation graph (no Neo4j).
+#
+
+def syntheticTriples(n_triples, n_entities, n_relations=1, seed=0):
+    import torch
+    generator = torch.Generator().manual_seed(seed)
+    heads = torch.randint(n_entities // 2, (n_triples,), generator=generator)
+    tails = torch.randint(n_entities // 2, n_entities, (n_triples,), generator=generator)
+    relations = torch.randint(n_relations, (n_triples,), generator=generator)
+    return torch.stack((heads, relations, tails), 1)
+
+
+def perTripleEpoch(model, triples, optimizer, criterion):
+    import numpy as np
+    import torch
+    num_entities = model.entity_embeddings.num_embeddings
+    for head, relation, tail in triples.tolist():
+        optimizer.zero_grad()
+        positive_score = model.forward(torch.LongTensor([head]), torch.LongTensor([relation]), torch.LongTensor([tail]))
+        corrupted_tail = np.random.choice(num_entities, size=1)[0]
+        negative_score = model.forward(torch.LongTensor([head]), torch.LongTensor([relation]), torch.LongTensor([corrupted_tail]))
+        loss = criterion(positive_score, negative_score, torch.tensor([-1]))
+        loss.backward()
+        optimizer.step()
+
+
+def benchTransE(args):
+    import torch
+    from transe import TransE, trainTransE
+
+    triples = syntheticTriples(args.triples, args.entities)
+    model = TransE(args.entities, 1, 50)
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.01)
+    criterion = torch.nn.MarginRankingLoss(margin=1.0)
+    looped = min(len(triples), args.loop_triples)
+    per_triple = bestOf(lambda: perTripleEpoch(model, triples[:looped], optimizer, criterion), 1)
+    print("per-triple loop: %.0f triples/s" % (looped / per_triple))
+
+    batched = bestOf(lambda: trainTransE(model, triples, 1, batch_size=args.batch_size,
+                                         print_every=1), args.repeat)
+    print("batched (%d): %.0f triples/s (%.1fx)" % (
+        args.batch_size, len(triples) / batched, per_triple / looped * len(triples) / batched))
+
+
+######################################################################
+# Nearest-word lookup
+# -------------------
+#
+# Queries/s of the TransE word lookup at several vocabulary sizes: the
+# old per-query loop (distance to every row, then a list scan to find the
+# word), exact batched search, and the approximate IVF index with its
+# recall against the exact answer.
+#
+
+def perQueryLookup(embeddings, entity2idx, word):
+    import torch
+    spanish_idx = entity2idx[word]
+    distances = torch.norm(embeddings[spanish_idx] - embeddings, p=2, dim=1)
+    distances[spanish_idx] = float('inf')
+    closest_idx = torch.argmin(distances)
+    return list(entity2idx.keys())[list(entity2idx.values()).index(closest_idx)]
+
+
+def benchLookup(args):
+    import numpy as np
+    import torch
+    from wordlookup import WordLookup
+
+    rng = np.random.default_rng(0)
+    for size in args.sizes:
+        embeddings = rng.standard_normal((size, 50)).astype(np.float32)
+        entity2idx = {'w%d' % i: i for i in range(size)}
+        english_ids = np.arange(size // 2, size)
+        queries = ['w%d' % i for i in rng.integers(0, size // 2, args.queries)]
+        lookup = WordLookup(embeddings, entity2idx, english_ids)
+
+        looped = queries[:args.loop_queries]
+        tensor = torch.from_numpy(embeddings)
+        loop_time = bestOf(lambda: [perQueryLookup(tensor, entity2idx, w) for w in looped], 1)
+        exact_time = bestOf(lambda: lookup.nearest(queries, k=args.k), args.repeat)
+        line = "%7d words: loop %8.0f q/s, exact %8.0f q/s" % (
+            size, len(looped) / loop_time, len(queries) / exact_time)
+
+        if size >= args.ivf_min_size:
+            build_time = bestOf(lambda: lookup.buildIVF(nprobe=args.nprobe), 1)
+            ivf_time = bestOf(lambda: lookup.nearest(queries, k=args.k, approximate=True), args.repeat)
+            exact = lookup.nearest(queries, k=1)
+            approximate = lookup.nearest(queries, k=1, approximate=True)
+            recall = np.mean([e[0][0] == a[0][0] for e, a in zip(exact, approximate)])
+            line += ", ivf %8.0f q/s (recall@1 %.2f, built in %.1fs)" % (
+                len(queries) / ivf_time, recall, build_time)
+        print(line)
+
+
+######################################################################
+# Data-parallel training
+# ----------------------
+#
+# Sentences/s of ``trainParallel`` on the prepared corpus with 1, 2, 4
+# and 8 workers, each on a fresh copy of the same model and with the same
+# per-worker batch size, and the speedup and efficiency relative to one
+# worker. Worker counts above the number of cores are skipped.
+#
+
+def benchParallel(args):
+    import os
+    import torch
+    from corpus import prepareData
+    from seq2seq import EncoderRNN, AttnDecoderRNN
+    from parallel import trainParallel
+
+    input_lang, output_lang, pairs = prepareData('eng', 'spa', True, path=args.path)
+    cores = os.cpu_count()
+    threads = torch.get_num_threads()
+    baseline = None
+    for workers in args.workers:
+        if workers > cores:
+            print("%d workers: skipped, %d cores" % (workers, cores))
+            continue
+        torch.manual_seed(0)
+        encoder = EncoderRNN(input_lang.n_words, args.hidden_size)
+        decoder = AttnDecoderRNN(args.hidden_size, output_lang.n_words)
+        # The same number of sentences for every worker count
+        n_iters = max(1, args.sentences // (args.batch_size * workers))
+        result = trainParallel(encoder, decoder, pairs, input_lang, output_lang, n_iters, workers,
+                               print_every=n_iters, plot_every=n_iters, batch_size=args.batch_size)
+        torch.set_num_threads(threads)
+        rate = result['sentences'] / result['seconds']
+        baseline = baseline or rate
+        print("%d workers: %8.0f sentences/s, %8.0f tokens/s, speedup %.2fx, efficiency %.0f%%" % (
+            workers, rate, result['tokens'] / result['seconds'], rate / baseline,
+            100 * rate / baseline / workers))
+
+
+######################################################################
+# Decoding latency
+# ----------------
+#
+# Per-token latency of greedy decoding with the attention decoder, one
+# sentence at a time like ``evaluate``: passing the zero-padded
+# ``max_length`` encoder buffer on every step, which recomputes
+# ``fc_encoder`` over all of it, against attention keys computed once
+# for the real source words. Every sentence decodes ``max_length`` steps
+# so both sides do the same number of tokens.
+#
+
+def decodeSteps(decoder, encoder_hidden, encoder_outputs, steps):
+    import torch
+    from corpus import SOS_token
+    decoder_input = torch.tensor([[SOS_token]])
+    decoder_hidden = encoder_hidden
+    for di in range(steps):
+        decoder_output, decoder_hidden, decoder_attention = decoder(
+            decoder_input, decoder_hidden, encoder_outputs)
+        decoder_input = decoder_output.argmax(dim=1).detach()
+
+
+def benchDecode(args):
+    import random
+    import torch
+    from corpus import prepareData
+    from seq2seq import EncoderRNN, AttnDecoderRNN, tensorFromIndexes
+
+    input_lang, output_lang, pairs = prepareData('eng', 'spa', True, path=args.path)
+    torch.manual_seed(0)
+    encoder = EncoderRNN(input_lang.n_words, args.hidden_size).eval()
+    decoder = AttnDecoderRNN(args.hidden_size, output_lang.n_words, max_length=args.max_length).eval()
+
+    random.seed(0)
+    encoded = []
+    with torch.no_grad():
+        for i in random.sample(range(len(pairs)), min(args.sentences, len(pairs))):
+            input_tensor = tensorFromIndexes(pairs.indexes(i)[0])
+            length = torch.tensor([input_tensor.size(0)])
+            outputs, hidden = encoder(input_tensor, encoder.initHidden(), length)
+            buffer = torch.zeros(args.max_length, args.hidden_size)
+            buffer[:input_tensor.size(0)] = outputs[0]
+            encoded.append((hidden, buffer, input_tensor.size(0)))
+
+    def padded():
+        for hidden, buffer, length in encoded:
+            decodeSteps(decoder, hidden, buffer, args.max_length)
+
+    def cached():
+        for hidden, buffer, length in encoded:
+            decodeSteps(decoder, hidden, decoder.encoderKeys(buffer[:length]), args.max_length)
+
+    n_tokens = len(encoded) * args.max_length
+    with torch.no_grad():
+        before = bestOf(padded, args.repeat)
+        after = bestOf(cached, args.repeat)
+    print("%d sentences, %d tokens: padded buffer %.1f us/token, precomputed keys %.1f us/token (%.2fx)" % (
+        len(encoded), n_tokens, before / n_tokens * 1e6, after / n_tokens * 1e6, before / after))
+
+
+######################################################################
+# Sentence length limits
+# ----------------------
+#
+# How many pairs of the corpus each ``max_length`` keeps, and what a
+# kept sentence costs: milliseconds per sentence for batched training
+# steps (length-bucketed, so short sentences are not padded to the
+# limit) and for greedy translation with ``translate_batch``.
+#
+
+def benchLengths(args):
+    import random
+    import numpy as np
+    import torch
+    from corpus import prepareData, readPairs
+    from seq2seq import EncoderRNN, AttnDecoderRNN
+    from training import iterBatches, trainBatch
+    from inference import translate_batch
+
+    total = sum(1 for pair in readPairs(args.path, True, max_length=None))
+    for cap in args.caps:
+        cap = None if cap <= 0 else cap
+        input_lang, output_lang, pairs = prepareData('eng', 'spa', True, path=args.path, max_length=cap)
+        random.seed(0)
+        np.random.seed(0)
+        torch.manual_seed(0)
+        encoder = EncoderRNN(input_lang.n_words, args.hidden_size)
+        decoder = AttnDecoderRNN(args.hidden_size, output_lang.n_words)
+        encoder_optimizer = torch.optim.SGD(encoder.parameters(), lr=0.01)
+        decoder_optimizer = torch.optim.SGD(decoder.parameters(), lr=0.01)
+
+        batches = iterBatches(pairs, args.batch_size)
+        trainBatch(*next(batches), encoder, decoder, encoder_optimizer, decoder_optimizer)  # warm up
+        steps = [next(batches) for _ in range(args.batches)]
+        start = time.perf_counter()
+        for step in steps:
+            trainBatch(*step, encoder, decoder, encoder_optimizer, decoder_optimizer)
+        train_time = (time.perf_counter() - start) / sum(step[0].size(1) for step in steps)
+
+        sample = [pairs[i][0] for i in random.sample(range(len(pairs)), min(args.sentences, len(pairs)))]
+        longest = int(pairs.lengths()[0].max()) + 1
+        start = time.perf_counter()
+        translate_batch(encoder, decoder, input_lang, output_lang, sample,
+                        max_length=longest, report=False)
+        translate_time = (time.perf_counter() - start) / len(sample)
+
+        print("max_length %4s: %6d pairs (%5.1f%%), mean %.1f words, "
+              "train %.2f ms/sentence, translate %.2f ms/sentence" % (
+                  cap or 'none', len(pairs), 100 * len(pairs) / total,
+                  pairs.lengths()[0].mean(), train_time * 1e3, translate_time * 1e3))
+
+
+######################################################################
+# Subword vocabularies
+# --------------------
+#
+# Whole-word ``Lang`` against BPE ``SubwordLang`` at several sizes, both
+# built from the first 90% of the corpus pairs: vocabulary size, how
+# many held-out Spanish sentences hit an unknown word (and would not be
+# translated), pieces per sentence, BPE training and encoding speed, and
+# the cost of the decoder's output layer (projection plus log-softmax)
+# per token at that vocabulary size.
+#
+
+def benchSubword(args):
+    import torch
+    from corpus import Lang, readPairs
+    from subword import SubwordLang
+
+    pairs = list(readPairs(args.path, True))
+    split = int(len(pairs) * 0.9)
+    lang = Lang('spa')
+    for pair in pairs[:split]:
+        lang.addSentence(pair[0])
+    held_out = [pair[0] for pair in pairs[split:]]
+
+    def outputLayer(n_words):
+        layer = torch.nn.Linear(args.hidden_size, n_words)
+        hidden = torch.randn(1, args.hidden_size)
+        with torch.no_grad():
+            step = bestOf(lambda: [torch.log_softmax(layer(hidden), dim=1) for _ in range(100)],
+                          args.repeat)
+        return step / 100 * 1e6
+
+    unknown = sum(any(word not in lang.word2index for word in sentence.split(' '))
+                  for sentence in held_out)
+    print("words   %6d entries, %4d/%d held-out sentences with unknown words, "
+          "%.1f tokens/sentence, output layer %.0f us/token" % (
+              lang.n_words, unknown, len(held_out),
+              sum(len(s.split(' ')) for s in held_out) / len(held_out), outputLayer(lang.n_words)))
+
+    for size in args.sizes:
+        start = time.perf_counter()
+        subwords = SubwordLang.train('spa', lang.word2count, size)
+        train_time = time.perf_counter() - start
+        start = time.perf_counter()
+        encoded = [subwords.encode(sentence) for sentence in held_out]
+        encode_time = time.perf_counter() - start
+        # A word is only lost if none of its characters are in the vocabulary
+        unknown = sum(any(not subwords.encodeWord(word) for word in sentence.split(' ') if word)
+                      for sentence in held_out)
+        print("bpe     %6d entries, %4d/%d held-out sentences with unknown words, "
+              "%.1f tokens/sentence, output layer %.0f us/token, "
+              "trained in %.1fs, encodes %.0f sentences/s" % (
+                  subwords.n_words, unknown, len(held_out),
+                  sum(map(len, encoded)) / len(encoded), outputLayer(subwords.n_words),
+                  train_time, len(held_out) / encode_time))
+
+
+######################################################################
+# Output layer
+# ------------
+#
+# Training step time of the attention decoder (one decoding step for a
+# batch, loss and backward) with the full softmax against the adaptive
+# softmax, at growing vocabulary sizes. Word frequencies and targets
+# follow Zipf's law, like a real vocabulary; ``exact`` is the time of
+# the full log-probabilities that evaluation and beam search use.
+#
+
+def benchSoftmax(args):
+    import numpy as np
+    import torch
+    from seq2seq import AttnDecoderRNN, adaptiveCutoffs
+
+    rng = np.random.default_rng(0)
+    for n_words in args.sizes:
+        # The word of frequency rank r is words[r]
+        words = rng.permutation(n_words)
+        counts = np.zeros(n_words, dtype=np.int64)
+        counts[words] = 1e6 / np.arange(1, n_words + 1)
+        targets = torch.from_numpy(words[np.minimum(rng.zipf(1.1, args.batch_size) - 1, n_words - 1)])
+
+        inputs = torch.randint(n_words, (args.batch_size,))
+        hidden = torch.zeros(1, args.batch_size, args.hidden_size)
+        encoder_outputs = torch.randn(args.batch_size, args.source_length, args.hidden_size)
+        line = "%7d words:" % n_words
+        for name, cutoffs in (('full', None), ('adaptive', adaptiveCutoffs(n_words))):
+            torch.manual_seed(0)
+            decoder = AttnDecoderRNN(args.hidden_size, n_words, adaptive_cutoffs=cutoffs,
+                                     word_counts=counts.tolist())
+
+            def trainStep():
+                output, _, _ = decoder.step(inputs, hidden, encoder_outputs)
+                (-decoder.targetLogProbs(output, targets).mean()).backward()
+
+            def exact():
+                with torch.no_grad():
+                    decoder(inputs, hidden, encoder_outputs)
+
+            step = bestOf(trainStep, args.repeat)
+            line += " %s %.2f ms/step (exact %.2f ms)" % (name, step * 1e3, bestOf(exact, args.repeat) * 1e3)
+            if name == 'full':
+                full = step
+        print(line + ", %.1fx" % (full / step))
+
+
+######################################################################
+# Vocabulary pruning
+# ------------------
+#
+# Vocabulary sizes, share of ``<UNK>`` tokens, parameter count and the
+# cost of a training step and of translating, with the full vocabulary
+# and with rare words pruned by ``min_count`` or ``max_words``. The
+# remap time is for pruning the cached token arrays.
+#
+
+def benchVocab(args):
+    import random
+    import numpy as np
+    import torch
+    from corpus import prepareData, prunePairs, UNK_token
+    from seq2seq import EncoderRNN, AttnDecoderRNN
+    from training import iterBatches, trainBatch
+    from inference import translate_batch
+
+    input_lang, output_lang, full = prepareData('eng', 'spa', True, path=args.path)
+    settings = [('full', None, None)] + [('min_count %d' % n, n, None) for n in args.min_counts] + \
+        [('max_words %d' % n, 1, n) for n in args.max_words]
+    for name, min_count, max_words in settings:
+        start = time.perf_counter()
+        pairs = full if min_count is None else prunePairs(full, min_count, max_words)
+        remap_time = time.perf_counter() - start
+        input_lang, output_lang = pairs.input_lang, pairs.output_lang
+        unknown = np.mean(pairs.inputs.ids == UNK_token) if min_count else 0.0
+
+        random.seed(0)
+        np.random.seed(0)
+        torch.manual_seed(0)
+        encoder = EncoderRNN(input_lang.n_words, args.hidden_size)
+        decoder = AttnDecoderRNN(args.hidden_size, output_lang.n_words)
+        n_params = sum(p.numel() for module in (encoder, decoder) for p in module.parameters())
+        encoder_optimizer = torch.optim.SGD(encoder.parameters(), lr=0.01)
+        decoder_optimizer = torch.optim.SGD(decoder.parameters(), lr=0.01)
+        batches = iterBatches(pairs, args.batch_size)
+        steps = [next(batches) for _ in range(args.batches + 1)]
+        trainBatch(*steps[0], encoder, decoder, encoder_optimizer, decoder_optimizer)  # warm up
+        step_time = bestOf(lambda: [trainBatch(*step, encoder, decoder, encoder_optimizer, decoder_optimizer)
+                                    for step in steps[1:]], 1) / args.batches
+
+        sample = [pairs[i][0] for i in random.sample(range(len(pairs)), args.sentences)]
+        translate_time = bestOf(lambda: translate_batch(encoder, decoder, input_lang, output_lang, sample,
+                                                        report=False), 1) / len(sample)
+        print("%-14s %5d/%5d words, %4.1f%% UNK, %5.1fM params, step %.1f ms, "
+              "translate %.2f ms/sentence, remap %.1f ms" % (
+                  name, input_lang.n_words, output_lang.n_words, 100 * unknown, n_params / 1e6,
+                  step_time * 1e3, translate_time * 1e3, remap_time * 1e3))
+
+
+######################################################################
+# Translation cache
+# -----------------
+#
+# Replays a stream of Spanish sentences, drawn with repeats from
+# ``--distinct`` corpus sentences, through ``translate_batch`` directly
+# and through a ``TranslationCache`` in batches: cold, then again with
+# everything in memory, then from a fresh cache that only has the SQLite
+# file. The cached translations must match the direct ones. A training
+# step has to invalidate the cache.
+#
+
+def benchCache(args):
+    import os
+    import random
+    import tempfile
+    import torch
+    from corpus import prepareData
+    from seq2seq import EncoderRNN, AttnDecoderRNN
+    from inference import translate_batch
+    from normalization import normalizeString
+    from training import iterBatches, trainBatch
+    from translationcache import TranslationCache
+
+    input_lang, output_lang, pairs = prepareData('eng', 'spa', True, path=args.path)
+    random.seed(0)
+    torch.manual_seed(0)
+    encoder = EncoderRNN(input_lang.n_words, args.hidden_size)
+    decoder = AttnDecoderRNN(args.hidden_size, output_lang.n_words)
+    # Traffic repeats itself: draw the stream from a smaller pool of inputs
+    pool = [pairs[i][0] for i in random.sample(range(len(pairs)), args.distinct)]
+    stream = [random.choice(pool) for _ in range(args.sentences)]
+    print("%d sentences, %d distinct" % (len(stream), len(set(stream))))
+
+    def translateNormalized(sentences):
+        results = translate_batch(encoder, decoder, input_lang, output_lang, sentences, report=False)
+        return [nbest[0][0] for nbest in results]
+
+    def replay(cache):
+        outputs = []
+        for k in range(0, len(stream), args.batch_size):
+            outputs.extend(cache.translate(stream[k:k + args.batch_size], translateNormalized))
+        return outputs
+
+    start = time.perf_counter()
+    direct = []
+    for k in range(0, len(stream), args.batch_size):
+        direct.extend(translateNormalized([normalizeString(s) for s in stream[k:k + args.batch_size]]))
+    timings = [('uncached', time.perf_counter() - start, None)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'translations.sqlite')
+        cache = TranslationCache(encoder, decoder, input_lang, output_lang,
+                                 capacity=args.capacity, path=path)
+        for name in ('cold', 'warm'):
+            start = time.perf_counter()
+            outputs = replay(cache)
+            timings.append((name, time.perf_counter() - start, dict(cache.stats())))
+        same = outputs == direct
+        cache.close()
+
+        cache = TranslationCache(encoder, decoder, input_lang, output_lang,
+                                 capacity=args.capacity, path=path)
+        start = time.perf_counter()
+        same = same and replay(cache) == direct
+        timings.append(('disk', time.perf_counter() - start, cache.stats()))
+
+        encoder_optimizer = torch.optim.SGD(encoder.parameters(), lr=0.01)
+        decoder_optimizer = torch.optim.SGD(decoder.parameters(), lr=0.01)
+        trainBatch(*next(iterBatches(pairs, 32)), encoder, decoder, encoder_optimizer, decoder_optimizer)
+        misses = cache.misses
+        cache.translate(stream[:1], translateNormalized)
+        invalidated = cache.misses == misses + 1 and cache.invalidations == 1
+        cache.close()
+
+    for name, seconds, stats in timings:
+        line = "%-9s %7.1f sentences/s" % (name, len(stream) / seconds)
+        if stats:
+            line += ", %(hits)d hits (%(disk_hits)d disk), %(misses)d misses, %(evictions)d evictions" % stats
+        print(line)
+    print("Cached translations match: %s; invalidated after a training step: %s" % (same, invalidated))
+    return same and invalidated
+
+
+######################################################################
+# Translation server
+# ------------------
+#
+# Load-tests ``server.py``: ``--clients`` concurrent keep-alive clients
+# each send ``--requests`` one-sentence translate requests, first with
+# batching off (``max_batch`` 1) and then with micro-batching, against an
+# untrained model on the prepared corpus with the cache off. Reports
+# requests/s, the latency the clients saw and the server's batch sizes.
+# With ``--url host:port`` it loads a server that is already running
+# instead.
+#
+
+def benchServe(args):
+    import asyncio
+    import random
+    import torch
+    from corpus import prepareData
+    from server import Client, TranslationServer, percentile
+
+    input_lang, output_lang, pairs = prepareData('eng', 'spa', True, path=args.path)
+    random.seed(0)
+    sentences = [pairs[random.randrange(len(pairs))][0] for _ in range(args.clients * args.requests)]
+
+    async def load(host, port):
+        latencies = []
+
+        async def client(k):
+            connection = Client(host, port)
+            for sentence in sentences[k::args.clients]:
+                start = time.perf_counter()
+                status, reply = await connection.request('POST', '/translate', {'sentences': [sentence]})
+                latencies.append(time.perf_counter() - start)
+                assert status == 200, reply
+            connection.close()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client(k) for k in range(args.clients)))
+        elapsed = time.perf_counter() - start
+        connection = Client(host, port)
+        status, stats = await connection.request('GET', '/stats')
+        connection.close()
+        return elapsed, latencies, stats['translate']
+
+    def report(name, elapsed, latencies, stats):
+        print("%-12s %6.1f requests/s, client p50 %6.1f ms, p99 %6.1f ms, mean batch %5.1f, "
+              "batches %s" % (name, len(latencies) / elapsed, percentile(latencies, 50) * 1e3,
+                              percentile(latencies, 99) * 1e3, stats['mean_batch_size'],
+                              stats['batch_size_histogram']))
+
+    if args.url:
+        host, _, port = args.url.rpartition(':')
+        report(args.url, *asyncio.run(load(host or '127.0.0.1', int(port))))
+        return
+
+    from seq2seq import EncoderRNN, AttnDecoderRNN
+    torch.manual_seed(0)
+    encoder = EncoderRNN(input_lang.n_words, args.hidden_size)
+    decoder = AttnDecoderRNN(args.hidden_size, output_lang.n_words)
+
+    async def run(max_batch):
+        server = TranslationServer(encoder, decoder, input_lang, output_lang,
+                                   max_batch=max_batch, max_delay=args.max_delay_ms / 1000)
+        port = await server.start(port=0)
+        try:
+            return await load('127.0.0.1', port)
+        finally:
+            await server.stop()
+
+    for name, max_batch in (('unbatched', 1), ('batched', args.max_batch)):
+        report(name, *asyncio.run(run(max_batch)))
+
+
+######################################################################
+# Exported models
+# ---------------
+#
+# Eager float32 ``translate_batch`` (greedy) against the TorchScript
+# exports of export.py, in float32, in int8 and in int8 with float32
+# embeddings, on a held-out slice of the corpus: milliseconds per
+# sentence in batches of 64 and one sentence at a time, file size, the
+# memory a fresh process gains by loading the model and translating one
+# sentence, and how many translations (and output tokens) agree with the
+# eager model. The model comes from ``--checkpoint`` or is trained for
+# ``--train-batches`` on the rest of the corpus first, since an untrained
+# model's outputs are too close to uniform to compare.
+#
+
+def rssAfterLoading(setup):
+    import os
+    import subprocess
+    import sys
+    code = ("import torch\n"
+            "def rss():\n"
+            "    with open('/proc/self/statm') as f:\n"
+            "        return int(f.read().split()[1])\n"
+            "before = rss()\n" + setup + "\nprint(rss() - before)")
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return int(output.stdout.split()[-1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def benchExport(args):
+    import os
+    import random
+    import tempfile
+    import numpy as np
+    import torch
+    from corpus import prepareData
+    from seq2seq import EncoderRNN, AttnDecoderRNN
+    from inference import translate_batch
+    from training import iterBatches, trainBatch
+    from checkpoint import loadCheckpoint, saveCheckpoint
+    from export import exportTranslator, loadExported
+
+    input_lang, output_lang, pairs = prepareData('eng', 'spa', True, path=args.path)
+    order = np.random.default_rng(0).permutation(len(pairs))
+    held_out = [pairs[i][0] for i in order[:args.sentences]]
+    if args.checkpoint:
+        state = loadCheckpoint(args.checkpoint, map_location='cpu')
+        encoder, decoder = state['encoder'], state['decoder']
+        input_lang, output_lang = state['input_lang'], state['output_lang']
+    else:
+        random.seed(0)
+        torch.manual_seed(0)
+        encoder = EncoderRNN(input_lang.n_words, args.hidden_size)
+        decoder = AttnDecoderRNN(args.hidden_size, output_lang.n_words)
+        encoder_optimizer = torch.optim.SGD(encoder.parameters(), lr=0.1)
+        decoder_optimizer = torch.optim.SGD(decoder.parameters(), lr=0.1)
+        batches = iterBatches(pairs, 32, order[args.sentences:])
+        start = time.perf_counter()
+        for _ in range(args.train_batches):
+            loss = trainBatch(*next(batches), encoder, decoder, encoder_optimizer, decoder_optimizer)
+        print("Trained %d batches in %.0fs, loss %.2f" % (args.train_batches, time.perf_counter() - start, loss))
+    encoder.eval()
+    decoder.eval()
+
+    def eager(sentences):
+        results = translate_batch(encoder, decoder, input_lang, output_lang, sentences, report=False)
+        return [nbest[0][0] for nbest in results]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        variants = [('eager fp32', eager, os.path.join(tmp, 'eager.pt'))]
+        saveCheckpoint(variants[0][2], encoder, decoder, input_lang, output_lang)
+        for name, quantize, embeddings in (('script fp32', False, False),
+                                           ('script int8', True, True),
+                                           ('int8 (fp32 emb)', True, False)):
+            path = os.path.join(tmp, '%s_%s.pt' % (quantize, embeddings))
+            exportTranslator(encoder, decoder, input_lang, output_lang, path, quantize, embeddings)
+            variants.append((name, loadExported(path).translate, path))
+
+        reference = None
+        for name, translate, path in variants:
+            with torch.no_grad():
+                outputs = [words for k in range(0, len(held_out), 64)
+                           for words in translate(held_out[k:k + 64])]
+                batched = bestOf(lambda: [translate(held_out[k:k + 64])
+                                          for k in range(0, len(held_out), 64)], args.repeat)
+                singles = held_out[:args.single]
+                single = bestOf(lambda: [translate([s]) for s in singles], args.repeat)
+            if reference is None:
+                reference = outputs
+            same = np.mean([a == b for a, b in zip(outputs, reference)])
+            tokens = np.mean([x == y for a, b in zip(outputs, reference)
+                              for x, y in zip(a + ['<EOS>'], b + ['<EOS>'])])
+            if name.startswith('eager'):
+                setup = ("from checkpoint import loadCheckpoint\nfrom inference import translate_batch\n"
+                         "s = loadCheckpoint(%r, map_location='cpu')\n"
+                         "translate_batch(s['encoder'], s['decoder'], s['input_lang'], s['output_lang'], "
+                         "[%r], report=False)" % (path, held_out[0]))
+            else:
+                setup = "m = torch.jit.load(%r)\nm.translate([%r])" % (path, held_out[0])
+            print("%-15s batched %5.2f ms/sentence, single %5.2f ms/sentence, file %5.1f MB, "
+                  "loaded +%5.1f MB RSS, agreement %5.1f%% sentences %5.1f%% tokens" % (
+                      name, batched / len(held_out) * 1e3, single / len(singles) * 1e3,
+                      os.path.getsize(path) / 2 ** 20, rssAfterLoading(setup), 100 * same, 100 * tokens))
+
+
+######################################################################
+# Import time
+# -----------
+#
+# Imports each module in a fresh interpreter and checks that it stays
+# cheap: no output, none of the heavy optional dependencies, and at most
+# ``--budget`` seconds on top of ``import torch`` (which every module
+# that builds a model pays anyway). knowledgegraph and plots must not
+# even import torch. This is the import-cost gate: it exits non-zero
+# when any module fails to import or breaks one of these rules.
+#
+
+HEAVY_MODULES = ('matplotlib', 'torchkge', 'py2neo', 'neo4j', 'pandas', 'tqdm')
+
+IMPORT_CHECKS = [
+    ('spanishTranslator', HEAVY_MODULES),
+    ('training', HEAVY_MODULES),
+    ('inference', HEAVY_MODULES),
+    ('server', HEAVY_MODULES),
+    ('export', HEAVY_MODULES),
+    ('telemetry', HEAVY_MODULES),
+    ('knowledgegraph', HEAVY_MODULES + ('torch',)),
+    ('plots', HEAVY_MODULES + ('torch',)),
+    ('preprocess', HEAVY_MODULES + ('torch',)),
+]
+
+
+def timeImport(module, preload, repeat):
+    import json
+    import subprocess
+    import sys
+    code = ("import json, sys, time\n%s\n"
+            "start = time.perf_counter()\nimport %s\nseconds = time.perf_counter() - start\n"
+            "print(json.dumps([seconds, sorted(m.split('.')[0] for m in sys.modules)]))"
+            % (preload, module))
+    best, output, loaded = float('inf'), '', []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+        if result.returncode != 0:
+            error = result.stderr.strip().splitlines()
+            return None, error[-1] if error else 'exit status %d' % result.returncode, set()
+        *printed, last = result.stdout.splitlines()
+        seconds, loaded = json.loads(last)
+        best = min(best, seconds)
+        output = '\n'.join(printed)
+    return best, output, set(loaded)
+
+
+def benchImports(args):
+    torch_time = timeImport('torch', '', args.repeat)[0]
+    print("import torch: %.2fs" % torch_time)
+    ok = True
+    for module, forbidden in IMPORT_CHECKS:
+        preload = '' if 'torch' in forbidden else 'import torch'
+        seconds, output, loaded = timeImport(module, preload, args.repeat)
+        if seconds is None:
+            ok = False
+            print("%-18s failed: %s" % (module, output))
+            continue
+        problems = ['imported ' + name for name in forbidden if name in loaded]
+        if output:
+            problems.append('printed %d lines' % len(output.splitlines()))
+        if seconds > args.budget:
+            problems.append('over the %.2fs budget' % args.budget)
+        ok = ok and not problems
+        print("%-18s %.3fs%s  %s" % (module, seconds, '' if preload else ' (without torch)',
+                                     '; '.join(problems) or 'ok'))
+    return ok
+
+
+######################################################################
+# Training data sampler
+# ---------------------
+#
+# How long ``trainIters`` takes to reach its first training step and how
+# many steps per second it runs after that, for ``--iters`` iterations:
+# the old up-front list of ``--iters`` randomly chosen pairs, the lazy
+# epoch iterators of training.py building each step's tensors in the
+# loop, and the same iterators run by a ``Prefetcher``. ``memory`` is the
+# resident memory gained before the first step.
+#
+
+def residentMB():
+    import os
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def benchSampler(args):
+    import random
+    import numpy as np
+    import torch
+    from corpus import prepareData
+    from seq2seq import EncoderRNN, AttnDecoderRNN
+    from training import (tensorsFromPairIndex, iterPairs, iterBatches, Prefetcher,
+                          train, trainBatch)
+
+    input_lang, output_lang, pairs = prepareData('eng', 'spa', True, path=args.path)
+    criterion = torch.nn.NLLLoss()
+    for batch_size in args.batch_sizes:
+        modes = ['lazy', 'prefetch']
+        if batch_size == 1:
+            modes.insert(0, 'prebuilt')
+        for mode in modes:
+            random.seed(0)
+            np.random.seed(0)
+            torch.manual_seed(0)
+            encoder = EncoderRNN(input_lang.n_words, args.hidden_size)
+            decoder = AttnDecoderRNN(args.hidden_size, output_lang.n_words, dropout_p=0.1)
+            encoder_optimizer = torch.optim.SGD(encoder.parameters(), lr=0.01)
+            decoder_optimizer = torch.optim.SGD(decoder.parameters(), lr=0.01)
+
+            def step(data):
+                if batch_size > 1:
+                    trainBatch(*next(data), encoder, decoder, encoder_optimizer, decoder_optimizer)
+                else:
+                    train(*next(data), encoder, decoder, encoder_optimizer, decoder_optimizer,
+                          criterion)
+
+            memory = residentMB()
+            start = time.perf_counter()
+            if mode == 'prebuilt':
+                data = iter([tensorsFromPairIndex(pairs, random.randrange(len(pairs)))
+                             for i in range(args.iters)])
+            elif batch_size > 1:
+                data = iterBatches(pairs, batch_size)
+            else:
+                data = iterPairs(pairs)
+            if mode == 'prefetch':
+                data = Prefetcher(data, args.depth)
+            step(data)
+            first_step = time.perf_counter() - start
+            memory = residentMB() - memory
+
+            start = time.perf_counter()
+            for _ in range(args.steps):
+                step(data)
+            rate = args.steps / (time.perf_counter() - start)
+            if mode == 'prefetch':
+                data.close()
+            print("batch %3d %-8s first step %7.3fs, %7.1f steps/s (%6.0f sentences/s), "
+                  "memory %+6.1f MB" % (batch_size, mode, first_step, rate, rate * batch_size, memory))
+
+
+######################################################################
+# Pipeline suite
+# --------------
+#
+# One timing for each stage of spanishTranslator.py, on spashort.txt,
+# spavshort.txt and synthetic data, so no Neo4j is needed. Every metric
+# is a time per unit, lower is better, and is the best of ``--repeat``
+# runs with every seed fixed. The results are written as JSON together
+# with the Python, torch and numpy versions, the machine, the thread
+# count and the git commit, so two files can be compared. Nothing reads
+# or writes the dataset cache in ``.cache``: the data is prepared from
+# the text files each time, and ``prepare_data_cached`` uses a temporary
+# cache directory.
+#
+# ``compare`` (or ``suite --baseline``) reports each metric's change and
+# fails if any got more than ``--threshold`` (default 10%) slower.
+#
+
+def environmentInfo():
+    import os
+    import platform
+    import subprocess
+    import sys
+    import numpy as np
+    import torch
+
+    def git(*command):
+        try:
+            return subprocess.run(('git',) + command, capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'python': sys.version.split()[0],
+        'torch': torch.__version__,
+        'numpy': np.__version__,
+        'torch_threads': torch.get_num_threads(),
+        'git_commit': git('rev-parse', 'HEAD'),
+        'git_dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+    }
+
+
+def quietly(fn, *args, **kwargs):
+    import contextlib
+    import io
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+def suiteMetrics(args):
+    import random
+    import tempfile
+    import numpy as np
+    import torch
+    from normalization import normalizeString
+    from corpus import readLangs, prepareData
+    from seq2seq import EncoderRNN, AttnDecoderRNN
+    from training import tensorsFromPairIndex, train, iterBatches, trainBatch
+    from inference import evaluate
+    from transe import TransE, trainTransE
+    from wordlookup import WordLookup
+
+    def seed():
+        random.seed(0)
+        np.random.seed(0)
+        torch.manual_seed(0)
+
+    metrics = {}
+
+    def report(name, value, unit, scale):
+        metrics[name] = {'value': value * scale, 'unit': unit}
+        print("%-24s %10.3f %s" % (name, value * scale, unit))
+
+    sentences = corpusSentences(args.path)
+    report('normalize', bestOf(lambda: [normalizeString(s) for s in sentences], args.repeat)
+           / len(sentences), 'us/sentence', 1e6)
+
+    def readAll(path):
+        input_lang, output_lang, pairs = readLangs('eng', 'spa', True, path)
+        return list(pairs)
+    report('read_langs', quietly(bestOf, lambda: readAll(args.path), args.repeat), 'ms', 1e3)
+    for name, path in (('prepare_data', args.path), ('prepare_data_small', args.small_path)):
+        report(name, quietly(bestOf, lambda: prepareData('eng', 'spa', True, path=path,
+                                                         cache_dir=None), args.repeat), 'ms', 1e3)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        quietly(prepareData, 'eng', 'spa', True, path=args.path, cache_dir=cache_dir)
+        report('prepare_data_cached', quietly(bestOf, lambda: prepareData(
+            'eng', 'spa', True, path=args.path, cache_dir=cache_dir), args.repeat), 'ms', 1e3)
+
+    input_lang, output_lang, pairs = quietly(prepareData, 'eng', 'spa', True, path=args.path,
+                                             cache_dir=None)
+    seed()
+    encoder = quietly(EncoderRNN, input_lang.n_words, args.hidden_size)
+    decoder = quietly(AttnDecoderRNN, args.hidden_size, output_lang.n_words, dropout_p=0.1)
+    encoder_optimizer = torch.optim.SGD(encoder.parameters(), lr=0.01)
+    decoder_optimizer = torch.optim.SGD(decoder.parameters(), lr=0.01)
+    criterion = torch.nn.NLLLoss()
+    order = np.random.default_rng(0).permutation(len(pairs))
+    steps = [tensorsFromPairIndex(pairs, i) for i in order[:args.steps].tolist()]
+
+    def trainSteps():
+        for input_tensor, target_tensor in steps:
+            train(input_tensor, target_tensor, encoder, decoder, encoder_optimizer,
+                  decoder_optimizer, criterion)
+    seed()
+    report('train_step', bestOf(trainSteps, args.repeat) / len(steps), 'ms/step', 1e3)
+
+    seed()
+    batches = iterBatches(pairs, 32)
+    batches = [next(batches) for _ in range(max(1, args.steps // 10))]
+
+    def trainBatches():
+        for batch in batches:
+            trainBatch(*batch, encoder, decoder, encoder_optimizer, decoder_optimizer)
+    seed()
+    report('train_batch_32', bestOf(trainBatches, args.repeat) / len(batches), 'ms/step', 1e3)
+
+    encoder.eval()
+    decoder.eval()
+    held_out = [pairs[i][0] for i in order[-args.sentences:].tolist()]
+    report('evaluate', bestOf(lambda: [evaluate(encoder, decoder, input_lang, output_lang, s)
+                                       for s in held_out], args.repeat) / len(held_out),
+           'ms/sentence', 1e3)
+
+    seed()
+    triples = syntheticTriples(args.triples, args.entities)
+    model = TransE(args.entities, 1, 50)
+    report('transe_epoch', quietly(bestOf, lambda: trainTransE(model, triples, 1),
+                                   args.repeat), 's', 1)
+
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((args.entities, 50)).astype(np.float32)
+    lookup = WordLookup(embeddings, {'w%d' % i: i for i in range(args.entities)},
+                        np.arange(args.entities // 2, args.entities))
+    queries = ['w%d' % i for i in rng.integers(0, args.entities // 2, args.queries)]
+    report('lookup', bestOf(lambda: lookup.nearest(queries), args.repeat) / len(queries),
+           'us/query', 1e6)
+    return metrics
+
+
+def compareResults(baseline, current, threshold):
+    ok = True
+    print("%-24s %12s %12s %8s" % ('metric', 'baseline', 'current', 'change'))
+    for name, metric in current['metrics'].items():
+        if name not in baseline['metrics']:
+            print("%-24s %12s %12.3f %8s  new" % (name, '-', metric['value'], ''))
+            continue
+        before = baseline['metrics'][name]['value']
+        change = metric['value'] / before - 1 if before else 0.0
+        status = ''
+        if change > threshold:
+            status = 'REGRESSION'
+            ok = False
+        elif change < -threshold:
+            status = 'faster'
+        print("%-24s %12.3f %12.3f %+7.1f%%  %s" % (name, before, metric['value'],
+                                                   change * 100, status))
+    for key in ('cpus', 'torch', 'torch_threads', 'machine'):
+        if baseline['environment'].get(key) != current['environment'].get(key):
+            print("note: %s differs (%s vs %s)" % (key, baseline['environment'].get(key),
+                                                    current['environment'].get(key)))
+    return ok
+
+
+def loadResults(path):
+    import json
+    with open(path, 'r', encoding='utf8') as f:
+        return json.load(f)
+
+
+def benchSuite(args):
+    import json
+    results = {
+        'environment': environmentInfo(),
+        'settings': {key: value for key, value in vars(args).items()
+                     if key not in ('run', 'command', 'output', 'baseline', 'threshold')},
+    }
+    results['metrics'] = suiteMetrics(args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+        print("Wrote %s" % args.output)
+    if args.baseline:
+        return compareResults(loadResults(args.baseline), results, args.threshold)
+
+
+def benchCompare(args):
+    return compareResults(loadResults(args.baseline), loadResults(args.current), args.threshold)
+
+
+######################################################################
+# Parallel preprocessing
+# ----------------------
+#
+# Reading, normalizing, filtering and counting the corpus (``buildPairs``,
+# what an uncached ``prepareData`` does) serially and with preprocess.py
+# at each worker count, on ``--copies`` concatenated copies of the file
+# so there is enough to split. Each copy after the first has a suffix
+# added to the first word of both sentences (a different one per copy),
+# so its lines are new pairs with some new words, as in a bigger corpus,
+# and not duplicates that are dropped. Every parallel result is checked to be
+# identical to the serial one: vocabularies, counts, word indexes and the
+# line statistics.
+#
+
+def benchPreprocess(args):
+    import contextlib
+    import io
+    import os
+    import tempfile
+    import numpy as np
+    from corpus import buildPairs
+
+    def build(path, workers):
+        log = io.StringIO()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(log):
+            pairs = buildPairs('eng', 'spa', True, path, 10, None, workers)
+        return time.perf_counter() - start, pairs, log.getvalue().splitlines()[-2:]
+
+    def identical(a, b):
+        return all(getattr(a, side).index2word == getattr(b, side).index2word and
+                   getattr(a, side).word2count == getattr(b, side).word2count
+                   for side in ('input_lang', 'output_lang')) and \
+            all(np.array_equal(getattr(getattr(a, side), name), getattr(getattr(b, side), name))
+                for side in ('inputs', 'targets') for name in ('ids', 'offsets'))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'corpus.txt')
+        with open(args.path, 'r', encoding='utf8') as corpus:
+            lines = corpus.readlines()
+        with open(path, 'w', encoding='utf8') as out:
+            out.writelines(lines)
+            for copy in range(1, args.copies):
+                suffix = ''.join(chr(ord('a') + int(digit, 26)) for digit in np.base_repr(copy, 26))
+                for line in lines:
+                    out.write('\t'.join(field.replace(' ', suffix + ' ', 1) for field in line.split('\t')))
+        print("%d copies of %s, %.1f MB, %d cores" % (
+            args.copies, args.path, os.path.getsize(path) / 2 ** 20, os.cpu_count()))
+
+        serial, expected, expected_log = build(path, 1)
+        print("serial:     %6.2fs (%s)" % (serial, '; '.join(expected_log)))
+        ok = True
+        for workers in args.workers:
+            if workers < 2:
+                continue
+            seconds, pairs, log = build(path, workers)
+            same = identical(expected, pairs) and log == expected_log
+            ok = ok and same
+            print("%2d workers: %6.2fs, speedup %.2fx, efficiency %3.0f%%, %s" % (
+                workers, seconds, serial / seconds, 100 * serial / seconds / workers,
+                'identical' if same else 'DIFFERENT'))
+    return ok
+
+
+######################################################################
+# Mixed precision
+# ---------------
+#
+# Float32 against bfloat16 autocast training (``mixed_precision``): the
+# step time of ``train`` on single pairs and of ``trainBatch`` on batches
+# of 32, and how much the peak resident memory grows over the batched
+# steps. Each mode runs in a fresh process with the
+# same seeds, on the threads set by ``--threads`` and
+# ``--interop-threads`` (see ``configureThreads``).
+#
+# Two loss checks, on held-out batches: the float32-trained model's loss
+# computed in bfloat16 against float32 (``lossParity``), and the float32
+# loss of the model trained in bfloat16 against the one trained in
+# float32. The run fails if either differs by more than its tolerance.
+#
+
+def precisionRun(args, mixed_precision):
+    import contextlib
+    import io
+    import random
+    import numpy as np
+    import torch
+    from corpus import prepareData
+    from seq2seq import EncoderRNN, AttnDecoderRNN
+    from training import (configureThreads, tensorsFromPairIndex, iterBatches, train, trainBatch,
+                          lossParity)
+
+    threads = configureThreads(args.threads, args.interop_threads)
+    with contextlib.redirect_stdout(io.StringIO()):
+        input_lang, output_lang, pairs = prepareData('eng', 'spa', True, path=args.path)
+        random.seed(0)
+        np.random.seed(0)
+        torch.manual_seed(0)
+        encoder = EncoderRNN(input_lang.n_words, args.hidden_size)
+        decoder = AttnDecoderRNN(args.hidden_size, output_lang.n_words, dropout_p=0.1)
+    encoder_optimizer = torch.optim.SGD(encoder.parameters(), lr=0.1)
+    decoder_optimizer = torch.optim.SGD(decoder.parameters(), lr=0.1)
+    criterion = torch.nn.NLLLoss()
+    order = np.random.default_rng(0).permutation(len(pairs))
+    held_out = iterBatches(pairs, 32, order[:args.held_out])
+    held_out = [next(held_out) for _ in range(args.held_out // 32)]
+    batches = iterBatches(pairs, 32, order[args.held_out:])
+    batches = [next(batches) for _ in range(args.batches + 1)]
+    steps = [tensorsFromPairIndex(pairs, i) for i in order[-args.steps - 1:].tolist()]
+
+    def rss(field):
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 2 ** 10
+
+    result = {'threads': threads}
+    train(*steps[0], encoder, decoder, encoder_optimizer, decoder_optimizer, criterion,
+          mixed_precision=mixed_precision)  # warm up
+    start = time.perf_counter()
+    for step in steps[1:]:
+        train(*step, encoder, decoder, encoder_optimizer, decoder_optimizer, criterion,
+              mixed_precision=mixed_precision)
+    result['train_ms'] = (time.perf_counter() - start) / args.steps * 1e3
+
+    trainBatch(*batches[0], encoder, decoder, encoder_optimizer, decoder_optimizer,
+               mixed_precision=mixed_precision)  # warm up
+    # Reset the peak (VmHWM) to the current resident memory
+    with open('/proc/self/clear_refs', 'w') as clear_refs:
+        clear_refs.write('5')
+    before = rss('VmRSS')
+    start = time.perf_counter()
+    for batch in batches[1:]:
+        loss = trainBatch(*batch, encoder, decoder, encoder_optimizer, decoder_optimizer,
+                          mixed_precision=mixed_precision)
+    result['batch_ms'] = (time.perf_counter() - start) / args.batches * 1e3
+    result['peak_mb'] = rss('VmHWM') - before
+    result['train_loss'] = loss
+    result['parity'] = lossParity(encoder, decoder, held_out)
+    return result
+
+
+def benchPrecision(args):
+    import multiprocessing
+
+    results = {}
+    for name, mixed_precision in (('float32', False), ('bfloat16', True)):
+        # A fresh process per mode, for the thread settings and the peak memory
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            results[name] = pool.apply(precisionRun, (args, mixed_precision))
+    print("threads: %d intra-op, %d inter-op" % tuple(results['float32']['threads']))
+    for name, result in results.items():
+        print("%-8s train %6.1f ms/step, batch of 32 %6.1f ms/step, peak +%5.1f MB, "
+              "final batch loss %.3f" % (
+                  name, result['train_ms'], result['batch_ms'], result['peak_mb'],
+                  result['train_loss']))
+    float32, bfloat16 = results['float32'], results['bfloat16']
+    print("speedup: train %.2fx, batch %.2fx" % (
+        float32['train_ms'] / bfloat16['train_ms'], float32['batch_ms'] / bfloat16['batch_ms']))
+
+    loss32, loss16, forward = float32['parity']
+    trained = abs(bfloat16['parity'][0] - loss32) / loss32
+    print("held-out loss of the float32 model: %.4f float32, %.4f bfloat16 (%.2f%%)" % (
+        loss32, loss16, forward * 100))
+    print("held-out float32 loss after training: %.4f float32, %.4f bfloat16 (%.2f%%)" % (
+        loss32, bfloat16['parity'][0], trained * 100))
+    return forward <= args.tolerance and trained <= args.train_tolerance
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    normalize = commands.add_parser('normalize', help='normalizeString speed and exactness')
+    normalize.add_argument('--path', default='spashort.txt')
+    normalize.add_argument('--repeat', type=int, default=5)
+    normalize.set_defaults(run=benchNormalize)
+
+    transe = commands.add_parser('transe', help='TransE triples/s, per-triple loop vs batched')
+    transe.add_argument('--triples', type=int, default=100000)
+    transe.add_argument('--entities', type=int, default=20000)
+    transe.add_argument('--loop-triples', type=int, default=1000)
+    transe.add_argument('--batch-size', type=int, default=1024)
+    transe.add_argument('--repeat', type=int, default=3)
+    transe.set_defaults(run=benchTransE)
+
+    lookup = commands.add_parser('lookup', help='TransE nearest-word lookup queries/s')
+    lookup.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    lookup.add_argument('--queries', type=int, default=1000)
+    lookup.add_argument('--loop-queries', type=int, default=50)
+    lookup.add_argument('--k', type=int, default=1)
+    lookup.add_argument('--nprobe', type=int, default=8)
+    lookup.add_argument('--ivf-min-size', type=int, default=10000)
+    lookup.add_argument('--repeat', type=int, default=3)
+    lookup.set_defaults(run=benchLookup)
+
+    parallel = commands.add_parser('parallel', help='data-parallel training scaling')
+    parallel.add_argument('--path', default='spashort.txt')
+    parallel.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parallel.add_argument('--sentences', type=int, default=20000)
+    parallel.add_argument('--batch-size', type=int, default=32)
+    parallel.add_argument('--hidden-size', type=int, default=256)
+    parallel.set_defaults(run=benchParallel)
+
+    decode = commands.add_parser('decode', help='attention decoder per-token latency')
+    decode.add_argument('--path', default='spashort.txt')
+    decode.add_argument('--sentences', type=int, default=200)
+    decode.add_argument('--hidden-size', type=int, default=256)
+    decode.add_argument('--max-length', type=int, default=10)
+    decode.add_argument('--repeat', type=int, default=3)
+    decode.set_defaults(run=benchDecode)
+
+    lengths = commands.add_parser('lengths', help='pairs kept and cost per sentence by length limit')
+    lengths.add_argument('--path', default='spashort.txt')
+    lengths.add_argument('--caps', type=int, nargs='+', default=[8, 10, 12, 16, 0],
+                         help='length limits, 0 for none')
+    lengths.add_argument('--batches', type=int, default=20)
+    lengths.add_argument('--batch-size', type=int, default=32)
+    lengths.add_argument('--sentences', type=int, default=500)
+    lengths.add_argument('--hidden-size', type=int, default=256)
+    lengths.set_defaults(run=benchLengths)
+
+    subword = commands.add_parser('subword', help='word vs BPE vocabularies')
+    subword.add_argument('--path', default='spashort.txt')
+    subword.add_argument('--sizes', type=int, nargs='+', default=[1000, 2000, 4000, 8000])
+    subword.add_argument('--hidden-size', type=int, default=256)
+    subword.add_argument('--repeat', type=int, default=3)
+    subword.set_defaults(run=benchSubword)
+
+    softmax = commands.add_parser('softmax', help='full vs adaptive softmax step time')
+    softmax.add_argument('--sizes', type=int, nargs='+', default=[2000, 8000, 32000, 128000])
+    softmax.add_argument('--batch-size', type=int, default=64)
+    softmax.add_argument('--hidden-size', type=int, default=256)
+    softmax.add_argument('--source-length', type=int, default=10)
+    softmax.add_argument('--repeat', type=int, default=5)
+    softmax.set_defaults(run=benchSoftmax)
+
+    vocab = commands.add_parser('vocab', help='rare-word pruning: sizes and step time')
+    vocab.add_argument('--path', default='spashort.txt')
+    vocab.add_argument('--min-counts', type=int, nargs='+', default=[2, 3, 5])
+    vocab.add_argument('--max-words', type=int, nargs='+', default=[2000])
+    vocab.add_argument('--batches', type=int, default=10)
+    vocab.add_argument('--batch-size', type=int, default=32)
+    vocab.add_argument('--sentences', type=int, default=200)
+    vocab.add_argument('--hidden-size', type=int, default=256)
+    vocab.set_defaults(run=benchVocab)
+
+    cache = commands.add_parser('cache', help='translation cache hit rate and throughput')
+    cache.add_argument('--path', default='spashort.txt')
+    cache.add_argument('--sentences', type=int, default=5000)
+    cache.add_argument('--distinct', type=int, default=1000)
+    cache.add_argument('--batch-size', type=int, default=64)
+    cache.add_argument('--capacity', type=int, default=10000)
+    cache.add_argument('--hidden-size', type=int, default=256)
+    cache.set_defaults(run=benchCache)
+
+    serve = commands.add_parser('serve', help='HTTP server load test, with and without batching')
+    serve.add_argument('--path', default='spashort.txt')
+    serve.add_argument('--clients', type=int, default=32)
+    serve.add_argument('--requests', type=int, default=20)
+    serve.add_argument('--max-batch', type=int, default=64)
+    serve.add_argument('--max-delay-ms', type=float, default=5)
+    serve.add_argument('--hidden-size', type=int, default=256)
+    serve.add_argument('--url', help='host:port of a running server to load instead')
+    serve.set_defaults(run=benchServe)
+
+    export = commands.add_parser('export', help='eager vs TorchScript fp32/int8 translation')
+    export.add_argument('--path', default='spashort.txt')
+    export.add_argument('--checkpoint', help='translate with this model instead of training one')
+    export.add_argument('--train-batches', type=int, default=300)
+    export.add_argument('--hidden-size', type=int, default=256)
+    export.add_argument('--sentences', type=int, default=1000, help='held-out sentences')
+    export.add_argument('--single', type=int, default=200, help='sentences timed one at a time')
+    export.add_argument('--repeat', type=int, default=3)
+    export.set_defaults(run=benchExport)
+
+    imports = commands.add_parser('imports', help='import time and side effects of each module')
+    imports.add_argument('--budget', type=float, default=0.5,
+                         help='seconds allowed on top of import torch')
+    imports.add_argument('--repeat', type=int, default=3)
+    imports.set_defaults(run=benchImports)
+
+    sampler = commands.add_parser('sampler', help='time to first training step and steps/s')
+    sampler.add_argument('--path', default='spashort.txt')
+    sampler.add_argument('--iters', type=int, default=200000, help='n_iters of the run')
+    sampler.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 32])
+    sampler.add_argument('--steps', type=int, default=300, help='steps timed after the first')
+    sampler.add_argument('--depth', type=int, default=8, help='prefetch queue length')
+    sampler.add_argument('--hidden-size', type=int, default=256)
+    sampler.set_defaults(run=benchSampler)
+
+    preprocess = commands.add_parser('preprocess', help='parallel corpus preprocessing scaling')
+    preprocess.add_argument('--path', default='spashort.txt')
+    preprocess.add_argument('--copies', type=int, default=4, help='copies of the file to read')
+    preprocess.add_argument('--workers', type=int, nargs='+', default=[2, 4, 8])
+    preprocess.set_defaults(run=benchPreprocess)
+
+    precision = commands.add_parser('precision', help='float32 vs bfloat16 autocast training')
+    precision.add_argument('--path', default='spashort.txt')
+    precision.add_argument('--steps', type=int, default=100, help='train() steps timed')
+    precision.add_argument('--batches', type=int, default=50, help='batches of 32 timed')
+    precision.add_argument('--held-out', type=int, default=640, help='pairs for the loss checks')
+    precision.add_argument('--hidden-size', type=int, default=256)
+    precision.add_argument('--threads', type=int, default=None, help='intra-op threads')
+    precision.add_argument('--interop-threads', type=int, default=None)
+    precision.add_argument('--tolerance', type=float, default=0.01,
+                           help='relative loss difference allowed for the same weights')
+    precision.add_argument('--train-tolerance', type=float, default=0.05,
+                           help='relative loss difference allowed after training')
+    precision.set_defaults(run=benchPrecision)
+
+    suite = commands.add_parser('suite', help='time every pipeline stage, write JSON')
+    suite.add_argument('--path', default='spashort.txt')
+    suite.add_argument('--small-path', default='spavshort.txt')
+    suite.add_argument('--output', help='JSON file for the results')
+    suite.add_argument('--baseline', help='JSON results to compare with')
+    suite.add_argument('--threshold', type=float, default=0.1,
+                       help='slowdown flagged as a regression, 0.1 for 10%%')
+    suite.add_argument('--steps', type=int, default=50, help='train() steps timed')
+    suite.add_argument('--sentences', type=int, default=50, help='sentences evaluated')
+    suite.add_argument('--triples', type=int, default=100000)
+    suite.add_argument('--entities', type=int, default=20000)
+    suite.add_argument('--queries', type=int, default=1000)
+    suite.add_argument('--hidden-size', type=int, default=256)
+    suite.add_argument('--repeat', type=int, default=3)
+    suite.set_defaults(run=benchSuite)
+
+    compare = commands.add_parser('compare', help='compare suite results with a baseline')
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=0.1)
+    compare.set_defaults(run=benchCompare)
+
+    args = parser.parse_args()
+    ok = args.run(args)
+    raise SystemExit(0 if ok in (None, True) else 1)
+
+
+if __name__ == '__main__':
+    main()
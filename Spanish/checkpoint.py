@@ -0,0 +1,96 @@
+"""
+Checkpoints
+***********
+Saving and restoring a trained translator: the encoder and attention
+decoder weights, their optimizer states, both vocabularies and how many
+training iterations have run. A checkpoint is enough on its own to
+translate with (see serve.py) or to carry on training.
+
+Only tensors, lists, dicts, strings and numbers are stored, so
+checkpoints load with ``torch.load(weights_only=True)``.
+"""
+import os
+
+import torch
+
+from corpus import langFromVocabulary, langVocabulary
+from seq2seq import device, EncoderRNN, AttnDecoderRNN
+
+CHECKPOINT_VERSION = 1
+
+
+def saveCheckpoint(path, encoder, decoder, input_lang, output_lang,
+                   encoder_optimizer=None, decoder_optimizer=None, iteration=0):
+    state = {
+        'version': CHECKPOINT_VERSION,
+        'hidden_size': encoder.hidden_size,
+        'dropout_p': decoder.dropout_p,
+        'max_length': decoder.max_length,
+        'adaptive_cutoffs': decoder.adaptive_cutoffs,
+        'encoder': encoder.state_dict(),
+        'decoder': decoder.state_dict(),
+        'iteration': iteration,
+    }
+    for key, lang in (('input_lang', input_lang), ('output_lang', output_lang)):
+        words, counts, merges = langVocabulary(lang)
+        state[key] = {'name': lang.name, 'words': words, 'counts': counts}
+        if merges is not None:
+            state[key]['merges'] = merges
+    if encoder_optimizer is not None:
+        state['encoder_optimizer'] = encoder_optimizer.state_dict()
+    if decoder_optimizer is not None:
+        state['decoder_optimizer'] = decoder_optimizer.state_dict()
+
+    # Write next to the target and rename, so a crash never leaves a
+    # truncated checkpoint behind
+    partial = path + '.partial'
+    torch.save(state, partial)
+    os.replace(partial, path)
+
+
+def loadCheckpoint(path, map_location=device):
+    """Load a checkpoint and rebuild the models and vocabularies in it.
+
+    Returns the saved dict with ``encoder`` and ``decoder`` replaced by the
+    models (on ``map_location``) and ``input_lang``/``output_lang`` by
+    ``Lang`` objects. The optimizer states are left as state dicts.
+    """
+    state = torch.load(path, map_location=map_location, weights_only=True)
+    if state.get('version') != CHECKPOINT_VERSION:
+        raise ValueError("%s: unsupported checkpoint version %r" % (path, state.get('version')))
+
+    for key in ('input_lang', 'output_lang'):
+        vocab = state[key]
+        state[key] = langFromVocabulary(vocab['name'], vocab['words'], vocab['counts'], vocab.get('merges'))
+
+    encoder = EncoderRNN(state['input_lang'].n_words, state['hidden_size'])
+    encoder.load_state_dict(state['encoder'])
+    decoder = AttnDecoderRNN(state['hidden_size'], state['output_lang'].n_words,
+                             dropout_p=state['dropout_p'], max_length=state['max_length'],
+                             adaptive_cutoffs=state.get('adaptive_cutoffs'))
+    decoder.load_state_dict(state['decoder'])
+    state['encoder'] = encoder.to(map_location)
+    state['decoder'] = decoder.to(map_location)
+    return state
+
+
+def resumeTraining(path, encoder, decoder, encoder_optimizer, decoder_optimizer, input_lang, output_lang):
+    """Load a checkpoint into models and optimizers that are already built.
+
+    The vocabularies must match the ones the checkpoint was trained with.
+    Returns the number of iterations already done.
+    """
+    state = torch.load(path, map_location=device, weights_only=True)
+    if state.get('version') != CHECKPOINT_VERSION:
+        raise ValueError("%s: unsupported checkpoint version %r" % (path, state.get('version')))
+    for key, lang in (('input_lang', input_lang), ('output_lang', output_lang)):
+        if state[key]['words'] != langVocabulary(lang)[0]:
+            raise ValueError("%s: %s vocabulary does not match the prepared data" % (path, lang.name))
+
+    encoder.load_state_dict(state['encoder'])
+    decoder.load_state_dict(state['decoder'])
+    if 'encoder_optimizer' in state:
+        encoder_optimizer.load_state_dict(state['encoder_optimizer'])
+    if 'decoder_optimizer' in state:
+        decoder_optimizer.load_state_dict(state['decoder_optimizer'])
+    return state['iteration']
@@ -0,0 +1,352 @@
+"""
+Corpus and vocabulary
+*********************
+Reading the Tatoeba-style sentence files into normalized, filtered pairs
+and the ``Lang`` vocabularies built from them. Nothing here touches
+torch, so it is cheap to import for serving and tooling.
+"""
+import numpy as np
+
+import datacache
+from normalization import normalizeString
+from subword import SubwordLang
+
+
+######################################################################
+# Unique index per word to use as the inputs and targets of
+# the networks. To keep track we use class Lang
+# Lang does word → index (``word2index``) and index → word
+# (``index2word``) dictionaries, as well as a count of each word
+# ``word2count`` which will be used to replace rare words later.
+# SOS: startOfSentence EOS: endOfSentence UNK: a word that is not in the
+# vocabulary (see ``pruneLang``)
+
+SOS_token = 0
+EOS_token = 1
+UNK_token = 2
+UNK_WORD = '<UNK>'
+
+# Default sentence length limit in words, see ``filterPair`` below
+MAX_LENGTH = 10
+
+class Lang:
+    def __init__(self, name):
+        self.name = name
+        self.word2index = {}
+        self.word2count = {}
+        self.index2word = {0: "SOS", 1: "EOS", 2: UNK_WORD}
+        self.n_words = 3  # Count SOS, EOS and UNK
+
+    def addSentence(self, sentence):
+        for word in sentence.split(' '):
+            self.addWord(word)
+
+    def addWord(self, word):
+        if word not in self.word2index:
+            self.word2index[word] = self.n_words
+            self.word2count[word] = 1 # augmenting this so we get rare words
+            self.index2word[self.n_words] = word
+            self.n_words += 1
+        else:
+            self.word2count[word] += 1
+
+
+# Rebuild a Lang from a vocabulary saved by datacache.py, where ``words``
+# is in index order (SOS, EOS and UNK first) and ``counts`` lines up with
+# it. Subword vocabularies also have their ``merges``. Vocabularies saved
+# before UNK existed have only SOS and EOS in front.
+def langFromVocabulary(name, words, counts, merges=None):
+    if merges is not None:
+        return SubwordLang(name, merges, words, counts)
+    lang = Lang(name)
+    lang.index2word = dict(enumerate(words))
+    lang.word2index = {word: i for i, word in enumerate(words) if i >= 2 and word != UNK_WORD}
+    lang.word2count = dict(zip(words[2:], counts[2:]))
+    lang.n_words = len(words)
+    return lang
+
+
+# The other way round: ``lang``'s words in index order, their counts (0
+# for SOS and EOS) and its merges, or None if it is not a subword one.
+# Checkpoints and the dataset cache both store vocabularies this way.
+def langVocabulary(lang):
+    words = [lang.index2word[i] for i in range(lang.n_words)]
+    counts = [lang.word2count.get(word, 0) if i >= 2 else 0
+              for i, word in enumerate(words)]
+    merges = [list(pair) for pair in lang.merges] if hasattr(lang, 'merges') else None
+    return words, counts, merges
+
+
+######################################################################
+# The files are all in Unicode, to simplify we will turn Unicode
+# characters to ASCII, make everything lowercase, and trim most
+# punctuation. ``normalizeString`` lives in normalization.py, which has
+# a fast version of it that gives the same output.
+
+######################################################################
+# THIS CALLS LANG. Ithis splits sentences and sends them to lang to get them enumerated
+# To read the data file we will split the file into lines, and then split
+# lines into pairs. The files are all English → Other Language, so if we
+# want to translate from Other Language → English I added the ``reverse``
+# flag to reverse the pairs.
+#
+# The file is streamed line by line instead of read whole: every line is
+# split, normalized and filtered as it comes in, and pairs we have already
+# kept are skipped through a set, so memory grows with the unique pairs we
+# keep and not with the size of the file. ``stats`` counts the lines read,
+# dropped (malformed or too long) and deduplicated. ``max_length`` is the
+# length limit passed to ``filterPair``.
+#
+# ``pairsFromLines`` does the work for any iterable of lines, so
+# preprocess.py can run it on chunks of the file in parallel.
+#
+
+def newLoadStats():
+    return {'read': 0, 'dropped': 0, 'duplicates': 0, 'kept': 0}
+
+
+def readPairs(path, reverse=False, stats=None, dedupe=True, max_length=MAX_LENGTH):
+    with open(path, 'r', encoding="utf8") as lines:
+        yield from pairsFromLines(lines, reverse, stats, dedupe, max_length)
+
+
+def pairsFromLines(lines, reverse=False, stats=None, dedupe=True, max_length=MAX_LENGTH):
+    if stats is None:
+        stats = newLoadStats()
+    seen = set()
+    for line in lines:
+        stats['read'] += 1
+        # Strip the attribution and split into the two sentences
+        head, sep, tail = line.partition('\tCC-BY')
+        fields = head.split('\t')
+        if len(fields) < 2:
+            stats['dropped'] += 1
+            continue
+
+        pair = [normalizeString(fields[0]), normalizeString(fields[1])]
+        if reverse:
+            pair.reverse()
+        if not filterPair(pair, max_length):
+            stats['dropped'] += 1
+            continue
+
+        if dedupe:
+            key = (pair[0], pair[1])
+            if key in seen:
+                stats['duplicates'] += 1
+                continue
+            seen.add(key)
+        stats['kept'] += 1
+        yield pair
+
+
+def readLangs(lang1, lang2, reverse=False, path='spavshort.txt', stats=None, max_length=MAX_LENGTH):
+    print("Reading lines...")
+
+    # Lazily read, normalize and filter the pairs, make Lang instances
+    pairs = readPairs(path, reverse, stats, max_length=max_length)
+    if reverse:
+        input_lang = Lang(lang2)
+        output_lang = Lang(lang1)
+    else:
+        input_lang = Lang(lang1)
+        output_lang = Lang(lang2)
+
+    return input_lang, output_lang, pairs
+
+
+######################################################################
+# Since there are a *lot* of example sentences and we want to train
+# something quickly, we'll trim the data set to only relatively short and
+# simple sentences. Here the maximum length is 10 words (that includes
+# ending punctuation) and we're filtering to sentences that translate to
+# the form "I am" or "He is" etc. (accounting for apostrophes replaced
+# earlier).
+# TRIM FOR EASIER SENTENCES TO DO LESS WORK
+#
+# The attention decoder takes encoder outputs of any length, so the limit
+# is only there to keep training cheap: pass a larger ``max_length``, or
+# None for no limit, to keep longer sentences.
+
+#eng_prefixes = (
+#    "i am ", "i m ",
+#    "he is", "he s ",
+#    "she is", "she s ",
+#    "you are", "you re ",
+#    "we are", "we re ",
+#    "they are", "they re "
+#)
+def filterPair(p, max_length=MAX_LENGTH):
+    if max_length is None:
+        return True
+    return len(p[0].split(' ')) < max_length and \
+        len(p[1].split(' ')) < max_length# and \
+       #p[1].startswith(eng_prefixes)
+
+def filterPairs(pairs, max_length=MAX_LENGTH):
+    return [pair for pair in pairs if filterPair(pair, max_length)]
+
+######################################################################
+# The full process to prepare data is called below. 
+#
+# -  Stream the text file line by line, split lines into pairs
+# -  Normalize text, filter by length and content, drop duplicates
+# -  Make word lists from sentences in pairs
+# -  Keep the pairs as arrays of word indexes (see datacache.py)
+#
+# With ``subword_vocab_size`` each language then gets a ``SubwordLang``
+# of that size (see subword.py) trained on its word counts, and the
+# sentences are re-encoded into pieces, one lookup per distinct word.
+#
+# The result is cached under ``cache_dir``, keyed on the corpus file and
+# the settings, so later runs load it back instead of redoing all of the
+# above. Pass ``cache_dir=None`` to always rebuild.
+#
+# With ``workers`` above 1 the file is read, normalized and filtered in
+# that many processes (see preprocess.py). The result is the same, so it
+# shares the cache entry.
+#
+# ``min_count`` and ``max_words`` prune rare words to ``<UNK>`` (see
+# ``pruneLang`` below). The cache holds the full vocabulary, so pruning
+# is applied after loading and changing it does not rebuild the cache.
+#
+
+def subwordsFromWords(lang, sentences, vocab_size):
+    subwords = SubwordLang.train(lang.name, lang.word2count, vocab_size)
+    pieces = {index: subwords.encodeWord(word) for word, index in lang.word2index.items()}
+    sentences = [[piece for index in sentence for piece in pieces[index]] for sentence in sentences]
+    for word, count in lang.word2count.items():
+        for piece in pieces[lang.word2index[word]]:
+            subwords.word2count[subwords.index2word[piece]] += count
+    return subwords, sentences
+
+
+def prepareData(lang1, lang2, reverse=False, path='spavshort.txt', cache_dir='.cache',
+                max_length=MAX_LENGTH, subword_vocab_size=None, min_count=None, max_words=None,
+                workers=1):
+    if subword_vocab_size and (min_count or max_words):
+        raise ValueError("subword vocabularies have no rare words to prune")
+    pairs = None
+    if cache_dir:
+        settings = {'langs': [lang1, lang2], 'reverse': reverse,
+                    'max_length': max_length, 'dedupe': True,
+                    'subword_vocab_size': subword_vocab_size}
+        key = datacache.cacheKey(path, settings)
+        pairs = datacache.loadCache(cache_dir, key, langFromVocabulary)
+        if pairs is not None:
+            print("Loaded %s sentence pairs from %s" % (len(pairs), cache_dir))
+    if pairs is None:
+        pairs = buildPairs(lang1, lang2, reverse, path, max_length, subword_vocab_size, workers)
+        if cache_dir:
+            datacache.saveCache(cache_dir, key, pairs, langVocabulary)
+
+    if min_count or max_words:
+        pairs = prunePairs(pairs, min_count or 1, max_words)
+    print("Counted words:")
+    print(pairs.input_lang.name, pairs.input_lang.n_words)
+    print(pairs.output_lang.name, pairs.output_lang.n_words)
+    return pairs.input_lang, pairs.output_lang, pairs
+
+
+def buildPairs(lang1, lang2, reverse, path, max_length, subword_vocab_size, workers=1):
+    if workers > 1:
+        # Imported here: preprocess.py imports this module
+        from preprocess import readPairsParallel
+        input_lang, output_lang, inputs, targets, stats = readPairsParallel(
+            lang1, lang2, reverse, path, max_length, workers)
+    else:
+        stats = newLoadStats()
+        input_lang, output_lang, pair_stream = readLangs(lang1, lang2, reverse, path, stats, max_length)
+        print("Counting words...")
+        input_indexes = []
+        target_indexes = []
+        for pair in pair_stream:
+            input_lang.addSentence(pair[0])
+            output_lang.addSentence(pair[1])
+            input_indexes.append([input_lang.word2index[word] for word in pair[0].split(' ')])
+            target_indexes.append([output_lang.word2index[word] for word in pair[1].split(' ')])
+        inputs = datacache.TokenArrays.fromSequences(input_indexes)
+        targets = datacache.TokenArrays.fromSequences(target_indexes)
+    if subword_vocab_size:
+        print("Learning subwords...")
+        input_lang, input_indexes = subwordsFromWords(
+            input_lang, [inputs[i].tolist() for i in range(len(inputs))], subword_vocab_size)
+        output_lang, target_indexes = subwordsFromWords(
+            output_lang, [targets[i].tolist() for i in range(len(targets))], subword_vocab_size)
+        inputs = datacache.TokenArrays.fromSequences(input_indexes)
+        targets = datacache.TokenArrays.fromSequences(target_indexes)
+    pairs = datacache.TokenizedPairs(input_lang, output_lang, inputs, targets)
+    print("Read %s lines, dropped %s, removed %s duplicates" % (
+        stats['read'], stats['dropped'], stats['duplicates']))
+    print("Trimmed to %s sentence pairs" % len(pairs))
+    return pairs
+
+
+######################################################################
+# Rare words
+# ----------
+#
+# ``pruneLang`` keeps the words seen at least ``min_count`` times, and of
+# those at most the ``max_words`` most frequent (ties go to the word seen
+# first), in their original order. Every other word becomes ``<UNK>``,
+# whose count is the total of the words it replaced. It returns the new
+# Lang and an array mapping every old index to its new one, so
+# ``prunePairs`` can remap the cached token arrays with one indexing
+# operation per side.
+#
+
+def pruneLang(lang, min_count=1, max_words=None):
+    words = [lang.index2word[i] for i in range(UNK_token + 1, lang.n_words)]
+    counts = np.array([lang.word2count.get(word, 0) for word in words], dtype=np.int64)
+    keep = counts >= min_count
+    if max_words is not None and keep.sum() > max_words:
+        by_count = np.argsort(-counts, kind='stable')
+        by_count = by_count[keep[by_count]][:max_words]
+        keep = np.zeros_like(keep)
+        keep[by_count] = True
+
+    pruned = Lang(lang.name)
+    remap = np.full(lang.n_words, UNK_token, dtype=np.int32)
+    remap[:UNK_token + 1] = np.arange(UNK_token + 1)
+    for i in np.flatnonzero(keep).tolist():
+        pruned.word2index[words[i]] = pruned.n_words
+        pruned.index2word[pruned.n_words] = words[i]
+        pruned.word2count[words[i]] = int(counts[i])
+        remap[UNK_token + 1 + i] = pruned.n_words
+        pruned.n_words += 1
+    pruned.word2count[UNK_WORD] = lang.word2count.get(UNK_WORD, 0) + int(counts[~keep].sum())
+    return pruned, remap
+
+
+def prunePairs(pairs, min_count=1, max_words=None):
+    input_lang, input_remap = pruneLang(pairs.input_lang, min_count, max_words)
+    output_lang, output_remap = pruneLang(pairs.output_lang, min_count, max_words)
+    inputs = datacache.TokenArrays(input_remap[pairs.inputs.ids], pairs.inputs.offsets)
+    targets = datacache.TokenArrays(output_remap[pairs.targets.ids], pairs.targets.offsets)
+    print("Pruned to %d and %d words, %.1f%% and %.1f%% of tokens are %s" % (
+        input_lang.n_words, output_lang.n_words,
+        100 * np.mean(inputs.ids == UNK_token), 100 * np.mean(targets.ids == UNK_token), UNK_WORD))
+    return datacache.TokenizedPairs(input_lang, output_lang, inputs, targets)
+
+
+######################################################################
+# Word indexes for a sentence. Unknown words become ``<UNK>``. A
+# ``SubwordLang`` has no unknown words, and with a vocabulary saved
+# before UNK existed an unknown word still drops the whole sentence.
+#
+
+def indexesFromSentence(lang, sentence):
+    if isinstance(lang, SubwordLang):
+        return lang.encode(sentence)
+    if lang.index2word.get(UNK_token) == UNK_WORD:
+        return [lang.word2index.get(word, UNK_token) for word in sentence.split(' ')]
+    #print(lang.word2index)
+    newSentence = sentence;
+    for tword in sentence.split(' '):
+        if tword not in  lang.word2index:
+            newSentence = sentence.replace(tword, ".")
+            print("UNKNOWN: ", tword)
+            print("Ignore following output and try another sentence")
+            return []
+
+    return [lang.word2index[word] for word in newSentence.split(' ')]
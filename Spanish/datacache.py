@@ -0,0 +1,191 @@
+"""
+Prepared dataset cache
+**********************
+``prepareData`` reads, normalizes and filters the whole corpus and then
+counts every word into the two ``Lang`` vocabularies. The result only
+depends on the corpus file and a handful of settings, so it is written to
+disk once and loaded back on later runs instead.
+
+A cache entry is a directory named after a hash of the source file, the
+normalization code and the settings, holding:
+
+- ``meta.json``: format version, language names and sizes, and the
+  merges of subword vocabularies
+- ``<lang>_words.npy`` / ``<lang>_counts.npy``: the vocabulary, as one
+  newline-joined UTF-8 blob (index order) and the ``word2count`` values
+- ``input_ids.npy`` / ``target_ids.npy``: every sentence's word indexes
+  concatenated into one int32 array, with ``*_offsets.npy`` marking where
+  each sentence starts
+
+The arrays are memory-mapped on load, so a warm start does no parsing at
+all and only touches the pages it needs.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+import normalization
+from subword import joinWords
+
+CACHE_VERSION = 2
+
+
+def cacheKey(path, settings):
+    digest = hashlib.sha256()
+    digest.update(b'v%d\0' % CACHE_VERSION)
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    with open(normalization.__file__, 'rb') as source:
+        digest.update(source.read())
+    with open(path, 'rb') as corpus:
+        for block in iter(lambda: corpus.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:32]
+
+
+######################################################################
+# Token arrays
+# ------------
+#
+# A list of variable-length sentences as one flat id array plus an offset
+# array, so sentence ``i`` is ``ids[offsets[i]:offsets[i + 1]]``.
+#
+
+class TokenArrays:
+    def __init__(self, ids, offsets):
+        self.ids = ids
+        self.offsets = offsets
+
+    @classmethod
+    def fromSequences(cls, sequences):
+        offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+        np.cumsum([len(seq) for seq in sequences], out=offsets[1:])
+        ids = np.fromiter((index for seq in sequences for index in seq),
+                          dtype=np.int32, count=int(offsets[-1]))
+        return cls(ids, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+
+######################################################################
+# Tokenized pairs
+# ---------------
+#
+# Behaves like the list of ``[input sentence, target sentence]`` pairs
+# ``prepareData`` used to return (indexing, ``len``, iteration,
+# ``random.choice``), rebuilding the strings from the word indexes on
+# access. ``indexes(i)`` gives the word indexes directly so training does
+# not need to split and look up the sentences again.
+#
+
+class TokenizedPairs:
+    def __init__(self, input_lang, output_lang, inputs, targets):
+        self.input_lang = input_lang
+        self.output_lang = output_lang
+        self.inputs = inputs
+        self.targets = targets
+
+    def __len__(self):
+        return len(self.inputs)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('pair index out of range')
+        return [self.sentence(self.input_lang, self.inputs[i]),
+                self.sentence(self.output_lang, self.targets[i])]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @staticmethod
+    def sentence(lang, indexes):
+        return joinWords([lang.index2word[index] for index in indexes.tolist()])
+
+    def indexes(self, i):
+        return self.inputs[i], self.targets[i]
+
+    def lengths(self):
+        return self.inputs.lengths(), self.targets.lengths()
+
+
+######################################################################
+# Saving and loading
+# ------------------
+#
+
+def saveCache(cache_dir, key, pairs, langVocabulary):
+    """Write ``pairs`` to a new cache entry and return its directory.
+
+    ``langVocabulary(lang)`` gives a ``Lang``'s words, counts and merges
+    (None unless it is a subword one), as ``makeLang`` takes them back.
+    """
+    entry = os.path.join(cache_dir, key)
+    partial = entry + '.partial'
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+
+    merges = {}
+    for role, lang in (('input', pairs.input_lang), ('output', pairs.output_lang)):
+        words, counts, merges[role] = langVocabulary(lang)
+        blob = np.frombuffer('\n'.join(words).encode('utf8'), dtype=np.uint8)
+        np.save(os.path.join(partial, role + '_words.npy'), blob)
+        np.save(os.path.join(partial, role + '_counts.npy'), np.array(counts, dtype=np.int64))
+    for role, tokens in (('input', pairs.inputs), ('target', pairs.targets)):
+        np.save(os.path.join(partial, role + '_ids.npy'), tokens.ids)
+        np.save(os.path.join(partial, role + '_offsets.npy'), tokens.offsets)
+
+    meta = {
+        'version': CACHE_VERSION,
+        'input_lang': pairs.input_lang.name,
+        'output_lang': pairs.output_lang.name,
+        'n_pairs': len(pairs),
+        'input_merges': merges['input'],
+        'output_merges': merges['output'],
+    }
+    with open(os.path.join(partial, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    # Publish the entry in one rename so readers never see half of it
+    shutil.rmtree(entry, ignore_errors=True)
+    os.replace(partial, entry)
+    return entry
+
+
+def loadCache(cache_dir, key, makeLang):
+    """Load a cache entry, or return None if there is no usable one.
+
+    ``makeLang(name, words, counts, merges)`` turns a stored vocabulary
+    back into a ``Lang``; ``merges`` is None unless it was a subword one.
+    """
+    entry = os.path.join(cache_dir, key)
+    try:
+        with open(os.path.join(entry, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != CACHE_VERSION:
+        return None
+
+    def load(name):
+        return np.load(os.path.join(entry, name + '.npy'), mmap_mode='r')
+
+    langs = []
+    for role in ('input', 'output'):
+        words = load(role + '_words').tobytes().decode('utf8').split('\n')
+        counts = load(role + '_counts').tolist()
+        langs.append(makeLang(meta[role + '_lang'], words, counts, meta.get(role + '_merges')))
+    inputs = TokenArrays(load('input_ids'), load('input_offsets'))
+    targets = TokenArrays(load('target_ids'), load('target_offsets'))
+    return TokenizedPairs(langs[0], langs[1], inputs, targets)
@@ -0,0 +1,226 @@
+"""
+Exported inference models
+*************************
+Packs a trained encoder and attention decoder, with both vocabularies,
+into one TorchScript file that translates with greedy decoding. Loading
+it needs nothing but ``torch`` (``torch.jit.load``); none of this repo's
+modules, Neo4j, torchkge or matplotlib. Run from the Spanish folder::
+
+    python export.py translator.pt translator.int8.pt
+    python export.py translator.pt translator.fp32.pt --no-quantize
+
+By default the model is quantized to int8. The ``nn.GRU`` and
+``nn.Linear`` layers use dynamic quantization: their weights are stored
+as int8 and the activations are quantized on the fly, so the matrix
+products run in int8. The embeddings are stored as int8 rows with a
+float scale each and only the attention vector stays float32, so the
+file is about a quarter of the size. Quantized embeddings cost some
+agreement with the float model; ``--float-embeddings`` keeps them
+float32. ``python benchmarks.py export`` compares the latency, size and
+translations with the eager float32 model.
+
+The exported module has:
+
+- ``forward(input, lengths)``: a padded (length, batch) tensor of word
+  indexes ending in ``EOS`` and the lengths, like ``translate_batch``
+  builds, returning a (batch, steps) tensor of output indexes; finished
+  sentences are padded with ``EOS``.
+- ``translate(sentences)``: normalized sentences in, lists of output
+  words out (``EOS`` not included). Words outside the vocabulary map to
+  ``<UNK>``, or are dropped if the vocabulary has none.
+
+Sentences must be normalized first (``normalizeString`` does not script);
+``translateExported`` does that and joins subword pieces.
+"""
+import argparse
+import warnings
+from typing import Dict, List
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.ao.quantization import default_dynamic_qconfig, float_qparams_weight_only_qconfig
+
+from corpus import SOS_token, EOS_token, UNK_token, UNK_WORD, MAX_LENGTH
+from normalization import normalizeString
+from subword import SubwordLang, joinWords
+
+
+######################################################################
+# The greedy translator
+# ---------------------
+#
+# The same computation as ``beamSearch`` with a beam of one, written out
+# in one module so TorchScript can compile it: the encoder GRU runs over
+# the padded batch and each sentence's final hidden state is its output
+# at its last real position (a one-layer unidirectional GRU's outputs are
+# its hidden states), so no packing is needed. The decoder step is
+# ``AttnDecoderRNN.step`` with dropout left out, as in ``eval()`` mode.
+#
+# An adaptive softmax output layer does not script, so its head and tail
+# projections are copied out and the full log probabilities rebuilt from
+# them, as ``AdaptiveLogSoftmaxWithLoss.log_prob`` does.
+#
+
+class GreedyTranslator(nn.Module):
+    def __init__(self, encoder, decoder, input_lang, output_lang, max_length=MAX_LENGTH):
+        super(GreedyTranslator, self).__init__()
+        if isinstance(input_lang, SubwordLang):
+            raise ValueError("cannot export a subword input vocabulary, "
+                             "its encoding does not run in TorchScript")
+        self.hidden_size = encoder.hidden_size
+        self.max_length = max_length
+        # TorchScript cannot read module globals, so the tokens are attributes
+        self.sos_token = SOS_token
+        self.eos_token = EOS_token
+        self.encoder_embedding = encoder.embedding
+        self.encoder_gru = encoder.gru
+        self.embedding = decoder.embedding
+        self.fc_hidden = decoder.fc_hidden
+        self.fc_encoder = decoder.fc_encoder
+        self.alignment_vector = decoder.alignment_vector
+        self.gru = decoder.gru
+
+        self.adaptive = decoder.adaptive_cutoffs is not None
+        if self.adaptive:
+            self.out = decoder.out.head
+            self.tails = nn.ModuleList(decoder.out.tail)
+            self.shortlist_size = decoder.out.shortlist_size
+            self.register_buffer('rank_to_word', decoder.rank_to_word.clone())
+        else:
+            self.out = decoder.out
+            self.tails = nn.ModuleList()
+            self.shortlist_size = 0
+            self.register_buffer('rank_to_word', torch.zeros(0, dtype=torch.long))
+
+        self.word2index: Dict[str, int] = dict(input_lang.word2index)
+        self.unknown = UNK_token if input_lang.index2word.get(UNK_token) == UNK_WORD else -1
+        self.index2word: List[str] = [output_lang.index2word[i] for i in range(output_lang.n_words)]
+
+    def scores(self, output):
+        if not self.adaptive:
+            return self.out(output)
+        head = F.log_softmax(self.out(output), dim=1)
+        scores = [head[:, :self.shortlist_size]]
+        for i, tail in enumerate(self.tails):
+            scores.append(F.log_softmax(tail(output), dim=1) +
+                          head[:, self.shortlist_size + i].unsqueeze(1))
+        # Columns are in frequency rank order, put them back in word order
+        ranked = torch.cat(scores, 1)
+        return torch.empty_like(ranked).index_copy_(1, self.rank_to_word, ranked)
+
+    def forward(self, input, lengths):
+        batch_size = input.size(1)
+        hidden = torch.zeros(1, batch_size, self.hidden_size)
+        encoder_outputs, _ = self.encoder_gru(self.encoder_embedding(input), hidden)
+        hidden = encoder_outputs[lengths - 1, torch.arange(batch_size)].unsqueeze(0)
+        encoder_outputs = encoder_outputs.transpose(0, 1)
+        encoder_keys = self.fc_encoder(encoder_outputs)
+        mask = torch.arange(input.size(0))[None, :] < lengths[:, None]
+
+        decoder_input = torch.full([batch_size], self.sos_token, dtype=torch.long)
+        finished = torch.zeros(batch_size, dtype=torch.bool)
+        tokens: List[torch.Tensor] = []
+        for di in range(self.max_length):
+            embedded = self.embedding(decoder_input)
+            alignment_scores = torch.tanh(self.fc_hidden(hidden[0]).unsqueeze(1) + encoder_keys)
+            alignment_scores = alignment_scores.matmul(self.alignment_vector.t()).squeeze(2)
+            attn_weights = F.softmax(alignment_scores.masked_fill(~mask, float('-inf')), dim=1)
+            context_vector = attn_weights.unsqueeze(1).bmm(encoder_outputs).squeeze(1)
+            output, hidden = self.gru(torch.cat((embedded, context_vector), 1).unsqueeze(0), hidden)
+
+            decoder_input = self.scores(output[0]).argmax(1).masked_fill(finished, self.eos_token)
+            tokens.append(decoder_input)
+            finished = finished | (decoder_input == self.eos_token)
+            if bool(finished.all()):
+                break
+        return torch.stack(tokens, 1)
+
+    @torch.jit.export
+    def translate(self, sentences: List[str]) -> List[List[str]]:
+        if len(sentences) == 0:
+            return []
+        sequences: List[List[int]] = []
+        for sentence in sentences:
+            indexes: List[int] = []
+            for word in sentence.split(' '):
+                index = self.word2index.get(word, self.unknown)
+                if index >= 0:
+                    indexes.append(index)
+            indexes.append(self.eos_token)
+            sequences.append(indexes)
+        lengths = torch.tensor([len(indexes) for indexes in sequences], dtype=torch.long)
+        input = torch.nn.utils.rnn.pad_sequence(
+            [torch.tensor(indexes, dtype=torch.long) for indexes in sequences],
+            padding_value=float(self.eos_token))
+
+        results: List[List[str]] = []
+        # TorchScript compiles the receiver of an annotated ``tolist()``
+        # twice, so ``self.forward(...).tolist()`` would decode every batch
+        # twice. Run forward on its own line first.
+        tokens = self.forward(input, lengths)
+        rows: List[List[int]] = tokens.tolist()
+        for row in rows:
+            words: List[str] = []
+            for index in row:
+                if index == self.eos_token:
+                    break
+                words.append(self.index2word[index])
+            results.append(words)
+        return results
+
+
+def exportTranslator(encoder, decoder, input_lang, output_lang, path=None, quantize=True,
+                     quantize_embeddings=True, max_length=MAX_LENGTH):
+    """Script (and by default int8-quantize) a translator; save it if ``path`` is given."""
+    translator = GreedyTranslator(encoder, decoder, input_lang, output_lang, max_length)
+    translator.eval()
+    with warnings.catch_warnings():
+        # torch.ao.quantization and torch.jit warn that they are deprecated
+        # in favour of torchao and torch.export, which do not cover this model yet
+        warnings.simplefilter('ignore')
+        if quantize:
+            qconfig = {nn.GRU: default_dynamic_qconfig, nn.Linear: default_dynamic_qconfig}
+            if quantize_embeddings:
+                qconfig[nn.Embedding] = float_qparams_weight_only_qconfig
+            translator = torch.ao.quantization.quantize_dynamic(translator, qconfig)
+        scripted = torch.jit.script(translator)
+        if path is not None:
+            torch.jit.save(scripted, path)
+    return scripted
+
+
+def loadExported(path):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return torch.jit.load(path, map_location='cpu')
+
+
+def translateExported(model, sentences):
+    with torch.no_grad():
+        outputs = model.translate([normalizeString(s) for s in sentences])
+    return [joinWords(words) for words in outputs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a checkpoint as a TorchScript translator.')
+    parser.add_argument('checkpoint')
+    parser.add_argument('output')
+    parser.add_argument('--no-quantize', dest='quantize', action='store_false',
+                        help='keep the float32 weights')
+    parser.add_argument('--float-embeddings', dest='quantize_embeddings', action='store_false',
+                        help='quantize the GRU and linear layers only')
+    parser.add_argument('--max-length', type=int, default=None,
+                        help='longest translation, default the one saved with the model')
+    args = parser.parse_args()
+
+    from checkpoint import loadCheckpoint
+    state = loadCheckpoint(args.checkpoint, map_location='cpu')
+    exportTranslator(state['encoder'], state['decoder'], state['input_lang'], state['output_lang'],
+                     args.output, args.quantize, args.quantize_embeddings,
+                     args.max_length or state['max_length'])
+    print("Wrote %s" % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""
+Neo4j graph export
+******************
+Pulls the ``(English)-[:TRANSLATES_TO]->(Spanish)`` relationships out of
+Neo4j in pages and keeps them in a local snapshot file, so TransE
+training does not have to wait on the whole graph every run.
+
+- The query is paged by relationship id (``WHERE id(r) > $after ORDER BY
+  id(r) LIMIT $limit``), so no page costs more than ``page_size`` rows on
+  either side and there is no growing ``SKIP``.
+- Rows are interned into integer (head, relation, tail) triples as they
+  arrive; only the words themselves are kept as strings. Spanish words,
+  English words and relation types each get their own dense ids, so a
+  word that exists in both languages is two entities (see below).
+- The snapshot remembers the highest relationship id it has seen, so the
+  next sync only asks for relationships created after it. Neo4j can reuse
+  the ids of deleted relationships; use ``full=True`` to rebuild the
+  snapshot after deletions.
+
+``graph`` is anything with a ``run(query, **parameters)`` method that
+yields records indexable by column name: a py2neo ``Graph``, a neo4j
+driver ``Session``, or ``LocalGraph`` below for working without a server.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+SNAPSHOT_VERSION = 2
+
+PAGE_QUERY = """
+MATCH (e:English)-[r:TRANSLATES_TO]->(s:Spanish)
+WHERE id(r) > $after
+RETURN id(r) AS rel_id, s.word AS spanish_word, e.word AS english_word, TYPE(r) AS relationship
+ORDER BY id(r)
+LIMIT $limit
+"""
+
+_query_hash = hashlib.sha256(PAGE_QUERY.encode()).hexdigest()[:16]
+
+
+def fetchPages(graph, after=-1, page_size=10000):
+    while True:
+        page = list(graph.run(PAGE_QUERY, after=after, limit=page_size))
+        if not page:
+            return
+        yield page
+        after = page[-1]['rel_id']
+        if len(page) < page_size:
+            return
+
+
+######################################################################
+# Interning
+# ---------
+#
+# Each name gets the next id the first time it is seen, so ids are dense
+# and every entity or relation type has exactly one embedding row.
+#
+# Spanish and English words are interned separately and stored with
+# their own 0-based ids. ``entityTriples`` lays them out in one typed id
+# space for TransE: Spanish entities take ids ``[0, n_spanish)`` and
+# English entities ``[n_spanish, n_spanish + n_english)``, which is also
+# the candidate range for nearest-English-word lookups.
+#
+
+class Interner:
+    def __init__(self, names=()):
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+
+    def __call__(self, name):
+        idx = self.index.get(name)
+        if idx is None:
+            idx = self.index[name] = len(self.names)
+            self.names.append(name)
+        return idx
+
+    def __len__(self):
+        return len(self.names)
+
+
+class GraphSnapshot:
+    def __init__(self):
+        self.spanish = Interner()
+        self.english = Interner()
+        self.relations = Interner()
+        self._triples = [np.zeros((0, 3), dtype=np.int32)]
+        self._rel_ids = [np.zeros(0, dtype=np.int64)]
+        self.last_id = -1
+
+    def addPage(self, page):
+        spanish, relations, english = self.spanish, self.relations, self.english
+        triples = np.array([(spanish(row['spanish_word']),
+                             relations(row['relationship']),
+                             english(row['english_word']))
+                            for row in page], dtype=np.int32).reshape(-1, 3)
+        rel_ids = np.array([row['rel_id'] for row in page], dtype=np.int64)
+        self._triples.append(triples)
+        self._rel_ids.append(rel_ids)
+        if len(rel_ids):
+            self.last_id = max(self.last_id, int(rel_ids[-1]))
+
+    @property
+    def triples(self):
+        if len(self._triples) > 1:
+            self._triples = [np.concatenate(self._triples)]
+        return self._triples[0]
+
+    @property
+    def rel_ids(self):
+        if len(self._rel_ids) > 1:
+            self._rel_ids = [np.concatenate(self._rel_ids)]
+        return self._rel_ids[0]
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self._rel_ids)
+
+    @property
+    def num_entities(self):
+        return len(self.spanish) + len(self.english)
+
+    def entityTriples(self):
+        """(head, relation, tail) as int64 in the typed entity id space."""
+        triples = self.triples.astype(np.int64)
+        triples[:, 2] += len(self.spanish)
+        return triples
+
+    def entityNames(self):
+        return self.spanish.names + self.english.names
+
+    def englishIds(self):
+        return np.arange(len(self.spanish), self.num_entities)
+
+    ######################################################################
+    # The snapshot is one uncompressed .npz: the triples as int32, the
+    # Neo4j relationship ids, and the three name lists plus metadata as
+    # JSON.
+    #
+
+    def save(self, path):
+        header = {
+            'version': SNAPSHOT_VERSION,
+            'query': _query_hash,
+            'last_id': self.last_id,
+            'spanish': self.spanish.names,
+            'english': self.english.names,
+            'relations': self.relations.names,
+        }
+        partial = path + '.partial.npz'
+        np.savez(partial, triples=self.triples, rel_ids=self.rel_ids,
+                 header=np.frombuffer(json.dumps(header).encode('utf8'), dtype=np.uint8))
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a snapshot, or return None if it is missing or stale."""
+        try:
+            with np.load(path) as data:
+                header = json.loads(data['header'].tobytes().decode('utf8'))
+                triples, rel_ids = data['triples'], data['rel_ids']
+        except (OSError, KeyError, ValueError):
+            return None
+        if header.get('version') != SNAPSHOT_VERSION or header.get('query') != _query_hash:
+            return None
+
+        snapshot = cls()
+        snapshot.spanish = Interner(header['spanish'])
+        snapshot.english = Interner(header['english'])
+        snapshot.relations = Interner(header['relations'])
+        snapshot._triples = [triples]
+        snapshot._rel_ids = [rel_ids]
+        snapshot.last_id = header['last_id']
+        return snapshot
+
+    def rows(self):
+        """The triples decoded back to (spanish, relationship, english) words."""
+        spanish, relations, english = self.spanish.names, self.relations.names, self.english.names
+        return [(spanish[h], relations[r], english[t]) for h, r, t in self.triples.tolist()]
+
+
+def syncSnapshot(graph, path, page_size=10000, full=False):
+    snapshot = None if full else GraphSnapshot.load(path)
+    if snapshot is None:
+        snapshot = GraphSnapshot()
+    before = len(snapshot)
+    for page in fetchPages(graph, snapshot.last_id, page_size):
+        snapshot.addPage(page)
+    added = len(snapshot) - before
+    if added or not os.path.exists(path):
+        snapshot.save(path)
+    print("Fetched %d new relationships, %d in snapshot" % (added, len(snapshot)))
+    return snapshot
+
+
+######################################################################
+# Local stand-in
+# --------------
+#
+# Answers ``PAGE_QUERY`` from rows held in memory, the way the Bolt
+# endpoint would, so the export can be exercised without a Neo4j server.
+# Rows are dicts with ``spanish_word``, ``english_word`` and optionally
+# ``relationship`` (default ``TRANSLATES_TO``); ``rel_id`` is assigned in
+# insertion order, like a fresh database does.
+#
+
+class LocalGraph:
+    def __init__(self, rows=()):
+        self.rows = []
+        self.queries = 0
+        for row in rows:
+            self.add(row['spanish_word'], row['english_word'],
+                     row.get('relationship', 'TRANSLATES_TO'))
+
+    def add(self, spanish_word, english_word, relationship='TRANSLATES_TO'):
+        self.rows.append({'rel_id': len(self.rows), 'spanish_word': spanish_word,
+                          'english_word': english_word, 'relationship': relationship})
+
+    def run(self, query, after=-1, limit=None):
+        if query != PAGE_QUERY:
+            raise ValueError("LocalGraph only answers graphsync.PAGE_QUERY")
+        self.queries += 1
+        # Ids are list positions, so the keyset condition is a slice
+        start = max(after + 1, 0)
+        end = len(self.rows) if limit is None else start + limit
+        return iter(self.rows[start:end])
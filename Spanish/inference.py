@@ -0,0 +1,158 @@
+"""
+Inference
+*********
+Translating sentences with a trained encoder and attention decoder,
+without any of the training code: ``evaluate`` one sentence at a time
+with its attention weights, or ``translate_batch`` for many at once.
+"""
+import time
+
+import torch
+
+from corpus import SOS_token, EOS_token, MAX_LENGTH
+from seq2seq import device, lengthMask, paddedTensorFromSentences, tensorFromSentence, EncoderKeys
+
+
+######################################################################
+# Evaluation
+# ==========
+#
+# Evaluation is mostly the same as training, but there are no targets so
+# we simply feed the decoder's predictions back to itself for each step.
+# Every time it predicts a word we add it to the output string, and if it
+# predicts the EOS token we stop there. We also store the decoder's
+# attention outputs for display later, one column per input word.
+# ``max_length`` only limits the length of the translation.
+#
+
+def evaluate(encoder, decoder, input_lang, output_lang, sentence, max_length=MAX_LENGTH):
+    with torch.no_grad():
+        input_tensor = tensorFromSentence(input_lang, sentence)
+        input_length = input_tensor.size()[0]
+        encoder_hidden = encoder.initHidden()
+
+        encoder_outputs = []
+        for ei in range(input_length):
+            encoder_output, encoder_hidden = encoder(input_tensor[ei],
+                                                     encoder_hidden)
+            encoder_outputs.append(encoder_output[0])
+
+        encoder_keys = decoder.encoderKeys(torch.cat(encoder_outputs))
+
+        decoder_input = torch.tensor([[SOS_token]], device=device)  # SOS
+
+        decoder_hidden = encoder_hidden
+
+        decoded_words = []
+        decoder_attentions = torch.zeros(max_length, input_length)
+
+        for di in range(max_length):
+            decoder_output, decoder_hidden, decoder_attention = decoder(
+                decoder_input, decoder_hidden, encoder_keys)
+            decoder_attentions[di] = decoder_attention.data
+            topv, topi = decoder_output.data.topk(1)
+            if topi.item() == EOS_token:
+                decoded_words.append('<EOS>')
+                break
+            else:
+                decoded_words.append(output_lang.index2word[topi.item()])
+
+            decoder_input = topi.squeeze().detach()
+
+        return decoded_words, decoder_attentions[:di + 1]
+
+
+######################################################################
+# Batched beam search
+# -------------------
+#
+# For translating many sentences offline, ``translate_batch`` encodes a
+# whole length-bucketed batch at once and runs beam search over it with
+# tensor operations only, so there is no ``.item()`` round trip per
+# token. Each sentence keeps ``beam_size`` hypotheses; a hypothesis that
+# emits ``EOS`` is frozen with its score while the others keep going, and
+# the batch stops when every hypothesis has finished or ``max_length`` is
+# reached. The result for every sentence is an n-best list of
+# ``(words, score)`` pairs, best first, where the score is the summed log
+# probability of the hypothesis. ``report`` prints the throughput.
+#
+
+def beamSearch(encoder, decoder, input_tensor, input_lengths, beam_size, max_length=MAX_LENGTH):
+    batch_size = input_tensor.size(1)
+    encoder_outputs, encoder_hidden = encoder(
+        input_tensor, encoder.initHidden(batch_size), input_lengths)
+    encoder_keys = decoder.encoderKeys(
+        encoder_outputs, lengthMask(input_lengths, encoder_outputs.size(1)))
+
+    # Every sentence gets ``beam_size`` rows, laid out sentence by sentence
+    encoder_keys = EncoderKeys(*(t.repeat_interleave(beam_size, dim=0) for t in encoder_keys))
+    decoder_hidden = encoder_hidden.repeat_interleave(beam_size, dim=1)
+    decoder_input = torch.full((batch_size * beam_size,), SOS_token, dtype=torch.long, device=device)
+
+    # Only the first beam is live at the start, the copies would be duplicates
+    scores = torch.full((batch_size, beam_size), float('-inf'), device=device)
+    scores[:, 0] = 0
+    history = torch.empty(batch_size * beam_size, 0, dtype=torch.long, device=device)
+    finished = torch.zeros(batch_size * beam_size, dtype=torch.bool, device=device)
+    offsets = (torch.arange(batch_size, device=device) * beam_size).unsqueeze(1)
+
+    for di in range(max_length):
+        decoder_output, decoder_hidden, decoder_attention = decoder(
+            decoder_input, decoder_hidden, encoder_keys)
+        n_words = decoder_output.size(1)
+        # Finished hypotheses can only repeat EOS, at no cost
+        decoder_output = decoder_output.masked_fill(finished.unsqueeze(1), float('-inf'))
+        decoder_output[:, EOS_token] = decoder_output[:, EOS_token].masked_fill(finished, 0)
+
+        candidates = (scores.view(-1, 1) + decoder_output).view(batch_size, -1)
+        scores, topi = candidates.topk(beam_size, dim=1)
+        rows = (offsets + topi // n_words).view(-1)
+        decoder_input = (topi % n_words).view(-1)
+
+        decoder_hidden = decoder_hidden[:, rows]
+        history = torch.cat((history[rows], decoder_input.unsqueeze(1)), 1)
+        finished = finished[rows] | (decoder_input == EOS_token)
+        if finished.all():
+            break
+
+    return scores, history.view(batch_size, beam_size, -1)
+
+
+def translate_batch(encoder, decoder, input_lang, output_lang, sentences, beam_size=1, n_best=1, batch_size=64, max_length=MAX_LENGTH, report=True):
+    start = time.time()
+    n_best = min(n_best, beam_size)
+    was_training = encoder.training, decoder.training
+    encoder.eval()
+    decoder.eval()
+
+    results = [None] * len(sentences)
+    n_tokens = 0
+    # Bucket by length so each batch needs little padding
+    order = sorted(range(len(sentences)), key=lambda i: len(sentences[i].split(' ')))
+    with torch.no_grad():
+        for k in range(0, len(order), batch_size):
+            chunk = order[k:k + batch_size]
+            input_tensor, input_lengths = paddedTensorFromSentences(
+                input_lang, [sentences[i] for i in chunk])
+            scores, history = beamSearch(encoder, decoder, input_tensor,
+                                         input_lengths, beam_size, max_length)
+            scores, history = scores.tolist(), history.tolist()
+            for b, i in enumerate(chunk):
+                nbest = []
+                for beam in range(n_best):
+                    words = []
+                    for index in history[b][beam]:
+                        if index == EOS_token:
+                            break
+                        words.append(output_lang.index2word[index])
+                    nbest.append((words, scores[b][beam]))
+                n_tokens += len(nbest[0][0]) + 1
+                results[i] = nbest
+
+    encoder.train(was_training[0])
+    decoder.train(was_training[1])
+    if report:
+        elapsed = max(time.time() - start, 1e-9)
+        print('Translated %d sentences in %.2fs (%.1f sentences/s, %.1f tokens/s)' % (
+            len(sentences), elapsed, len(sentences) / elapsed, n_tokens / elapsed))
+    return results
@@ -0,0 +1,94 @@
+"""
+Knowledge graph
+***************
+The word-level half of the project: the ``(English)-[:TRANSLATES_TO]->
+(Spanish)`` graph in Neo4j is synced to a local snapshot (graphsync.py),
+embedded with TransE (transe.py), and the nearest English word to a
+Spanish one is looked up in the embeddings (wordlookup.py).
+
+Nothing runs on import. py2neo and torch are only imported by the
+functions that need them, so the lookup can be loaded with numpy alone.
+``runKnowledgeGraph`` does the whole thing, as the script does.
+
+https://medium.com/stanford-cs224w/simple-schemes-for-knowledge-graph-embedding-dd07c61f3267
+"""
+import graphsync
+from wordlookup import WordLookup
+
+
+######################################################################
+# Making connection to our neo4j database via py2neo. Remember to change
+# the password to your own when running the program.
+#
+
+def connectGraph(uri="bolt://localhost:7687", user="neo4j", password="password"):
+    from py2neo import Graph
+    return Graph(uri, user=user, password=password)
+
+
+######################################################################
+# The snapshot interns every unique Spanish word, English word and
+# relation type once, with dense ids. Spanish entities take ids
+# [0, n_spanish) and English entities the range after them, so "no" the
+# Spanish word and "no" the English word are different entities.
+#
+# TransE is trained in batches (see transe.py); the learned entity
+# embeddings come back as a numpy array.
+#
+
+def embedGraph(snapshot, embedding_dim=50, num_epochs=10, batch_size=1024, learning_rate=0.01,
+               margin=1.0):
+    import torch
+    from transe import TransE, trainTransE
+
+    model = TransE(snapshot.num_entities, len(snapshot.relations), embedding_dim)
+    triples = torch.from_numpy(snapshot.entityTriples())
+    trainTransE(model, triples, num_epochs, batch_size=batch_size,
+                learning_rate=learning_rate, margin=margin)
+    return model.entity_embeddings.weight.data.numpy()
+
+
+def lookupFromSnapshot(snapshot, entity_embeddings):
+    return WordLookup(entity_embeddings, snapshot.spanish.index, snapshot.englishIds(),
+                      snapshot.entityNames())
+
+
+def wordLoop(lookup):
+    while True:
+        user_input = input("Enter a word in Spanish (or 'exit' to quit): ")
+        if user_input.lower() == "exit":
+            break
+
+        # Closest English embedding
+        closest = lookup.nearest([user_input])[0]
+        if closest:
+            english_word = closest[0][0]
+            print(f"The corresponding English word for '{user_input}' is '{english_word}'.")
+        else:
+            print("Word not found in the vocabulary.")
+
+
+######################################################################
+# Syncs the snapshot from ``graph`` (by default the local Neo4j server),
+# trains TransE, prints every entity, saves the lookup for server.py to
+# ``lookup_path`` and, if ``interactive``, asks for words to look up.
+#
+
+def runKnowledgeGraph(graph=None, snapshot_path='graph_snapshot.npz', lookup_path='word_lookup.npz',
+                      embedding_dim=50, num_epochs=10, interactive=True):
+    if graph is None:
+        graph = connectGraph()
+    snapshot = graphsync.syncSnapshot(graph, snapshot_path)
+    entity_embeddings = embedGraph(snapshot, embedding_dim, num_epochs)
+
+    # Print the learned embeddings
+    for idx, entity in enumerate(snapshot.entityNames()):
+        print(idx, entity)
+    print("----------------------")
+
+    lookup = lookupFromSnapshot(snapshot, entity_embeddings)
+    if lookup_path:
+        lookup.save(lookup_path)
+    if interactive:
+        wordLoop(lookup)
+    return lookup
@@ -0,0 +1,97 @@
+"""
+Sentence normalization
+**********************
+Fast version of the ``normalizeString`` used to clean the corpus and the
+sentences typed in at translation time: lowercase, strip accents and
+trim everything that is not a letter or ``.!?``.
+
+The output is exactly the same as the original implementation, which is
+kept here as ``referenceNormalizeString`` so the two can be compared (see
+``python benchmarks.py normalize``).
+"""
+import re
+import string
+import unicodedata
+from functools import lru_cache
+
+
+######################################################################
+# Original implementation
+# -----------------------
+#
+# Turn a Unicode string to plain ASCII, thanks to
+# https://stackoverflow.com/a/518232/2809427
+# then lowercase, trim, and remove non-letter characters.
+#
+
+def referenceUnicodeToAscii(s):
+    return ''.join(
+        c for c in unicodedata.normalize('NFD', s)
+        if unicodedata.category(c) != 'Mn'
+    )
+
+def referenceNormalizeString(s):
+    s = referenceUnicodeToAscii(s.lower().strip())
+    s = re.sub(r"([.!?])", r" \1", s)
+    s = re.sub(r"[^a-zA-Z.!?]+", r" ", s)
+    return s
+
+
+######################################################################
+# Fast implementation
+# -------------------
+#
+# NFD works character by character, so stripping accents can be done
+# with ``str.translate`` and a table from each character to its
+# decomposition without the combining marks (``é`` → ``e``, a bare
+# combining accent → nothing). The table fills itself in the first time
+# a character is seen. Pure ASCII strings have nothing to decompose and
+# skip the table altogether, which is most of an English/Spanish corpus
+# after lowercasing.
+#
+# The ``[^a-zA-Z.!?]+`` substitution is done the same way: a second table
+# turns every other character into a space, and the runs of spaces are
+# then squeezed to one, which is what the regex does to each run.
+#
+
+class _AccentTable(dict):
+    def __missing__(self, code):
+        stripped = referenceUnicodeToAscii(chr(code))
+        self[code] = stripped
+        return stripped
+
+
+class _LetterTable(dict):
+    def __missing__(self, code):
+        char = chr(code)
+        kept = char if char in _letters else ' '
+        self[code] = kept
+        return kept
+
+_letters = frozenset(string.ascii_letters + '.!?')
+_accent_table = _AccentTable()
+_letter_table = _LetterTable()
+
+
+def unicodeToAscii(s):
+    if s.isascii():
+        return s
+    return s.translate(_accent_table)
+
+
+# Lowercase, trim, and remove non-letter characters
+def normalizeString(s):
+    s = unicodeToAscii(s.lower().strip())
+    # Same as re.sub(r"([.!?])", r" \1", s)
+    s = s.replace('.', ' .').replace('!', ' !').replace('?', ' ?')
+    # Same as re.sub(r"[^a-zA-Z.!?]+", r" ", s)
+    s = s.translate(_letter_table)
+    while '  ' in s:
+        s = s.replace('  ', ' ')
+    return s
+
+
+# Interactive queries and duplicated corpus lines repeat the same
+# sentences, so callers can put a bounded LRU cache in front.
+def cachedNormalizer(maxsize=65536):
+    return lru_cache(maxsize=maxsize)(normalizeString)
@@ -0,0 +1,210 @@
+"""
+Data-parallel training
+**********************
+Trains the encoder and attention decoder in several worker processes on
+one machine, with ``torch.distributed`` over the gloo backend.
+
+- Worker ``rank`` of ``workers`` trains on every ``workers``-th pair
+  (its shard), in length-bucketed batches of ``batch_size``, so one
+  iteration covers ``workers * batch_size`` sentences.
+- After each backward pass the gradients of both models are averaged
+  over all workers with a single all-reduce of one flat buffer, the same
+  reduction ``DistributedDataParallel`` does but for two modules and a
+  decoder that is called once per target step. Every worker then takes
+  the same SGD step, so the replicas stay identical.
+- Worker 0 trains the caller's models in place (their parameters are
+  moved to shared memory first), prints the loss like ``trainIters`` and
+  writes the checkpoints.
+
+Workers are forked, so they inherit the prepared pairs and vocabularies
+without pickling them and without re-running the training script. The
+intra-op thread pool is split evenly between them.
+"""
+import copy
+import os
+import random
+import socket
+import time
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch import optim
+
+import checkpoint
+from seq2seq import mixedPrecision
+from training import iterBatches, batchLoss, timeSince
+
+
+def freePort():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def shardIndices(n_pairs, rank, workers):
+    return np.arange(rank, n_pairs, workers)
+
+
+######################################################################
+# Gradients are copied into one flat buffer, reduced with a single
+# ``all_reduce`` and copied back, averaged over the workers. The last
+# three slots carry the summed loss, token count and sentence count of
+# the step, so worker 0 can report the loss over all shards for free.
+#
+
+class GradientAllReduce:
+    def __init__(self, modules, workers):
+        self.params = [p for module in modules for p in module.parameters() if p.requires_grad]
+        self.buffer = torch.zeros(sum(p.numel() for p in self.params) + 3)
+        self.workers = workers
+
+    def __call__(self, loss, n_tokens, n_sentences):
+        offset = 0
+        for p in self.params:
+            n = p.numel()
+            if p.grad is None:
+                self.buffer[offset:offset + n].zero_()
+            else:
+                self.buffer[offset:offset + n].copy_(p.grad.reshape(-1))
+            offset += n
+        self.buffer[-3:] = torch.tensor([loss, n_tokens, n_sentences], dtype=self.buffer.dtype)
+
+        dist.all_reduce(self.buffer)
+
+        self.buffer[:-3].div_(self.workers)
+        offset = 0
+        for p in self.params:
+            n = p.numel()
+            if p.grad is None:
+                p.grad = torch.empty_like(p)
+            p.grad.copy_(self.buffer[offset:offset + n].view_as(p))
+            offset += n
+        return self.buffer[-3:].tolist()
+
+
+def _worker(rank, workers, port, encoder, decoder, pairs, input_lang, output_lang, n_iters,
+            settings, results):
+    torch.set_num_threads(settings['threads'])
+    random.seed(settings['seed'] + rank)
+    np.random.seed(settings['seed'] + rank)
+    torch.manual_seed(settings['seed'] + rank)
+    dist.init_process_group('gloo', init_method='tcp://127.0.0.1:%d' % port,
+                            rank=rank, world_size=workers)
+    try:
+        if rank != 0:
+            encoder, decoder = copy.deepcopy(encoder), copy.deepcopy(decoder)
+        _trainShard(rank, workers, encoder, decoder, pairs, input_lang, output_lang, n_iters,
+                    settings, results)
+    finally:
+        dist.destroy_process_group()
+
+
+def _trainShard(rank, workers, encoder, decoder, pairs, input_lang, output_lang, n_iters,
+                settings, results):
+    checkpoint_path = settings['checkpoint_path']
+    encoder_optimizer = optim.SGD(encoder.parameters(), lr=settings['learning_rate'])
+    decoder_optimizer = optim.SGD(decoder.parameters(), lr=settings['learning_rate'])
+    done = settings['done']
+    if done:
+        # Every worker reads the same checkpoint, so they resume identical
+        checkpoint.resumeTraining(checkpoint_path, encoder, decoder,
+                                  encoder_optimizer, decoder_optimizer,
+                                  input_lang, output_lang)
+
+    reduce = GradientAllReduce((encoder, decoder), workers)
+    batches = iterBatches(pairs, settings['batch_size'], shardIndices(len(pairs), rank, workers))
+    print_every, plot_every = settings['print_every'], settings['plot_every']
+    plot_losses = []
+    print_loss_total = 0  # Reset every print_every
+    plot_loss_total = 0  # Reset every plot_every
+    n_sentences = n_tokens = 0
+
+    start = time.time()
+    for iter in range(done + 1, n_iters + 1):
+        input_tensor, input_lengths, target_tensor, target_lengths = next(batches)
+        encoder_optimizer.zero_grad()
+        decoder_optimizer.zero_grad()
+        with mixedPrecision(settings['mixed_precision']):
+            loss, tokens = batchLoss(input_tensor, input_lengths, target_tensor, target_lengths,
+                                     encoder, decoder, settings['teacher_forcing_ratio'])
+        (loss / input_tensor.size(1)).backward()
+        loss, tokens, sentences = reduce(loss.item(), tokens.item(), input_tensor.size(1))
+        encoder_optimizer.step()
+        decoder_optimizer.step()
+
+        loss = loss / tokens
+        n_sentences += sentences
+        n_tokens += tokens
+        print_loss_total += loss
+        plot_loss_total += loss
+        if rank != 0:
+            continue
+
+        if iter % print_every == 0:
+            print_loss_avg = print_loss_total / print_every
+            print_loss_total = 0
+            print('%s (%d %d%%) %.4f' % (timeSince(start, (iter - done) / (n_iters - done)),
+                                         iter, iter / n_iters * 100, print_loss_avg))
+
+        if iter % plot_every == 0:
+            plot_loss_avg = plot_loss_total / plot_every
+            plot_losses.append(plot_loss_avg)
+            plot_loss_total = 0
+
+        if checkpoint_path and (iter % settings['save_every'] == 0 or iter == n_iters):
+            checkpoint.saveCheckpoint(checkpoint_path, encoder, decoder, input_lang, output_lang,
+                                      encoder_optimizer, decoder_optimizer, iter)
+
+    if rank == 0:
+        results.put({'seconds': time.time() - start, 'sentences': n_sentences,
+                     'tokens': n_tokens, 'plot_losses': plot_losses})
+
+
+######################################################################
+# ``trainParallel`` takes the same arguments as ``trainIters`` plus the
+# prepared data and the number of workers. ``batch_size`` is per worker.
+# It returns once all workers have finished, with the models trained in
+# place and worker 0's timing: seconds spent in the training loop and
+# the sentences and target tokens processed by all workers.
+#
+
+def trainParallel(encoder, decoder, pairs, input_lang, output_lang, n_iters, workers,
+                  print_every=1000, plot_every=100, learning_rate=0.01, batch_size=32,
+                  teacher_forcing_ratio=1, checkpoint_path=None, save_every=1000,
+                  mixed_precision=False):
+    done = 0
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        done = torch.load(checkpoint_path, weights_only=True)['iteration']
+        print("Resuming from %s at iteration %d" % (checkpoint_path, done))
+        if done >= n_iters:
+            return None
+
+    settings = {
+        'threads': max(1, torch.get_num_threads() // workers),
+        'seed': random.randrange(2 ** 31),
+        'learning_rate': learning_rate,
+        'batch_size': batch_size,
+        'teacher_forcing_ratio': teacher_forcing_ratio,
+        'mixed_precision': mixed_precision,
+        'print_every': print_every,
+        'plot_every': plot_every,
+        'checkpoint_path': checkpoint_path,
+        'save_every': save_every,
+        'done': done,
+    }
+    encoder.share_memory()
+    decoder.share_memory()
+    results = mp.get_context('fork').SimpleQueue()
+    context = mp.start_processes(_worker, nprocs=workers, join=False, start_method='fork',
+                                 args=(workers, freePort(), encoder, decoder, pairs,
+                                       input_lang, output_lang, n_iters, settings, results))
+    # Collect worker 0's result while waiting, so it never blocks on a full pipe
+    result = None
+    while not context.join(timeout=0.1):
+        if result is None and not results.empty():
+            result = results.get()
+    if result is None and not results.empty():
+        result = results.get()
+    return result
@@ -0,0 +1,65 @@
+"""
+Plots
+*****
+The training loss curve and attention matrices, drawn with matplotlib.
+matplotlib is only imported when a plot is drawn, so importing this
+module costs nothing.
+"""
+
+
+######################################################################
+# Plotting results
+# ----------------
+#
+# Plotting is done with matplotlib, using the array of loss values
+# ``plot_losses`` saved while training.
+#
+
+def showPlot(points):
+    import matplotlib.pyplot as plt
+    import matplotlib.ticker as ticker
+
+    plt.figure()
+    fig, ax = plt.subplots()
+    # this locator puts ticks at regular intervals
+    loc = ticker.MultipleLocator(base=0.2)
+    ax.yaxis.set_major_locator(loc)
+    plt.plot(points)
+
+
+######################################################################
+# Visualizing Attention
+# ---------------------
+#
+# A useful property of the attention mechanism is its highly interpretable
+# outputs. Because it is used to weight specific encoder outputs of the
+# input sequence, we can imagine looking where the network is focused most
+# at each time step.
+#
+# You could simply run ``plt.matshow(attentions)`` to see attention output
+# displayed as a matrix, with the columns being input steps and rows being
+# output steps. For a better viewing experience we will do the extra work
+# of adding axes and labels. With a ``path`` the figure is saved there.
+#
+
+def showAttention(input_sentence, output_words, attentions, path=None):
+    import matplotlib.pyplot as plt
+    import matplotlib.ticker as ticker
+
+    # Set up figure with colorbar
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    cax = ax.matshow(attentions.numpy(), cmap='bone')
+    fig.colorbar(cax)
+
+    # Set up axes
+    ax.set_xticklabels([''] + input_sentence.split(' ') +
+                       ['<EOS>'], rotation=90)
+    ax.set_yticklabels([''] + output_words)
+
+    # Show label at every tick
+    ax.xaxis.set_major_locator(ticker.MultipleLocator(1))
+    ax.yaxis.set_major_locator(ticker.MultipleLocator(1))
+
+    if path is not None:
+        plt.savefig(path)
@@ -0,0 +1,183 @@
+"""
+Parallel corpus preprocessing
+*****************************
+Reads, normalizes and filters a sentence file in several processes and
+builds the same pairs and vocabularies as the serial ``prepareData``.
+Run from the Spanish folder to fill the dataset cache (see datacache.py)
+before training::
+
+    python preprocess.py spashort.txt --workers 4
+
+- The file is split into byte ranges that start and end on line
+  boundaries, several per worker so that uneven chunks even out.
+- Each worker decodes its range, runs the same ``pairsFromLines`` as
+  ``readPairs`` over it, and counts the words of its pairs into its own
+  ``Lang``, returning the word counts (in order of first use) and the
+  pairs as word indexes of that ``Lang``.
+- The chunks are merged in file order. A word gets its index the first
+  time a chunk introduces it, so the vocabulary order is the serial one,
+  and the ``word2count`` tallies are summed. A pair already kept from an
+  earlier chunk is dropped as a duplicate and its words are taken off the
+  tallies again.
+
+``python benchmarks.py preprocess`` checks the output against the serial
+path and times it by worker count.
+"""
+import argparse
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import datacache
+from corpus import (SOS_token, EOS_token, UNK_token, MAX_LENGTH, Lang, newLoadStats, pairsFromLines,
+                    prepareData)
+
+
+######################################################################
+# Chunks
+# ------
+#
+# Each boundary is moved forward to just after the next newline, so no
+# line (or UTF-8 character) is split. A range is decoded through the same
+# text layer ``open`` uses, so line endings are handled as in the serial
+# path.
+#
+
+def chunkRanges(path, n_chunks):
+    size = os.path.getsize(path)
+    starts = [0]
+    with open(path, 'rb') as f:
+        for k in range(1, n_chunks):
+            f.seek(max(size * k // n_chunks - 1, 0))
+            f.readline()
+            start = f.tell()
+            if starts[-1] < start < size:
+                starts.append(start)
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def readChunk(path, start, end, reverse, max_length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    lines = io.TextIOWrapper(io.BytesIO(data), encoding="utf8")
+
+    stats = newLoadStats()
+    input_lang, output_lang = Lang('input'), Lang('output')
+    keys = []
+    input_indexes = []
+    target_indexes = []
+    for pair in pairsFromLines(lines, reverse, stats, max_length=max_length):
+        input_lang.addSentence(pair[0])
+        output_lang.addSentence(pair[1])
+        keys.append((pair[0], pair[1]))
+        input_indexes.append([input_lang.word2index[word] for word in pair[0].split(' ')])
+        target_indexes.append([output_lang.word2index[word] for word in pair[1].split(' ')])
+    return (list(input_lang.word2count.items()), list(output_lang.word2count.items()), keys,
+            datacache.TokenArrays.fromSequences(input_indexes),
+            datacache.TokenArrays.fromSequences(target_indexes), stats)
+
+
+######################################################################
+# Merging
+# -------
+#
+# ``mergeVocabulary`` adds a chunk's words to ``lang`` and returns the
+# array that maps the chunk's word indexes to ``lang``'s. Every ``Lang``
+# starts with SOS, EOS and UNK, which map to themselves.
+#
+
+def mergeVocabulary(lang, word_counts):
+    remap = np.empty(UNK_token + 1 + len(word_counts), dtype=np.int32)
+    remap[:UNK_token + 1] = (SOS_token, EOS_token, UNK_token)
+    for i, (word, count) in enumerate(word_counts, UNK_token + 1):
+        if word not in lang.word2index:
+            lang.word2index[word] = lang.n_words
+            lang.index2word[lang.n_words] = word
+            lang.word2count[word] = 0
+            lang.n_words += 1
+        lang.word2count[word] += count
+        remap[i] = lang.word2index[word]
+    return remap
+
+
+# Drops the pairs not in ``keep`` from a chunk's word indexes and takes
+# their words off ``lang``'s tallies.
+def keptTokens(lang, ids, lengths, keep):
+    token_keep = np.repeat(keep, lengths)
+    dropped = np.bincount(ids[~token_keep], minlength=lang.n_words)
+    for index in np.flatnonzero(dropped).tolist():
+        lang.word2count[lang.index2word[index]] -= int(dropped[index])
+    return ids[token_keep], lengths[keep]
+
+
+def mergeChunks(lang1, lang2, reverse, chunks):
+    if reverse:
+        input_lang, output_lang = Lang(lang2), Lang(lang1)
+    else:
+        input_lang, output_lang = Lang(lang1), Lang(lang2)
+    stats = newLoadStats()
+    seen = set()
+    input_parts, target_parts = [], []
+    for input_counts, output_counts, keys, inputs, targets, chunk_stats in chunks:
+        for name, count in chunk_stats.items():
+            stats[name] += count
+        input_ids = mergeVocabulary(input_lang, input_counts)[inputs.ids]
+        target_ids = mergeVocabulary(output_lang, output_counts)[targets.ids]
+
+        keep = np.ones(len(keys), dtype=bool)
+        for i, key in enumerate(keys):
+            if key in seen:
+                keep[i] = False
+            else:
+                seen.add(key)
+        stats['duplicates'] += int((~keep).sum())
+        stats['kept'] -= int((~keep).sum())
+        input_parts.append(keptTokens(input_lang, input_ids, inputs.lengths(), keep))
+        target_parts.append(keptTokens(output_lang, target_ids, targets.lengths(), keep))
+
+    def concatenate(parts):
+        lengths = np.concatenate([np.zeros(1, dtype=np.int64)] + [p[1] for p in parts])
+        ids = np.concatenate([np.zeros(0, dtype=np.int32)] + [p[0] for p in parts])
+        return datacache.TokenArrays(ids, np.cumsum(lengths))
+
+    return input_lang, output_lang, concatenate(input_parts), concatenate(target_parts), stats
+
+
+######################################################################
+# ``readPairsParallel`` is what ``buildPairs`` calls with ``workers``
+# above 1. The chunks are merged as they come back, in order, while the
+# workers go on with the later ones.
+#
+
+def readPairsParallel(lang1, lang2, reverse, path, max_length=MAX_LENGTH, workers=2,
+                      chunks_per_worker=4):
+    ranges = chunkRanges(path, workers * chunks_per_worker)
+    print("Reading lines in %d chunks with %d workers..." % (len(ranges), workers))
+    with ProcessPoolExecutor(workers) as executor:
+        chunks = executor.map(readChunk, [path] * len(ranges), [r[0] for r in ranges],
+                              [r[1] for r in ranges], [reverse] * len(ranges),
+                              [max_length] * len(ranges))
+        return mergeChunks(lang1, lang2, reverse, chunks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prepare and cache a sentence file in parallel.')
+    parser.add_argument('path', nargs='?', default='spavshort.txt')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--cache-dir', default='.cache')
+    parser.add_argument('--max-length', type=int, default=MAX_LENGTH, help='0 for no limit')
+    parser.add_argument('--subword-vocab-size', type=int, default=None)
+    parser.add_argument('--no-reverse', dest='reverse', action='store_false',
+                        help='translate eng to spa instead of spa to eng')
+    args = parser.parse_args()
+
+    prepareData('eng', 'spa', args.reverse, path=args.path, cache_dir=args.cache_dir,
+                max_length=args.max_length or None, subword_vocab_size=args.subword_vocab_size,
+                workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+"""
+Sequence to sequence models
+***************************
+The GRU encoder and the (attention) decoders, plus the helpers that turn
+sentences and word indexes into the tensors they take.
+"""
+from collections import namedtuple
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from corpus import EOS_token, MAX_LENGTH, indexesFromSentence
+
+# I assume cpu for me
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+# Opt-in mixed precision for training: inside ``with mixedPrecision():``
+# the linear layers and attention products run in bfloat16 while the
+# GRUs, softmaxes and losses stay float32 (see ``torch.autocast``). On
+# CPUs with AVX512-BF16 or AMX the products are faster and the
+# activations kept for backward are half the size.
+def mixedPrecision(enabled=True):
+    return torch.autocast(device.type, dtype=torch.bfloat16, enabled=enabled)
+
+
+######################################################################
+# The Encoder
+# -----------
+#
+# The encoder of a seq2seq network is a RNN that outputs some value for
+# every word from the input sentence. For every input word the encoder
+# outputs a vector and a hidden state, and uses the hidden state for the
+# next input word.
+#
+# .. figure:: /_static/img/seq-seq-images/encoder-network.png
+#    :alt:
+#
+# sizes
+
+class EncoderRNN(nn.Module):
+    def __init__(self, input_size, hidden_size):
+        print("Encoder ")
+        print(input_size, hidden_size)
+        super(EncoderRNN, self).__init__()
+        self.hidden_size = hidden_size
+
+        self.embedding = nn.Embedding(input_size, hidden_size)
+        self.gru = nn.GRU(hidden_size, hidden_size)
+
+    def forward(self, input, hidden, lengths=None):
+        if lengths is None:
+            embedded = self.embedding(input).view(1, 1, -1)
+            output = embedded
+            output, hidden = self.gru(output, hidden)
+            return output, hidden
+
+        # Batched: ``input`` is a padded (seq_len, batch) tensor, so the
+        # whole sequence goes through nn.GRU in one call. Outputs come back
+        # as (batch, seq_len, hidden) for the attention decoder.
+        embedded = self.embedding(input)
+        packed = nn.utils.rnn.pack_padded_sequence(
+            embedded, lengths.cpu(), enforce_sorted=False)
+        output, hidden = self.gru(packed, hidden)
+        output, _ = nn.utils.rnn.pad_packed_sequence(
+            output, batch_first=True, total_length=input.size(0))
+        return output, hidden
+
+    def initHidden(self, batch_size=1):
+        return torch.zeros(1, batch_size, self.hidden_size, device=device)
+
+######################################################################
+# The Decoder
+# -----------
+#
+# The decoder is another RNN that takes the encoder output vector(s) and
+# outputs a sequence of words to create the translation.
+#
+
+
+######################################################################
+# Simple Decoder
+# ^^^^^^^^^^^^^^
+#
+# In the simplest seq2seq decoder we use only last output of the encoder.
+# This last output is sometimes called the *context vector* as it encodes
+# context from the entire sequence. This context vector is used as the
+# initial hidden state of the decoder.
+#
+# At every step of decoding, the decoder is given an input token and
+# hidden state. The initial input token is the start-of-string ``<SOS>``
+# token, and the first hidden state is the context vector (the encoder's
+# last hidden state).
+#
+# .. figure:: /_static/img/seq-seq-images/decoder-network.png
+#    :alt:
+#
+#
+
+class DecoderRNN(nn.Module):
+    def __init__(self, hidden_size, output_size):
+        print("Decoder ")
+        print(hidden_size, output_size)
+        super(DecoderRNN, self).__init__()
+        self.hidden_size = hidden_size
+
+        self.embedding = nn.Embedding(output_size, hidden_size)
+        self.gru = nn.GRU(hidden_size, hidden_size)
+        self.out = nn.Linear(hidden_size, output_size)
+        self.softmax = nn.LogSoftmax(dim=1)
+
+    def forward(self, input, hidden):
+        output = self.embedding(input).view(1, 1, -1)
+        output = F.relu(output)
+        output, hidden = self.gru(output, hidden)
+        output = self.softmax(self.out(output[0]))
+        return output, hidden
+
+    def initHidden(self):
+        return torch.zeros(1, 1, self.hidden_size, device=device)
+
+######################################################################
+# I encourage you to train and observe the results of this model, but to
+# save space we'll be going straight for the gold and introducing the
+# Attention Mechanism.
+#
+
+
+######################################################################
+# Attention Decoder
+# ^^^^^^^^^^^^^^^^^
+#
+# If only the context vector is passed between the encoder and decoder,
+# that single vector carries the burden of encoding the entire sentence.
+#
+# Attention allows the decoder network to "focus" on a different part of
+# the encoder's outputs for every step of the decoder's own outputs. First
+# we calculate a set of *attention weights*. These will be multiplied by
+# the encoder output vectors to create a weighted combination. The result
+# (called ``attn_applied`` in the code) should contain information about
+# that specific part of the input sequence, and thus help the decoder
+# choose the right output words.
+#
+# .. figure:: https://i.imgur.com/1152PYf.png
+#    :alt:
+#
+# Calculating the attention weights is done with another feed-forward
+# layer ``attn``, using the decoder's input and hidden state as inputs.
+# Because there are sentences of all sizes in the training data, to
+# actually create and train this layer we have to choose a maximum
+# sentence length (input length, for encoder outputs) that it can apply
+# to. Sentences of the maximum length will use all the attention weights,
+# while shorter sentences will only use the first few.
+#
+# .. figure:: /_static/img/seq-seq-images/attention-decoder-network.png
+#    :alt:
+#
+# The encoder outputs do not change while a sentence is decoded, so their
+# projection ``fc_encoder(encoder_outputs)`` (the attention keys) only
+# needs computing once. ``encoderKeys`` does that and returns it with the
+# outputs and the mask of real source positions; ``forward`` takes either
+# that or the raw encoder outputs. Pass the outputs of the real source
+# positions only, or a mask, so attention never looks at padding. The
+# source can be any length; ``max_length`` is only kept with the model as
+# its default limit on sentence length.
+#
+# Output layer
+# ^^^^^^^^^^^^
+#
+# By default every step ends in ``log_softmax`` over the whole output
+# vocabulary, which is most of the cost of a step once the vocabulary is
+# large. With ``adaptive_cutoffs`` the output layer is an adaptive
+# softmax (Grave et al., 2017) instead: the words are ordered by
+# ``word_counts``, the most frequent ones up to the first cutoff are
+# scored directly, and each band of rarer words between two cutoffs is a
+# cluster with a smaller projection that is only evaluated for the
+# targets that fall in it. ``forward`` still returns exact log
+# probabilities over the whole vocabulary, so evaluation and beam search
+# are unchanged; the saving is in training, through ``step`` (the GRU
+# output before the output layer), ``targetLogProbs`` and ``predict``.
+#
+# sizes
+
+EncoderKeys = namedtuple('EncoderKeys', ['outputs', 'keys', 'mask'])
+
+
+def wordCounts(lang):
+    """Counts in index order, with EOS (once per sentence) as the most frequent."""
+    counts = [lang.word2count.get(lang.index2word[i], 0) for i in range(lang.n_words)]
+    counts[EOS_token] = max(counts) + 1
+    return counts
+
+
+def adaptiveCutoffs(n_words, head=2000, factor=4):
+    cutoffs = []
+    cutoff = min(head, n_words // 4)
+    while 0 < cutoff < n_words // 2:
+        cutoffs.append(cutoff)
+        cutoff *= factor
+    return cutoffs
+
+
+class AttnDecoderRNN(nn.Module):
+    def __init__(self, hidden_size, output_size, dropout_p=0.1, max_length=MAX_LENGTH,
+                 adaptive_cutoffs=None, word_counts=None):
+        print("Att Decoder ")
+        print(hidden_size, output_size)
+        
+        super(AttnDecoderRNN, self).__init__()
+        self.hidden_size = hidden_size
+        self.output_size = output_size
+        self.dropout_p = dropout_p
+        self.max_length = max_length
+
+        self.embedding = nn.Embedding(self.output_size, self.hidden_size)
+        self.fc_hidden = nn.Linear(self.hidden_size, self.hidden_size, bias=False)
+        self.fc_encoder = nn.Linear(self.hidden_size, self.hidden_size, bias=False)
+        self.alignment_vector = nn.Parameter(torch.Tensor(1, hidden_size))
+        torch.nn.init.xavier_uniform_(self.alignment_vector)
+        self.dropout = nn.Dropout(self.dropout_p)
+        self.gru = nn.GRU(self.hidden_size * 2, self.hidden_size)
+        self.adaptive_cutoffs = list(adaptive_cutoffs) if adaptive_cutoffs else None
+        if self.adaptive_cutoffs is None:
+            self.out = nn.Linear(self.hidden_size, self.output_size)
+        else:
+            self.out = nn.AdaptiveLogSoftmaxWithLoss(self.hidden_size, self.output_size,
+                                                     self.adaptive_cutoffs, div_value=4.0)
+            # Word index <-> frequency rank, the order the adaptive softmax needs
+            order = torch.arange(self.output_size)
+            if word_counts is not None:
+                order = torch.argsort(torch.tensor(word_counts), descending=True, stable=True)
+            self.register_buffer('rank_to_word', order)
+            self.register_buffer('word_to_rank', torch.argsort(order))
+
+    # ``encoder_outputs`` is either (length, hidden) for one sentence or
+    # (batch, length, hidden) for a padded batch, in which case ``mask``
+    # marks the real (non-padding) source positions.
+    def encoderKeys(self, encoder_outputs, mask=None):
+        if encoder_outputs.dim() == 2:
+            encoder_outputs = encoder_outputs.unsqueeze(0)
+        return EncoderKeys(encoder_outputs, self.fc_encoder(encoder_outputs), mask)
+
+    def step(self, input, hidden, encoder_outputs, mask=None):
+        if not isinstance(encoder_outputs, EncoderKeys):
+            encoder_outputs = self.encoderKeys(encoder_outputs, mask)
+        encoder_outputs, encoder_keys, mask = encoder_outputs
+        batch_size = encoder_outputs.size(0)
+
+        embedded = self.embedding(input).view(batch_size, -1)
+        embedded = self.dropout(embedded)
+
+        transformed_hidden = self.fc_hidden(hidden[0]).unsqueeze(1)
+        alignment_scores = torch.tanh(transformed_hidden + encoder_keys)
+        alignment_scores = alignment_scores.matmul(self.alignment_vector.T).squeeze(2)
+        if mask is not None:
+            alignment_scores = alignment_scores.masked_fill(~mask, float('-inf'))
+        attn_weights = F.softmax(alignment_scores, dim=1)
+        context_vector = attn_weights.unsqueeze(1).bmm(encoder_outputs).squeeze(1)
+
+        output = torch.cat((embedded, context_vector), 1).unsqueeze(0)
+        output, hidden = self.gru(output, hidden)
+        return output[0], hidden, attn_weights
+
+    # Log probabilities are float32 even under ``mixedPrecision``, so
+    # losses summed from them keep their precision
+    def logProbs(self, output):
+        if self.adaptive_cutoffs is None:
+            return F.log_softmax(self.out(output), dim=1, dtype=torch.float32)
+        return self.out.log_prob(output).float()[:, self.word_to_rank]
+
+    def targetLogProbs(self, output, target):
+        if self.adaptive_cutoffs is None:
+            return self.logProbs(output).gather(1, target.view(-1, 1)).squeeze(1)
+        return self.out(output, self.word_to_rank[target]).output.float()
+
+    def predict(self, output):
+        if self.adaptive_cutoffs is None:
+            return self.out(output).argmax(dim=1)
+        return self.rank_to_word[self.out.predict(output)]
+
+    def forward(self, input, hidden, encoder_outputs, mask=None):
+        output, hidden, attn_weights = self.step(input, hidden, encoder_outputs, mask)
+        return self.logProbs(output), hidden, attn_weights
+
+    def initHidden(self, batch_size=1):
+        return torch.zeros(1, batch_size, self.hidden_size, device=device)
+
+
+######################################################################
+# Tensors
+# -------
+#
+# Word indexes with ``EOS`` appended, as a (length, 1) column for one
+# sentence, or as a padded (max length, batch) tensor plus the true
+# lengths for a batch. Shorter sentences in a batch are padded with
+# ``EOS`` and ``lengthMask`` marks the real positions.
+#
+
+def tensorFromSentence(lang, sentence):
+    indexes = indexesFromSentence(lang, sentence)
+    indexes.append(EOS_token)
+    return torch.tensor(indexes, dtype=torch.long, device=device).view(-1, 1)
+
+
+# The prepared pairs already hold the word indexes, so training can skip
+# splitting and looking up the sentences again.
+def tensorFromIndexes(indexes):
+    indexes = indexes.tolist()
+    indexes.append(EOS_token)
+    return torch.tensor(indexes, dtype=torch.long, device=device).view(-1, 1)
+
+
+def paddedTensorFromIndexes(sequences):
+    indexes = [list(seq) + [EOS_token] for seq in sequences]
+    lengths = torch.tensor([len(idx) for idx in indexes], dtype=torch.long)
+    padded = nn.utils.rnn.pad_sequence(
+        [torch.tensor(idx, dtype=torch.long) for idx in indexes],
+        padding_value=EOS_token)
+    return padded.to(device), lengths.to(device)
+
+
+def paddedTensorFromSentences(lang, sentences):
+    return paddedTensorFromIndexes(
+        [indexesFromSentence(lang, sentence) for sentence in sentences])
+
+
+def lengthMask(lengths, max_len):
+    return torch.arange(max_len, device=lengths.device)[None, :] < lengths[:, None]
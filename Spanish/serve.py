@@ -0,0 +1,84 @@
+"""
+Translating with a saved model
+******************************
+Inference-only entry point: loads a checkpoint written by ``trainIters``
+(see checkpoint.py) and translates, without connecting to Neo4j, training
+TransE or importing matplotlib. Run from the Spanish folder::
+
+    python serve.py translator.pt                      # interactive
+    python serve.py translator.pt "estas a dieta ."    # one-off
+    python serve.py translator.pt --beam 5 < input.txt # one per line
+
+Translations are cached (see translationcache.py); ``--cache FILE`` also
+keeps them in a SQLite file between runs. The startup time (imports and
+checkpoint load) and the cache counters are printed to stderr.
+"""
+import time
+_started = time.perf_counter()
+
+import argparse
+import sys
+
+from checkpoint import loadCheckpoint
+from inference import translate_batch
+from subword import joinWords
+from translationcache import TranslationCache
+
+_imported = time.perf_counter()
+
+
+def loadTranslator(path):
+    state = loadCheckpoint(path)
+    state['encoder'].eval()
+    state['decoder'].eval()
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Translate with a saved checkpoint.')
+    parser.add_argument('checkpoint')
+    parser.add_argument('sentences', nargs='*')
+    parser.add_argument('--beam', type=int, default=1)
+    parser.add_argument('--cache', help='SQLite file to keep translations in')
+    parser.add_argument('--cache-size', type=int, default=10000,
+                        help='translations kept in memory')
+    args = parser.parse_args()
+
+    state = loadTranslator(args.checkpoint)
+    loaded = time.perf_counter()
+    print("Startup %.2fs (imports %.2fs, checkpoint %.2fs)" % (
+        loaded - _started, _imported - _started, loaded - _imported), file=sys.stderr)
+
+    cache = TranslationCache(state['encoder'], state['decoder'],
+                             state['input_lang'], state['output_lang'],
+                             capacity=args.cache_size, path=args.cache)
+
+    def translateNormalized(sentences):
+        results = translate_batch(state['encoder'], state['decoder'],
+                                  state['input_lang'], state['output_lang'],
+                                  sentences, beam_size=args.beam, report=False)
+        return [joinWords(nbest[0][0]) for nbest in results]
+
+    def translate(sentences):
+        return cache.translate(sentences, translateNormalized, options='beam=%d' % args.beam)
+
+    if args.sentences:
+        for output in translate(args.sentences):
+            print(output)
+    elif not sys.stdin.isatty():
+        for output in translate([line.rstrip('\n') for line in sys.stdin]):
+            print(output)
+    else:
+        while True:
+            sentence = input('Enter a sentence to translate (-1 to exit): ')
+            if sentence == "-1":
+                break
+            print('<', translate([sentence])[0])
+            print('')
+    print("Cache: %(hits)d hits (%(disk_hits)d from disk), %(misses)d misses, "
+          "%(evictions)d evictions" % cache.stats(), file=sys.stderr)
+    cache.close()
+
+
+if __name__ == '__main__':
+    main()
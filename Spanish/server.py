@@ -0,0 +1,448 @@
+"""
+Translation server
+******************
+A local HTTP/JSON service for the translator and the TransE word lookup,
+built on asyncio so one process can serve many clients at once. Run from
+the Spanish folder::
+
+    python server.py translator.pt --lookup word_lookup.npz --port 8000
+
+    curl -d '{"sentences": ["estas a dieta ."]}' localhost:8000/translate
+    curl -d '{"words": ["perro"], "k": 3}' localhost:8000/lookup
+    curl localhost:8000/stats
+
+- ``POST /translate`` takes ``{"sentences": [...]}`` (or ``"sentence"``)
+  and returns ``{"translations": [...]}``.
+- ``POST /lookup`` takes ``{"words": [...], "k": 1}`` (or ``"word"``) and
+  returns ``{"results": [...]}``, a list of ``[english_word, distance]``
+  pairs per word, or null for words that are not in the graph.
+- ``GET /stats`` returns p50/p90/p99 latency, the batch-size histogram
+  of each endpoint and the translation cache counters.
+
+Requests are not run one by one. Each endpoint has a ``MicroBatcher``
+that collects the sentences (or words) of concurrent requests for up to
+``--max-delay-ms`` after the first one arrives, or until ``--max-batch``
+of them are waiting, and runs them as one batch on a worker thread. The
+event loop keeps accepting requests meanwhile. ``python benchmarks.py
+serve`` load-tests it.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from inference import translate_batch
+from normalization import cachedNormalizer
+from subword import joinWords
+from translationcache import TranslationCache
+
+
+######################################################################
+# Statistics
+# ----------
+#
+# Latencies are kept for the last ``window`` requests and batch sizes are
+# counted in power-of-two buckets (1, 2, 3-4, 5-8, ...).
+#
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def sizeBucket(size):
+    upper = 1
+    while upper < size:
+        upper *= 2
+    return str(upper) if upper <= 2 else '%d-%d' % (upper // 2 + 1, upper)
+
+
+class ServerStats:
+    def __init__(self, window=10000):
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = Counter()
+        self.requests = 0
+        self.items = 0
+        self.errors = 0
+
+    def addRequest(self, seconds, n_items):
+        self.latencies.append(seconds)
+        self.requests += 1
+        self.items += n_items
+
+    def addBatch(self, size):
+        self.batch_sizes[size] += 1
+
+    def summary(self):
+        latencies = list(self.latencies)
+        histogram = Counter()
+        for size, count in self.batch_sizes.items():
+            histogram[sizeBucket(size)] += count
+        batches = sum(self.batch_sizes.values())
+        return {
+            'requests': self.requests,
+            'items': self.items,
+            'errors': self.errors,
+            'latency_ms': {'p50': percentile(latencies, 50) * 1e3,
+                           'p90': percentile(latencies, 90) * 1e3,
+                           'p99': percentile(latencies, 99) * 1e3},
+            'batches': batches,
+            'mean_batch_size': (sum(size * count for size, count in self.batch_sizes.items())
+                                / batches if batches else 0.0),
+            'batch_size_histogram': dict(sorted(histogram.items(),
+                                                key=lambda item: int(item[0].split('-')[-1]))),
+        }
+
+
+######################################################################
+# Micro-batching
+# --------------
+#
+# ``submit`` queues a request's items and waits for their results. A
+# single task takes requests off the queue: the first one opens a batch,
+# which is closed ``max_delay`` seconds after that request arrived or as
+# soon as it holds ``max_batch`` items, and is then run with ``run(items)``
+# in the executor. Requests that arrive while a batch is running wait in
+# the queue, so under load the next batch is usually full at once and the
+# delay only matters when traffic is light. A request with more than
+# ``max_batch`` items is run as a batch of its own.
+#
+
+_Pending = namedtuple('_Pending', 'items future arrival')
+
+
+class MicroBatcher:
+    def __init__(self, run, executor, max_batch=64, max_delay=0.005, stats=None):
+        self.run = run
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.stats = stats if stats is not None else ServerStats()
+        self.queue = None
+        self._task = None
+
+    async def submit(self, items):
+        loop = asyncio.get_running_loop()
+        if self._task is None:
+            self.queue = asyncio.Queue()
+            self._task = loop.create_task(self._batches())
+        future = loop.create_future()
+        self.queue.put_nowait(_Pending(list(items), future, loop.time()))
+        return await future
+
+    async def _nextBatch(self, loop):
+        pending = [await self.queue.get()]
+        size = len(pending[0].items)
+        deadline = pending[0].arrival + self.max_delay
+        while size < self.max_batch:
+            if self.queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                request = self.queue.get_nowait()
+            pending.append(request)
+            size += len(request.items)
+        return pending
+
+    async def _batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = await self._nextBatch(loop)
+            items = [item for request in pending for item in request.items]
+            try:
+                results = await loop.run_in_executor(self.executor, self.run, items)
+            except Exception as error:
+                for request in pending:
+                    if not request.future.done():
+                        request.future.set_exception(error)
+                continue
+            self.stats.addBatch(len(items))
+            offset = 0
+            for request in pending:
+                n = len(request.items)
+                if not request.future.done():
+                    request.future.set_result(results[offset:offset + n])
+                offset += n
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+######################################################################
+# The service
+# -----------
+#
+# The models are only used from one worker thread, so batches never run
+# concurrently and need no locking; PyTorch and numpy release the GIL
+# while they compute, so the event loop stays responsive. Translations go
+# through a ``TranslationCache`` when one is given.
+#
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+MAX_BODY = 1 << 20
+
+
+def _stringList(payload, many, one):
+    values = payload.get(many)
+    if values is None and isinstance(payload.get(one), str):
+        values = [payload[one]]
+    if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+        raise HTTPError(400, 'expected "%s": a list of strings' % many)
+    return values
+
+
+class TranslationServer:
+    def __init__(self, encoder, decoder, input_lang, output_lang, lookup=None, beam_size=1,
+                 cache=None, max_batch=64, max_delay=0.005):
+        self.encoder, self.decoder = encoder, decoder
+        self.input_lang, self.output_lang = input_lang, output_lang
+        self.lookup = lookup
+        self.beam_size = beam_size
+        self.cache = cache
+        self.normalize = cachedNormalizer()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='translate')
+        self.translator = MicroBatcher(self._translate, self.executor, max_batch, max_delay)
+        self.lookups = MicroBatcher(self._lookup, self.executor, max_batch, max_delay)
+        self.server = None
+        self._connections = set()
+
+    def _translateNormalized(self, sentences):
+        results = translate_batch(self.encoder, self.decoder, self.input_lang, self.output_lang,
+                                  sentences, beam_size=self.beam_size, report=False)
+        return [joinWords(nbest[0][0]) for nbest in results]
+
+    def _translate(self, sentences):
+        if self.cache is None:
+            return self._translateNormalized([self.normalize(s) for s in sentences])
+        return self.cache.translate(sentences, self._translateNormalized,
+                                    options='beam=%d' % self.beam_size)
+
+    def _lookup(self, items):
+        # One search with the largest k of the batch, cut down per request
+        words = [word for word, k in items]
+        results = self.lookup.nearest(words, k=max(k for word, k in items))
+        return [None if result is None else [[word, distance] for word, distance in result[:k]]
+                for result, (word, k) in zip(results, items)]
+
+    def stats(self):
+        stats = {'translate': self.translator.stats.summary(),
+                 'lookup': self.lookups.stats.summary()}
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+        return stats
+
+    async def dispatch(self, method, path, body):
+        if path in ('/translate', '/lookup'):
+            if method != 'POST':
+                raise HTTPError(405, 'use POST')
+            try:
+                payload = json.loads(body or b'{}')
+            except ValueError:
+                raise HTTPError(400, 'body is not JSON')
+            if not isinstance(payload, dict):
+                raise HTTPError(400, 'expected a JSON object')
+            if path == '/translate':
+                return await self._timed(self.translator, 'translations',
+                                         _stringList(payload, 'sentences', 'sentence'))
+            if self.lookup is None:
+                raise HTTPError(404, 'no word lookup loaded, start with --lookup')
+            k = payload.get('k', 1)
+            if not isinstance(k, int) or not 1 <= k <= 100:
+                raise HTTPError(400, '"k" must be an integer from 1 to 100')
+            return await self._timed(self.lookups, 'results',
+                                     [(word, k) for word in _stringList(payload, 'words', 'word')])
+        if path in ('/stats', '/health'):
+            if method != 'GET':
+                raise HTTPError(405, 'use GET')
+            return self.stats() if path == '/stats' else {'status': 'ok'}
+        raise HTTPError(404, 'unknown path %s' % path)
+
+    async def _timed(self, batcher, key, items):
+        start = time.perf_counter()
+        try:
+            results = await batcher.submit(items) if items else []
+        except Exception:
+            batcher.stats.errors += 1
+            raise
+        batcher.stats.addRequest(time.perf_counter() - start, len(items))
+        return {key: results}
+
+    ######################################################################
+    # HTTP/1.1 with keep-alive, just enough for JSON clients: a request
+    # line, headers and a ``Content-Length`` body; no chunked encoding.
+    #
+
+    async def handle(self, reader, writer):
+        self._connections.add(asyncio.current_task())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                connection = headers.get('connection', '').lower()
+                try:
+                    method, target, version = line.decode('latin-1').split()
+                    length = int(headers.get('content-length', 0))
+                    if length < 0:
+                        raise ValueError('negative Content-Length')
+                except ValueError:
+                    method = version = None
+                keep_alive = (connection == 'keep-alive' or
+                              version == 'HTTP/1.1' and connection != 'close')
+
+                if method is None:
+                    # The rest of the stream cannot be trusted after a bad request line
+                    status, payload, keep_alive = 400, {'error': 'malformed request'}, False
+                elif length > MAX_BODY:
+                    status, payload, keep_alive = 413, {'error': 'body larger than %d bytes' % MAX_BODY}, False
+                else:
+                    try:
+                        body = await reader.readexactly(length)
+                        status, payload = 200, await self.dispatch(method, target.split('?')[0], body)
+                    except asyncio.IncompleteReadError:
+                        break
+                    except HTTPError as error:
+                        status, payload = error.status, {'error': str(error)}
+                    except Exception as error:
+                        status, payload = 500, {'error': repr(error)}
+
+                data = json.dumps(payload).encode('utf8')
+                writer.write(b'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\n'
+                             b'Content-Length: %d\r\nConnection: %s\r\n\r\n' % (
+                                 status, REASONS[status].encode(), len(data),
+                                 b'keep-alive' if keep_alive else b'close') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        except asyncio.CancelledError:
+            # The server is stopping; returning normally keeps asyncio from
+            # logging the cancelled connection
+            pass
+        finally:
+            writer.close()
+            self._connections.discard(asyncio.current_task())
+
+    async def start(self, host='127.0.0.1', port=8000):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.translator.close()
+        self.lookups.close()
+        if self.server is not None:
+            self.server.close()
+            for task in list(self._connections):
+                task.cancel()
+            await self.server.wait_closed()
+        self.executor.shutdown()
+
+
+######################################################################
+# A small keep-alive JSON client, for load tests and scripts.
+#
+
+class Client:
+    def __init__(self, host='127.0.0.1', port=8000):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, payload=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = b'' if payload is None else json.dumps(payload).encode('utf8')
+        self.writer.write(b'%s %s HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\n'
+                          b'Content-Length: %d\r\n\r\n' % (
+                              method.encode(), path.encode(), self.host.encode(), len(body)) + body)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            header = await self.reader.readline()
+            if header in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = header.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        data = await self.reader.readexactly(int(headers['content-length']))
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, json.loads(data)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+async def serveForever(server, host, port):
+    port = await server.start(host, port)
+    print("Serving on http://%s:%d" % (host, port))
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve translations and word lookups over HTTP.')
+    parser.add_argument('checkpoint')
+    parser.add_argument('--lookup', help='word lookup saved by WordLookup.save')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--beam', type=int, default=1)
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-delay-ms', type=float, default=5)
+    parser.add_argument('--cache', help='SQLite file to keep translations in')
+    parser.add_argument('--cache-size', type=int, default=10000,
+                        help='translations kept in memory, 0 for no cache')
+    args = parser.parse_args()
+
+    from serve import loadTranslator
+    from wordlookup import WordLookup
+    state = loadTranslator(args.checkpoint)
+    models = (state['encoder'], state['decoder'], state['input_lang'], state['output_lang'])
+    cache = None
+    if args.cache_size > 0:
+        cache = TranslationCache(*models, capacity=args.cache_size, path=args.cache)
+    lookup = WordLookup.load(args.lookup) if args.lookup else None
+    server = TranslationServer(*models, lookup=lookup, beam_size=args.beam, cache=cache,
+                               max_batch=args.max_batch, max_delay=args.max_delay_ms / 1000)
+    try:
+        asyncio.run(serveForever(server, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+Subword vocabularies
+********************
+Byte-pair encoding (Sennrich et al., 2016) over the normalized words, as
+a drop-in replacement for ``Lang``. Starting from single characters, the
+most frequent pair of adjacent symbols in the corpus is merged into a new
+symbol until the vocabulary reaches the requested size. Frequent words
+end up as one symbol and rare words as a few pieces, so the vocabulary
+(and the decoder's output layer) stays at a fixed size and there are no
+unknown words: every character of the alphabet is always in it.
+
+Pieces that do not end a word carry a ``@@`` suffix, as in subword-nmt:
+"hablaste" may become ``habl@@ aste``. ``joinWords`` turns a list of
+pieces back into the words.
+"""
+import heapq
+import json
+from collections import Counter, defaultdict
+
+JOINER = '@@'
+
+# Everything normalizeString can leave in a word
+ALPHABET = 'abcdefghijklmnopqrstuvwxyz.!?'
+
+
+def joinWords(words):
+    sentence = ' '.join(words).replace(JOINER + ' ', '')
+    # A translation can stop in the middle of a word
+    return sentence[:-len(JOINER)] if sentence.endswith(JOINER) else sentence
+
+
+def splitWord(word):
+    return [c + JOINER for c in word[:-1]] + [word[-1:]]
+
+
+def mergeSymbols(a, b):
+    return a[:-len(JOINER)] + b
+
+
+######################################################################
+# Learning the merges
+# -------------------
+#
+# Every distinct word is a list of symbols weighted by its count. Pair
+# counts are kept in a dict with an index from each pair to the words
+# that contain it, so a merge only rewrites the words it touches and
+# updates the counts of their pairs. The most frequent pair comes off a
+# heap; entries whose count has changed since they were pushed are
+# skipped. Ties go to the smallest pair, so training is deterministic.
+#
+
+def learnMerges(word_counts, n_symbols, min_count=2):
+    words = [splitWord(word) for word in word_counts]
+    counts = list(word_counts.values())
+    symbols = sorted({c + JOINER for c in ALPHABET} | set(ALPHABET) |
+                     {symbol for word in words for symbol in word})
+
+    pair_counts = Counter()
+    where = defaultdict(set)
+    for i, word in enumerate(words):
+        for pair in zip(word, word[1:]):
+            pair_counts[pair] += counts[i]
+            where[pair].add(i)
+    heap = [(-count, pair) for pair, count in pair_counts.items()]
+    heapq.heapify(heap)
+
+    merges = []
+    while len(symbols) < n_symbols and heap:
+        count, pair = heapq.heappop(heap)
+        if -count != pair_counts.get(pair):
+            continue
+        if -count < min_count:
+            break
+        merged = mergeSymbols(*pair)
+        merges.append(pair)
+        symbols.append(merged)
+
+        changed = set()
+        for i in where.pop(pair):
+            word, count = words[i], counts[i]
+            if pair not in zip(word, word[1:]):
+                continue
+            for old in zip(word, word[1:]):
+                pair_counts[old] -= count
+                changed.add(old)
+            new, k = [], 0
+            while k < len(word):
+                if k + 1 < len(word) and (word[k], word[k + 1]) == pair:
+                    new.append(merged)
+                    k += 2
+                else:
+                    new.append(word[k])
+                    k += 1
+            for added in zip(new, new[1:]):
+                pair_counts[added] += count
+                where[added].add(i)
+                changed.add(added)
+            words[i] = new
+
+        for changed_pair in changed:
+            if pair_counts[changed_pair] > 0:
+                heapq.heappush(heap, (-pair_counts[changed_pair], changed_pair))
+            else:
+                del pair_counts[changed_pair]
+    return merges, symbols
+
+
+######################################################################
+# SubwordLang
+# -----------
+#
+# Has the same ``name``, ``word2index``, ``index2word``, ``word2count``
+# and ``n_words`` as ``Lang``, with the pieces in place of words and SOS
+# and EOS at 0 and 1. ``encode`` turns a sentence into piece indexes by
+# applying the merges in the order they were learned (lowest rank
+# first), with each distinct word encoded once and cached. Characters
+# outside the vocabulary are dropped. ``addSentence`` counts the pieces
+# of a sentence into ``word2count``.
+#
+# ``vocab_size`` counts SOS and EOS; the characters of the alphabet are
+# always kept, even if that makes the vocabulary larger.
+#
+
+class SubwordLang:
+    def __init__(self, name, merges, words, counts=None):
+        self.name = name
+        self.merges = [tuple(pair) for pair in merges]
+        self.ranks = {pair: rank for rank, pair in enumerate(self.merges)}
+        self.index2word = dict(enumerate(words))
+        self.word2index = {word: i for i, word in enumerate(words) if i >= 2}
+        self.word2count = dict(zip(words[2:], counts[2:] if counts else [0] * len(words)))
+        self.n_words = len(words)
+        self._cache = {}
+
+    @classmethod
+    def train(cls, name, word_counts, vocab_size):
+        merges, symbols = learnMerges(word_counts, vocab_size - 2)
+        return cls(name, merges, ['SOS', 'EOS'] + symbols)
+
+    def encodeWord(self, word):
+        indexes = self._cache.get(word)
+        if indexes is None:
+            symbols = splitWord(word)
+            while len(symbols) > 1:
+                rank, k = min((self.ranks.get(pair, len(self.ranks)), k)
+                              for k, pair in enumerate(zip(symbols, symbols[1:])))
+                if rank == len(self.ranks):
+                    break
+                symbols[k:k + 2] = [mergeSymbols(symbols[k], symbols[k + 1])]
+            indexes = self._cache[word] = [self.word2index[symbol] for symbol in symbols
+                                           if symbol in self.word2index]
+        return indexes
+
+    def encode(self, sentence):
+        indexes = []
+        for word in sentence.split(' '):
+            indexes.extend(self.encodeWord(word))
+        return indexes
+
+    def addSentence(self, sentence):
+        for index in self.encode(sentence):
+            self.word2count[self.index2word[index]] += 1
+
+    def save(self, path):
+        words = [self.index2word[i] for i in range(self.n_words)]
+        with open(path, 'w', encoding='utf8') as f:
+            json.dump({'name': self.name, 'merges': self.merges, 'words': words,
+                       'counts': [0, 0] + [self.word2count[word] for word in words[2:]]}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf8') as f:
+            vocabulary = json.load(f)
+        return cls(vocabulary['name'], vocabulary['merges'], vocabulary['words'], vocabulary['counts'])
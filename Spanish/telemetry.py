@@ -0,0 +1,193 @@
+"""
+Training telemetry
+******************
+Machine-readable progress records for ``trainIters``, to see where the
+training time goes. Every ``every`` iterations one record is appended to
+a JSONL file (or a CSV file, if the path ends in ``.csv``) with:
+
+- ``iter`` and ``elapsed_s``, the seconds since the first step
+- ``loss``: the average loss per target token over the interval
+- ``sentences_per_s`` and ``tokens_per_s`` (target tokens, ``EOS``
+  included)
+- the seconds of the interval spent in each phase of the steps:
+  ``data_s`` waiting for the next pair or batch, ``encoder_s``,
+  ``decoder_s`` (attention, output layer and loss included),
+  ``backward_s`` and ``optimizer_s`` (``zero_grad`` and ``step``), and
+  ``other_s`` for the rest of the loop (reports and checkpoints)
+- ``peak_rss_mb``: the peak resident memory of the process so far
+
+With ``profile_start`` the ``profile_steps`` iterations from that one on
+are recorded by ``torch.profiler`` and written to ``trace_path`` as a
+Chrome trace (open it in chrome://tracing or Perfetto).
+
+Records are appended, so a run resumed from a checkpoint continues the
+same file.
+"""
+import csv
+import json
+import os
+import sys
+import time
+
+import torch
+
+PHASES = ('data', 'encoder', 'decoder', 'backward', 'optimizer')
+FIELDS = (('iter', 'elapsed_s', 'loss', 'sentences_per_s', 'tokens_per_s') +
+          tuple(phase + '_s' for phase in PHASES) + ('other_s', 'peak_rss_mb'))
+
+
+######################################################################
+# Timing the phases
+# -----------------
+#
+# ``lap(phase)`` charges the time since the previous lap (or ``start``)
+# to ``phase``, so the training steps only mark where each phase ends.
+# CUDA kernels run asynchronously, so on a GPU each lap waits for them to
+# finish first. ``train`` and ``trainBatch`` default to ``NO_TIMER``,
+# which does nothing.
+#
+
+class StepTimer:
+    def __init__(self):
+        self.synchronize = torch.cuda.is_available()
+        self.totals = dict.fromkeys(PHASES, 0.0)
+        self.last = None
+
+    def start(self):
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        if self.synchronize:
+            torch.cuda.synchronize()
+        now = time.perf_counter()
+        self.totals[phase] += now - self.last
+        self.last = now
+
+    def reset(self):
+        self.totals = dict.fromkeys(PHASES, 0.0)
+
+
+class _NoTimer:
+    def start(self):
+        pass
+
+    def lap(self, phase):
+        pass
+
+
+NO_TIMER = _NoTimer()
+
+
+def peakRssMB():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+######################################################################
+# The records
+# -----------
+#
+# ``trainIters`` calls ``begin(iter)`` before it fetches an iteration's
+# data, passes ``timer`` to the training step and calls ``end`` with the
+# step's loss, sentences and target tokens after it.
+#
+
+class TrainingTelemetry:
+    def __init__(self, path, every=100, profile_start=None, profile_steps=10,
+                 trace_path='trace.json'):
+        self.path = path
+        self.every = every
+        self.profile_start = profile_start
+        self.profile_steps = profile_steps
+        self.trace_path = trace_path
+        self.timer = StepTimer()
+        self.profiler = None
+        self.file = None
+        self.writer = None
+        self.first = None
+        self.last_iter = None
+        self._resetInterval()
+
+    def _resetInterval(self):
+        self.interval_start = None
+        self.loss_total = 0
+        self.sentences = 0
+        self.tokens = 0
+        self.timer.reset()
+
+    def begin(self, iter):
+        if iter == self.profile_start:
+            from torch.profiler import profile, ProfilerActivity
+            activities = [ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(ProfilerActivity.CUDA)
+            self.profiler = profile(activities=activities)
+            self.profiler.__enter__()
+        now = time.perf_counter()
+        if self.first is None:
+            self.first = now
+        if self.interval_start is None:
+            self.interval_start = now
+        self.timer.start()
+
+    def end(self, iter, loss, sentences, tokens):
+        self.loss_total += loss * tokens
+        self.sentences += sentences
+        self.tokens += tokens
+        self.last_iter = iter
+        if self.profiler is not None and iter == self.profile_start + self.profile_steps - 1:
+            self._stopProfiler()
+        if iter % self.every == 0:
+            self.write(iter)
+
+    def _stopProfiler(self):
+        self.profiler.__exit__(None, None, None)
+        self.profiler.export_chrome_trace(self.trace_path)
+        print("Wrote profiler trace of iterations %d-%d to %s" % (
+            self.profile_start, self.profile_start + self.profile_steps - 1, self.trace_path))
+        self.profiler = None
+
+    def record(self, iter):
+        now = time.perf_counter()
+        seconds = now - self.interval_start
+        record = {
+            'iter': iter,
+            'elapsed_s': round(now - self.first, 3),
+            'loss': round(self.loss_total / max(self.tokens, 1), 4),
+            'sentences_per_s': round(self.sentences / seconds, 2),
+            'tokens_per_s': round(self.tokens / seconds, 2),
+        }
+        for phase in PHASES:
+            record[phase + '_s'] = round(self.timer.totals[phase], 4)
+        record['other_s'] = round(seconds - sum(self.timer.totals.values()), 4)
+        record['peak_rss_mb'] = round(peakRssMB(), 1)
+        return record
+
+    def write(self, iter):
+        if self.interval_start is None:
+            return
+        record = self.record(iter)
+        if self.file is None:
+            exists = os.path.exists(self.path) and os.path.getsize(self.path) > 0
+            self.file = open(self.path, 'a', newline='', encoding='utf8')
+            if self.path.endswith('.csv'):
+                self.writer = csv.DictWriter(self.file, FIELDS)
+                if not exists:
+                    self.writer.writeheader()
+        if self.writer is not None:
+            self.writer.writerow(record)
+        else:
+            self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        self._resetInterval()
+
+    def close(self):
+        if self.profiler is not None:
+            self._stopProfiler()
+        if self.sentences:
+            self.write(self.last_iter)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,538 @@
+"""
+Training
+********
+The training steps for the encoder and attention decoder, one pair at a
+time (``train``) or over length-bucketed mini-batches of a
+``TokenizedPairs`` (see datacache.py), and ``trainIters``, the training
+loop with progress reports and checkpoints. Kept out of the script so
+that worker processes (see parallel.py) can use them.
+"""
+import math
+import os
+import queue
+import random
+import threading
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch import optim
+
+import checkpoint
+from telemetry import NO_TIMER
+from corpus import SOS_token, EOS_token
+from seq2seq import (device, mixedPrecision, tensorFromSentence, tensorFromIndexes,
+                     paddedTensorFromIndexes, lengthMask)
+
+
+######################################################################
+# Preparing Training Data
+# -----------------------
+#
+# To train, for each pair we will need an input tensor (indexes of the
+# words in the input sentence) and target tensor (indexes of the words in
+# the target sentence). While creating these vectors we will append the
+# EOS token to both sequences.
+#
+
+def tensorsFromPair(input_lang, output_lang, pair):
+    input_tensor = tensorFromSentence(input_lang, pair[0])
+    target_tensor = tensorFromSentence(output_lang, pair[1])
+    return (input_tensor, target_tensor)
+
+
+def tensorsFromPairIndex(pairs, i):
+    input_indexes, target_indexes = pairs.indexes(i)
+    return (tensorFromIndexes(input_indexes), tensorFromIndexes(target_indexes))
+
+
+######################################################################
+# Training the Model
+# ------------------
+#
+# To train we run the input sentence through the encoder, and keep track
+# of every output and the latest hidden state. Then the decoder is given
+# the ``<SOS>`` token as its first input, and the last hidden state of the
+# encoder as its first hidden state.
+#
+# "Teacher forcing" is the concept of using the real target outputs as
+# each next input, instead of using the decoder's guess as the next input.
+# Using teacher forcing causes it to converge faster but `when the trained
+# network is exploited, it may exhibit
+# instability <http://citeseerx.ist.psu.edu/viewdoc/download?doi=10.1.1.378.4095&rep=rep1&type=pdf>`__.
+#
+# You can observe outputs of teacher-forced networks that read with
+# coherent grammar but wander far from the correct translation -
+# intuitively it has learned to represent the output grammar and can "pick
+# up" the meaning once the teacher tells it the first few words, but it
+# has not properly learned how to create the sentence from the translation
+# in the first place.
+#
+# Because of the freedom PyTorch's autograd gives us, we can randomly
+# choose to use teacher forcing or not with a simple if statement. Turn
+# ``teacher_forcing_ratio`` up to use more of it.
+#
+# ``timer`` marks where each phase of the step ends (see telemetry.py).
+# With ``mixed_precision`` the forward pass runs under bfloat16 autocast
+# (see ``mixedPrecision`` in seq2seq.py); the backward pass, the weights
+# and the optimizer stay float32.
+#
+
+def train(input_tensor, target_tensor, encoder, decoder, encoder_optimizer, decoder_optimizer, criterion,
+          teacher_forcing_ratio=1, timer=NO_TIMER, mixed_precision=False):
+    encoder_hidden = encoder.initHidden()
+
+    encoder_optimizer.zero_grad()
+    decoder_optimizer.zero_grad()
+    timer.lap('optimizer')
+
+    input_length = input_tensor.size(0)
+    target_length = target_tensor.size(0)
+
+    loss = 0
+
+    # The forward pass and loss, in bfloat16 with ``mixed_precision``
+    with mixedPrecision(mixed_precision):
+        # One output per source word, however long the sentence is
+        encoder_outputs = []
+        for ei in range(input_length):
+            encoder_output, encoder_hidden = encoder(
+                input_tensor[ei], encoder_hidden)
+            encoder_outputs.append(encoder_output[0])
+        encoder_outputs = torch.cat(encoder_outputs)
+        timer.lap('encoder')
+
+        # Attention keys for the source words, computed once per sentence
+        encoder_keys = decoder.encoderKeys(encoder_outputs)
+
+        decoder_input = torch.tensor([[SOS_token]], device=device)
+
+        decoder_hidden = encoder_hidden
+
+        use_teacher_forcing = True if random.random() < teacher_forcing_ratio else False
+
+        if use_teacher_forcing:
+            # Teacher forcing: Feed the target as the next input
+            for di in range(target_length):
+                decoder_output, decoder_hidden, decoder_attention = decoder(
+                    decoder_input, decoder_hidden, encoder_keys)
+                loss += criterion(decoder_output, target_tensor[di])
+                decoder_input = target_tensor[di]  # Teacher forcing
+
+        else:
+            # Without teacher forcing: use its own predictions as the next input
+            for di in range(target_length):
+                decoder_output, decoder_hidden, decoder_attention = decoder(
+                    decoder_input, decoder_hidden, encoder_keys)
+                topv, topi = decoder_output.topk(1)
+                decoder_input = topi.squeeze().detach()  # detach from history as input
+
+                loss += criterion(decoder_output, target_tensor[di])
+
+                if decoder_input.item() == EOS_token:
+                    break
+    timer.lap('decoder')
+
+    loss.backward()
+    timer.lap('backward')
+
+    encoder_optimizer.step()
+    decoder_optimizer.step()
+    timer.lap('optimizer')
+
+    return loss.item() / target_length
+
+
+######################################################################
+# For mini-batch training the pairs are bucketed by length, so that each
+# batch holds sentences of about the same size and little padding is
+# needed. Shorter sentences in a batch are padded with ``EOS`` and the
+# true lengths are kept alongside so the padding can be masked out.
+#
+# ``indices`` restricts the batches to a subset of the pairs, e.g. one
+# worker's shard. ``rng`` is the numpy random generator to shuffle with.
+#
+
+def batchesFromPairs(pairs, batch_size, indices=None, rng=np.random):
+    input_lengths, target_lengths = pairs.lengths()
+    if indices is None:
+        indices = np.arange(len(pairs))
+    input_lengths, target_lengths = input_lengths[indices], target_lengths[indices]
+    # Sort by length, ties broken at random so batches differ per epoch
+    order = indices[np.lexsort((rng.permutation(len(indices)),
+                                target_lengths, input_lengths))].tolist()
+    batches = [order[k:k + batch_size]
+               for k in range(0, len(order), batch_size)]
+    rng.shuffle(batches)
+    return batches
+
+
+def tensorsFromBatch(pairs, batch):
+    indexes = [pairs.indexes(i) for i in batch]
+    input_tensor, input_lengths = paddedTensorFromIndexes(
+        [pair[0].tolist() for pair in indexes])
+    target_tensor, target_lengths = paddedTensorFromIndexes(
+        [pair[1].tolist() for pair in indexes])
+    return input_tensor, input_lengths, target_tensor, target_lengths
+
+
+######################################################################
+# The training loop draws its data from endless iterators that go over
+# the pairs epoch by epoch, so every pair is seen once per pass instead
+# of being sampled with replacement, and that build each step's tensors
+# only when it is asked for: starting to train costs the same however
+# many iterations are run. ``iterPairs`` yields single pairs in a fresh
+# random order every epoch and ``iterBatches`` length-bucketed batches.
+#
+# Each iterator shuffles with its own generator, seeded from numpy's
+# global one when it is created. ``iterPairs`` and ``iterBatches`` draw
+# the seed before they return the generator, not on its first ``next``,
+# so the order is reproducible with ``np.random.seed`` even when a
+# ``Prefetcher`` runs it on another thread.
+#
+
+def _samplerRng():
+    return np.random.default_rng(np.random.randint(2 ** 31))
+
+
+def iterPairs(pairs, indices=None):
+    rng = _samplerRng()
+    if indices is None:
+        indices = np.arange(len(pairs))
+
+    def epochs():
+        while True:
+            for i in rng.permutation(indices).tolist():
+                yield tensorsFromPairIndex(pairs, i)
+    return epochs()
+
+
+def iterBatches(pairs, batch_size, indices=None):
+    rng = _samplerRng()
+
+    def epochs():
+        while True:
+            for batch in batchesFromPairs(pairs, batch_size, indices, rng):
+                yield tensorsFromBatch(pairs, batch)
+    return epochs()
+
+
+######################################################################
+# A ``Prefetcher`` runs such an iterator on a background thread and keeps
+# up to ``depth`` items ready in a queue. PyTorch releases the GIL while
+# it computes, so the next steps' tensors are built while the encoder and
+# decoder run. Errors in the iterator are raised from ``next``; ``close``
+# stops the thread.
+#
+
+class Prefetcher:
+    def __init__(self, iterator, depth=8):
+        self.queue = queue.Queue(depth)
+        self.stopped = threading.Event()
+        self.finished = False
+        self.thread = threading.Thread(target=self._fill, args=(iterator,),
+                                       name='prefetch', daemon=True)
+        self.thread.start()
+
+    def _put(self, entry):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _fill(self, iterator):
+        try:
+            for item in iterator:
+                if not self._put((item, None)):
+                    return
+        except Exception as error:
+            self._put((None, error))
+        else:
+            self._put((None, StopIteration()))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.finished:
+            raise StopIteration
+        item, error = self.queue.get()
+        if error is not None:
+            self.finished = True
+            raise error
+        return item
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+######################################################################
+# The batched version of ``train`` runs the whole padded source batch
+# through the encoder at once and then decodes all sentences in step.
+# Padding positions are masked out of both the attention and the loss.
+#
+# ``batchLoss`` returns the loss summed over all target tokens and the
+# number of tokens. It only asks the decoder for the log probabilities of
+# the targets, which is cheaper with an adaptive softmax output layer.
+# ``trainBatch`` averages it over the batch, so the gradient has the same
+# scale as in ``train``; the value returned is the average loss per
+# target token, like ``train`` returns.
+#
+
+def batchLoss(input_tensor, input_lengths, target_tensor, target_lengths, encoder, decoder,
+              teacher_forcing_ratio=1, timer=NO_TIMER):
+    batch_size = input_tensor.size(1)
+
+    encoder_outputs, encoder_hidden = encoder(
+        input_tensor, encoder.initHidden(batch_size), input_lengths)
+    timer.lap('encoder')
+    encoder_keys = decoder.encoderKeys(
+        encoder_outputs, lengthMask(input_lengths, encoder_outputs.size(1)))
+    target_mask = lengthMask(target_lengths, target_tensor.size(0)).T
+
+    decoder_input = torch.full((batch_size,), SOS_token, dtype=torch.long, device=device)
+    decoder_hidden = encoder_hidden
+    finished = torch.zeros(batch_size, dtype=torch.bool, device=device)
+
+    use_teacher_forcing = True if random.random() < teacher_forcing_ratio else False
+
+    loss = 0
+    n_tokens = 0
+    for di in range(target_tensor.size(0)):
+        decoder_output, decoder_hidden, decoder_attention = decoder.step(
+            decoder_input, decoder_hidden, encoder_keys)
+        step_mask = target_mask[di] & ~finished
+        step_loss = -decoder.targetLogProbs(decoder_output, target_tensor[di])
+        loss = loss + step_loss.masked_fill(~step_mask, 0).sum()
+        n_tokens = n_tokens + step_mask.sum()
+
+        if use_teacher_forcing:
+            decoder_input = target_tensor[di]  # Teacher forcing
+        else:
+            decoder_input = decoder.predict(decoder_output).detach()
+            finished = finished | (decoder_input == EOS_token)
+            if finished.all():
+                break
+    timer.lap('decoder')
+
+    return loss, n_tokens
+
+
+def trainBatch(input_tensor, input_lengths, target_tensor, target_lengths, encoder, decoder,
+               encoder_optimizer, decoder_optimizer, teacher_forcing_ratio=1, timer=NO_TIMER,
+               mixed_precision=False):
+    encoder_optimizer.zero_grad()
+    decoder_optimizer.zero_grad()
+    timer.lap('optimizer')
+
+    with mixedPrecision(mixed_precision):
+        loss, n_tokens = batchLoss(input_tensor, input_lengths, target_tensor, target_lengths,
+                                   encoder, decoder, teacher_forcing_ratio, timer)
+    (loss / input_tensor.size(1)).backward()
+    timer.lap('backward')
+
+    encoder_optimizer.step()
+    decoder_optimizer.step()
+    timer.lap('optimizer')
+
+    return loss.item() / n_tokens.item()
+
+
+######################################################################
+# The whole training process looks like this:
+#
+# -  Start a timer
+# -  Initialize optimizers and criterion
+# -  Start drawing training pairs (``iterPairs``)
+# -  Start empty losses array for plotting
+#
+# Then we call ``train`` many times and occasionally print the progress (%
+# of examples, time so far, estimated time) and average loss.
+#
+# With ``batch_size`` above 1 every iteration is one ``trainBatch`` step
+# over a length-bucketed mini-batch (``iterBatches``) instead of a single
+# pair. Either way the tensors are built ``prefetch`` steps ahead on a
+# background thread; ``prefetch=0`` builds them in the loop instead.
+#
+# With a ``checkpoint_path`` the models, optimizers, vocabularies and the
+# iteration count are saved there every ``save_every`` iterations and at
+# the end. If the file already exists training picks up where it left
+# off, so a run that already reached ``n_iters`` does no training at all.
+#
+# With ``workers`` above 1 the pairs are sharded over that many worker
+# processes which train in data parallel (see parallel.py); every
+# iteration is then one batch of ``batch_size`` per worker.
+#
+# The average losses, one every ``plot_every`` iterations, are returned
+# for ``showPlot`` (see plots.py).
+#
+# A ``telemetry`` (a ``TrainingTelemetry``, see telemetry.py) also gets
+# a record of the loss, throughput, time per phase and memory every few
+# iterations, and can profile a window of them. It is closed at the end.
+# It needs ``workers`` left at 1.
+#
+# ``mixed_precision`` trains with bfloat16 autocast (see ``train``).
+# ``lossParity`` below checks what it does to the loss, and
+# ``configureThreads`` sets the thread pools before training starts.
+#
+
+def trainIters(encoder, decoder, pairs, input_lang, output_lang, n_iters, print_every=1000,
+               plot_every=100, learning_rate=0.01, batch_size=1, checkpoint_path=None,
+               save_every=1000, workers=1, teacher_forcing_ratio=1, prefetch=8, telemetry=None,
+               mixed_precision=False):
+    if workers > 1 and telemetry is not None:
+        raise ValueError("telemetry is only recorded by single-process training")
+    if workers > 1:
+        # Imported here: parallel.py imports this module
+        from parallel import trainParallel
+        result = trainParallel(encoder, decoder, pairs, input_lang, output_lang, n_iters, workers,
+                               print_every, plot_every, learning_rate, batch_size,
+                               teacher_forcing_ratio, checkpoint_path, save_every, mixed_precision)
+        return result['plot_losses'] if result else []
+
+    start = time.time()
+    plot_losses = []
+    print_loss_total = 0  # Reset every print_every
+    plot_loss_total = 0  # Reset every plot_every
+
+    encoder_optimizer = optim.SGD(encoder.parameters(), lr=learning_rate)
+    decoder_optimizer = optim.SGD(decoder.parameters(), lr=learning_rate)
+    done = 0
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        done = checkpoint.resumeTraining(checkpoint_path, encoder, decoder,
+                                         encoder_optimizer, decoder_optimizer,
+                                         input_lang, output_lang)
+        print("Resuming from %s at iteration %d" % (checkpoint_path, done))
+        if done >= n_iters:
+            return plot_losses
+
+    if batch_size > 1:
+        training_data = iterBatches(pairs, batch_size)
+    else:
+        training_data = iterPairs(pairs)
+    if prefetch:
+        training_data = Prefetcher(training_data, prefetch)
+    criterion = nn.NLLLoss()
+    timer = NO_TIMER if telemetry is None else telemetry.timer
+
+    try:
+        for iter in range(done + 1, n_iters + 1):
+            if telemetry is not None:
+                telemetry.begin(iter)
+            if batch_size > 1:
+                input_tensor, input_lengths, target_tensor, target_lengths = next(training_data)
+                timer.lap('data')
+                loss = trainBatch(input_tensor, input_lengths, target_tensor, target_lengths,
+                                  encoder, decoder, encoder_optimizer, decoder_optimizer,
+                                  teacher_forcing_ratio, timer, mixed_precision)
+                n_sentences, n_tokens = input_tensor.size(1), int(target_lengths.sum())
+            else:
+                input_tensor, target_tensor = next(training_data)
+                timer.lap('data')
+
+                loss = train(input_tensor, target_tensor, encoder, decoder,
+                             encoder_optimizer, decoder_optimizer, criterion, teacher_forcing_ratio,
+                             timer, mixed_precision)
+                n_sentences, n_tokens = 1, target_tensor.size(0)
+            if telemetry is not None:
+                telemetry.end(iter, loss, n_sentences, n_tokens)
+            print_loss_total += loss
+            plot_loss_total += loss
+
+            if iter % print_every == 0:
+                print_loss_avg = print_loss_total / print_every
+                print_loss_total = 0
+                print('%s (%d %d%%) %.4f' % (timeSince(start, (iter - done) / (n_iters - done)),
+                                             iter, iter / n_iters * 100, print_loss_avg))
+
+            if iter % plot_every == 0:
+                plot_loss_avg = plot_loss_total / plot_every
+                plot_losses.append(plot_loss_avg)
+                plot_loss_total = 0
+
+            if checkpoint_path and (iter % save_every == 0 or iter == n_iters):
+                checkpoint.saveCheckpoint(checkpoint_path, encoder, decoder, input_lang, output_lang,
+                                          encoder_optimizer, decoder_optimizer, iter)
+    finally:
+        training_data.close()
+        if telemetry is not None:
+            telemetry.close()
+
+    return plot_losses
+
+
+######################################################################
+# Mixed precision and threads
+# ---------------------------
+#
+# ``lossParity`` computes the average loss per target token over
+# ``batches`` (as ``iterBatches`` yields them) with the models as they
+# are, once in float32 and once under bfloat16 autocast, with teacher
+# forcing and dropout off so both see exactly the same inputs. The
+# relative difference should stay within a percent or two.
+#
+
+def lossParity(encoder, decoder, batches):
+    modes = (encoder.training, decoder.training)
+    encoder.eval()
+    decoder.eval()
+    losses = []
+    try:
+        with torch.no_grad():
+            for mixed_precision in (False, True):
+                total = tokens = 0
+                for batch in batches:
+                    with mixedPrecision(mixed_precision):
+                        loss, n_tokens = batchLoss(*batch, encoder, decoder)
+                    total += loss.item()
+                    tokens += n_tokens.item()
+                losses.append(total / tokens)
+    finally:
+        encoder.train(modes[0])
+        decoder.train(modes[1])
+    float32, bfloat16 = losses
+    return float32, bfloat16, abs(bfloat16 - float32) / float32
+
+
+######################################################################
+# PyTorch sizes its intra-op pool (threads inside one operator) to the
+# cores and its inter-op pool (operators run concurrently) likewise.
+# ``configureThreads`` sets either explicitly; the inter-op pool can only
+# be sized before its first use, so call this at the start of a run.
+# Returns the sizes in effect.
+#
+
+def configureThreads(intra_op_threads=None, inter_op_threads=None):
+    if inter_op_threads is not None and inter_op_threads != torch.get_num_interop_threads():
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError as error:
+            raise RuntimeError("inter-op threads must be set before any parallel work "
+                               "has started") from error
+    if intra_op_threads is not None:
+        torch.set_num_threads(intra_op_threads)
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+######################################################################
+# This is a helper function to print time elapsed and estimated time
+# remaining given the current time and progress %.
+#
+
+def asMinutes(s):
+    m = math.floor(s / 60)
+    s -= m * 60
+    return '%dm %ds' % (m, s)
+
+
+def timeSince(since, percent):
+    now = time.time()
+    s = now - since
+    es = s / (percent)
+    rs = es - s
+    return '%s (- %s)' % (asMinutes(s), asMinutes(rs))
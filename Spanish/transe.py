@@ -0,0 +1,116 @@
+"""
+TransE knowledge graph embeddings
+*********************************
+Embeds the (Spanish word, TRANSLATES_TO, English word) triples from Neo4j
+so that ``head + relation ≈ tail``. See
+https://medium.com/stanford-cs224w/simple-schemes-for-knowledge-graph-embedding-dd07c61f3267
+"""
+import time
+
+import torch
+import torch.nn as nn
+from torch import optim
+
+
+class TransE(nn.Module):
+    def __init__(self, num_entities, num_relations, embedding_dim):
+        super(TransE, self).__init__()
+        self.entity_embeddings = nn.Embedding(num_entities, embedding_dim)
+        self.relation_embeddings = nn.Embedding(num_relations, embedding_dim)
+
+    def forward(self, head, relation, tail):
+        h = self.entity_embeddings(head)
+        r = self.relation_embeddings(relation)
+        t = self.entity_embeddings(tail)
+        score = torch.norm(h + r - t, p=2, dim=1)
+        return score
+
+
+######################################################################
+# Negative sampling
+# -----------------
+#
+# Every true triple is paired with a corrupted one where the tail (or
+# the head) is swapped for a random entity. With ``bernoulli`` the side
+# to corrupt is picked per relation as in Wang et al. (2014), the same
+# scheme as torchkge's ``BernoulliNegativeSampler``: for one-to-many
+# relations replacing the head is less likely to produce another true
+# triple, so the head is corrupted with probability tph / (tph + hpt),
+# where tph is the average number of tails per head and hpt the average
+# number of heads per tail.
+#
+
+def bernoulliProbabilities(triples, num_relations):
+    heads, relations, tails = triples.unbind(1)
+    probabilities = torch.full((num_relations,), 0.5)
+    for relation in relations.unique().tolist():
+        chosen = relations == relation
+        tails_per_head = chosen.sum() / heads[chosen].unique().numel()
+        heads_per_tail = chosen.sum() / tails[chosen].unique().numel()
+        probabilities[relation] = tails_per_head / (tails_per_head + heads_per_tail)
+    return probabilities
+
+
+def corruptTriples(heads, relations, tails, num_entities, head_probabilities=None):
+    replacements = torch.randint(num_entities, heads.shape)
+    if head_probabilities is None:
+        return heads, replacements
+    corrupt_head = torch.rand(heads.shape) < head_probabilities[relations]
+    return (torch.where(corrupt_head, replacements, heads),
+            torch.where(corrupt_head, tails, replacements))
+
+
+######################################################################
+# Training
+# --------
+#
+# ``triples`` is one (n, 3) int64 tensor of (head, relation, tail) ids.
+# Each epoch walks a random permutation of it in batches of
+# ``batch_size``, draws ``num_negatives`` corrupted triples per true one
+# in bulk, and takes one optimizer step on the margin ranking loss of the
+# whole batch. The printed loss is summed over triples, like the old
+# one-triple-per-step loop reported it.
+#
+
+def trainTransE(model, triples, num_epochs=10, batch_size=1024, learning_rate=0.01, margin=1.0,
+                num_negatives=1, bernoulli=False, print_every=10):
+    num_entities = model.entity_embeddings.num_embeddings
+    num_relations = model.relation_embeddings.num_embeddings
+    criterion = nn.MarginRankingLoss(margin=margin)
+    optimizer = optim.Adam(model.parameters(), lr=learning_rate)
+    head_probabilities = bernoulliProbabilities(triples, num_relations) if bernoulli else None
+
+    losses = []
+    interval_start = time.time()
+    interval_triples = 0
+    for epoch in range(num_epochs):
+        total_loss = 0.0
+        order = torch.randperm(len(triples))
+
+        for k in range(0, len(triples), batch_size):
+            heads, relations, tails = triples[order[k:k + batch_size]].unbind(1)
+            if num_negatives > 1:
+                heads = heads.repeat(num_negatives)
+                relations = relations.repeat(num_negatives)
+                tails = tails.repeat(num_negatives)
+            corrupted_heads, corrupted_tails = corruptTriples(
+                heads, relations, tails, num_entities, head_probabilities)
+
+            optimizer.zero_grad()
+            positive_score = model(heads, relations, tails)
+            negative_score = model(corrupted_heads, relations, corrupted_tails)
+            target = -torch.ones_like(positive_score)  # Negative target score
+            loss = criterion(positive_score, negative_score, target)
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(heads)
+
+        losses.append(total_loss)
+        interval_triples += len(triples)
+        if (epoch + 1) % print_every == 0:
+            elapsed = time.time() - interval_start
+            print(f"Epoch {epoch+1}/{num_epochs}, Loss: {total_loss:.4f}, "
+                  f"{interval_triples / elapsed:.0f} triples/s")
+            interval_start = time.time()
+            interval_triples = 0
+    return losses
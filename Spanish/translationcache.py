@@ -0,0 +1,191 @@
+"""
+Translation cache
+*****************
+Remembers translations so a sentence that has been translated before is
+not run through the encoder and decoder again.
+
+- Sentences are looked up by their normalized form, so "¿Estás aquí?"
+  and "estas aqui ?" share an entry, together with an ``options`` string
+  for anything else that changes the output (e.g. the beam size).
+- Every entry also carries the id of the model that produced it: a hash
+  of the encoder and decoder weights and both vocabularies. Training
+  steps and ``load_state_dict`` change the weights in place, which
+  changes the id, so stale translations are never returned.
+- The most recently used ``capacity`` entries are kept in memory. With a
+  ``path`` they are also written to a SQLite file, which survives
+  restarts and is shared by every process that opens it; entries found
+  there are copied back into memory.
+
+``stats()`` returns the hit, miss, eviction and invalidation counters.
+"""
+import hashlib
+import json
+import sqlite3
+from collections import OrderedDict
+
+from normalization import cachedNormalizer
+
+
+######################################################################
+# Model ids
+# ---------
+#
+# Hashing every weight takes about 50 ms for the default model, too slow
+# to do on every lookup. PyTorch bumps a tensor's ``_version`` counter
+# whenever it is modified in place, which is how optimizers and
+# ``load_state_dict`` update parameters, so the hash is only recomputed
+# when one of those counters (or the set of tensors) has changed.
+#
+
+class ModelFingerprint:
+    def __init__(self, encoder, decoder, input_lang, output_lang):
+        self.modules = (encoder, decoder)
+        self.langs = (input_lang, output_lang)
+        self._versions = None
+        self._id = None
+
+    def _tensors(self):
+        return [t for module in self.modules for t in module.state_dict(keep_vars=True).values()]
+
+    def __call__(self):
+        tensors = self._tensors()
+        versions = [(id(t), t._version) for t in tensors]
+        if versions != self._versions:
+            digest = hashlib.sha256()
+            for t in tensors:
+                digest.update(t.detach().cpu().contiguous().numpy().tobytes())
+            for lang in self.langs:
+                words = [lang.index2word[i] for i in range(lang.n_words)]
+                digest.update('\n'.join(words).encode('utf8') + b'\0')
+            self._versions = versions
+            self._id = digest.hexdigest()[:16]
+        return self._id
+
+
+######################################################################
+# The cache
+# ---------
+#
+# ``translate`` is the usual entry point: it normalizes the sentences,
+# answers what it can from memory and then from disk, and hands the
+# distinct remaining sentences to ``translate_fn`` in one call, so a
+# batched translator still sees one batch. ``translate_fn`` takes a list
+# of normalized sentences and returns one translation for each; anything
+# JSON can store will do (``evaluate`` gives a list of words).
+#
+# When the model id changes, the memory tier is emptied, since none of it
+# can be hit again. Rows of other models stay on disk, so switching back
+# to an earlier checkpoint finds its translations; ``clear`` drops them.
+#
+
+class TranslationCache:
+    def __init__(self, encoder, decoder, input_lang, output_lang, capacity=10000, path=None):
+        self.modelId = ModelFingerprint(encoder, decoder, input_lang, output_lang)
+        self.capacity = capacity
+        self.normalize = cachedNormalizer()
+        self._entries = OrderedDict()
+        self._model = None
+        self.hits = self.disk_hits = self.misses = self.evictions = self.invalidations = 0
+
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS translations ("
+                            "model TEXT, options TEXT, sentence TEXT, output TEXT, "
+                            "PRIMARY KEY (model, options, sentence))")
+            self.db.commit()
+
+    def _currentModel(self):
+        model = self.modelId()
+        if model != self._model:
+            if self._entries:
+                self.invalidations += 1
+                self._entries.clear()
+            self._model = model
+        return model
+
+    def _remember(self, key, output):
+        self._entries[key] = output
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _fromDisk(self, model, options, sentences):
+        found = {}
+        if self.db is None or not sentences:
+            return found
+        sentences = list(sentences)
+        # Stay under SQLite's limit on the number of bound parameters
+        for k in range(0, len(sentences), 500):
+            chunk = sentences[k:k + 500]
+            rows = self.db.execute(
+                "SELECT sentence, output FROM translations WHERE model = ? AND options = ? "
+                "AND sentence IN (%s)" % ','.join('?' * len(chunk)), [model, options] + chunk)
+            for sentence, output in rows:
+                found[sentence] = json.loads(output)
+        return found
+
+    def translate(self, sentences, translate_fn, options=''):
+        model = self._currentModel()
+        normalized = [self.normalize(s) for s in sentences]
+
+        outputs = {}
+        missing = []
+        for sentence in normalized:
+            key = (options, sentence)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                outputs[sentence] = self._entries[key]
+                self.hits += 1
+            elif sentence not in outputs:
+                outputs[sentence] = None
+                missing.append(sentence)
+            else:
+                self.hits += 1  # Repeated within this call
+
+        found = self._fromDisk(model, options, missing)
+        self.disk_hits += len(found)
+        self.hits += len(found)
+        for sentence, output in found.items():
+            outputs[sentence] = output
+            self._remember((options, sentence), output)
+
+        missing = [sentence for sentence in missing if sentence not in found]
+        self.misses += len(missing)
+        if missing:
+            for sentence, output in zip(missing, translate_fn(missing)):
+                outputs[sentence] = output
+                self._remember((options, sentence), output)
+            if self.db is not None:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)",
+                    [(model, options, sentence, json.dumps(outputs[sentence]))
+                     for sentence in missing])
+                self.db.commit()
+
+        return [outputs[sentence] for sentence in normalized]
+
+    def clear(self):
+        self._entries.clear()
+        if self.db is not None:
+            self.db.execute("DELETE FROM translations")
+            self.db.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'entries': len(self._entries),
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
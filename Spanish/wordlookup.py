@@ -0,0 +1,181 @@
+"""
+Nearest-word lookup over TransE embeddings
+******************************************
+Given a Spanish word, find the English entities whose embeddings are
+closest to it. The English embeddings are kept as one matrix with their
+squared norms precomputed, so a batch of queries is a single matrix
+product:
+
+    ||q - e||² = ||q||² - 2 q·e + ||e||²
+
+For large vocabularies ``buildIVF`` adds an approximate inverted-file
+index: the English embeddings are clustered with k-means, and a query
+only scans the ``nprobe`` clusters whose centroids are closest to it.
+
+``save`` and ``load`` keep the embeddings and word lists in one .npz, so
+the lookup can be served (see server.py) without retraining TransE.
+"""
+import json
+import os
+
+import numpy as np
+
+
+def squaredDistances(queries, vectors, vector_norms):
+    distances = vector_norms[None, :] - 2 * queries @ vectors.T
+    distances += (queries * queries).sum(1)[:, None]
+    return np.maximum(distances, 0, out=distances)
+
+
+def kmeans(vectors, n_clusters, n_iter=10, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignment = squaredDistances(vectors, centroids, (centroids ** 2).sum(1)).argmin(1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    assignment = squaredDistances(vectors, centroids, (centroids ** 2).sum(1)).argmin(1)
+    return centroids, assignment
+
+
+# ``entity2idx`` maps the words that can be looked up to their entity ids
+# and ``idx2entity`` names every entity id; when it is not given it is
+# built from ``entity2idx``.
+class WordLookup:
+    def __init__(self, embeddings, entity2idx, candidate_ids, idx2entity=None):
+        # Reverse index so results resolve to words without a dict scan
+        self.idx2entity = np.empty(len(embeddings), dtype=object)
+        if idx2entity is None:
+            for entity, idx in entity2idx.items():
+                self.idx2entity[idx] = entity
+        else:
+            self.idx2entity[:] = idx2entity
+        self.entity2idx = entity2idx
+        self.embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+
+        self.candidate_ids = np.asarray(candidate_ids, dtype=np.int64)
+        self.candidates = self.embeddings[self.candidate_ids]
+        self.candidate_norms = (self.candidates ** 2).sum(1)
+        self.candidate_position = np.full(len(embeddings), -1, dtype=np.int64)
+        self.candidate_position[self.candidate_ids] = np.arange(len(self.candidate_ids))
+        self.ivf = None
+
+    ######################################################################
+    # Saved as one uncompressed .npz like the graph snapshot: the arrays,
+    # and the word lists as a JSON blob.
+    #
+
+    def save(self, path):
+        header = {
+            'names': self.idx2entity.tolist(),
+            'words': list(self.entity2idx),
+            'ids': [int(i) for i in self.entity2idx.values()],
+        }
+        partial = path + '.partial.npz'
+        np.savez(partial, embeddings=self.embeddings, candidate_ids=self.candidate_ids,
+                 header=np.frombuffer(json.dumps(header).encode('utf8'), dtype=np.uint8))
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            header = json.loads(data['header'].tobytes().decode('utf8'))
+            embeddings, candidate_ids = data['embeddings'], data['candidate_ids']
+        return cls(embeddings, dict(zip(header['words'], header['ids'])), candidate_ids,
+                   header['names'])
+
+    def buildIVF(self, n_clusters=None, nprobe=8, n_iter=10):
+        n_clusters = n_clusters or max(1, int(np.sqrt(len(self.candidates))))
+        centroids, assignment = kmeans(self.candidates, n_clusters, n_iter)
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.zeros(n_clusters + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=n_clusters), out=offsets[1:])
+        self.ivf = {
+            'centroids': centroids,
+            'centroid_norms': (centroids ** 2).sum(1),
+            # Candidates stored cluster by cluster, so each list is a slice
+            'members': order,
+            'vectors': self.candidates[order],
+            'norms': self.candidate_norms[order],
+            'ids': self.candidate_ids[order],
+            'offsets': offsets,
+            'nprobe': min(nprobe, n_clusters),
+        }
+        return self
+
+    ######################################################################
+    # Searching. ``exclude`` holds one entity id per query that must not
+    # be returned (the query word itself, when it is also an English
+    # entity). Results are (entity ids, L2 distances), both (queries, k).
+    #
+
+    def search(self, queries, k=1, exclude=None, approximate=False):
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.embeddings.shape[1])
+        if approximate and self.ivf is not None:
+            return self._searchIVF(queries, k, exclude)
+
+        distances = squaredDistances(queries, self.candidates, self.candidate_norms)
+        if exclude is not None:
+            positions = self.candidate_position[np.asarray(exclude)]
+            excluded = positions >= 0
+            distances[np.flatnonzero(excluded), positions[excluded]] = np.inf
+        return self._topk(distances, self.candidate_ids, k)
+
+    # Queries are grouped by the clusters they probe, so every inverted
+    # list is scanned once with one matrix product for all the queries
+    # that picked it, and merged into each query's running top k.
+    def _searchIVF(self, queries, k, exclude):
+        ivf = self.ivf
+        coarse = squaredDistances(queries, ivf['centroids'], ivf['centroid_norms'])
+        probes = np.argpartition(coarse, ivf['nprobe'] - 1, axis=1)[:, :ivf['nprobe']]
+
+        best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        best = np.full((len(queries), k), np.inf, dtype=np.float32)
+        flat = probes.ravel()
+        by_cluster = np.argsort(flat, kind='stable')
+        bounds = np.searchsorted(flat[by_cluster], np.arange(len(ivf['offsets'])))
+        for cluster in np.unique(flat):
+            rows = by_cluster[bounds[cluster]:bounds[cluster + 1]] // probes.shape[1]
+            start, end = ivf['offsets'][cluster], ivf['offsets'][cluster + 1]
+            if start == end:
+                continue
+            distances = squaredDistances(queries[rows], ivf['vectors'][start:end], ivf['norms'][start:end])
+            ids = np.broadcast_to(ivf['ids'][start:end], distances.shape)
+            if exclude is not None:
+                distances[ids == np.asarray(exclude)[rows, None]] = np.inf
+            merged = np.concatenate((best[rows], distances), 1)
+            merged_ids = np.concatenate((best_ids[rows], ids), 1)
+            top = np.argpartition(merged, k - 1, axis=1)[:, :k]
+            best[rows] = np.take_along_axis(merged, top, 1)
+            best_ids[rows] = np.take_along_axis(merged_ids, top, 1)
+
+        order = np.argsort(best, axis=1)
+        return np.take_along_axis(best_ids, order, 1), np.sqrt(np.take_along_axis(best, order, 1))
+
+    @staticmethod
+    def _topk(distances, candidate_ids, k):
+        k = min(k, distances.shape[1])
+        best = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        best_distances = np.take_along_axis(distances, best, 1)
+        order = np.argsort(best_distances, axis=1)
+        best = np.take_along_axis(best, order, 1)
+        return candidate_ids[best], np.sqrt(np.take_along_axis(best_distances, order, 1))
+
+    def nearest(self, words, k=1, approximate=False):
+        """Closest candidate words for each known word in ``words``.
+
+        Returns one list of ``(word, distance)`` per input word, or None
+        for words that are not in the vocabulary.
+        """
+        known = [word for word in words if word in self.entity2idx]
+        results = {}
+        if known:
+            query_ids = np.array([self.entity2idx[word] for word in known])
+            ids, dists = self.search(self.embeddings[query_ids], k, query_ids, approximate)
+            for word, row_ids, row_dists in zip(known, ids, dists):
+                results[word] = [(self.idx2entity[i], float(d))
+                                 for i, d in zip(row_ids, row_dists) if i >= 0 and np.isfinite(d)]
+        return [results.get(word) for word in words]